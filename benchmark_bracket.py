@@ -0,0 +1,263 @@
+# Benchmark and quality suite for tournament bracket generation
+#
+# Runs create_tournament_bracket on synthetic fields and records how long it
+# takes, how much memory it needs and how well it separates schools and seeds.
+# Results are written as JSON so runs from different commits can be compared:
+#
+#   python benchmark_bracket.py --output before.json
+#   python benchmark_bracket.py --output after.json --compare before.json
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from tournament import create_tournament_bracket, meeting_round
+
+DEFAULT_SIZES = [8, 13, 64, 100, 512, 2000, 4096, 16384, 65536]
+DEFAULT_DISTRIBUTIONS = ['uniform', 'skewed', 'dominant', 'singletons']
+DEFAULT_SEED_COUNTS = [0, 8, 32]
+
+
+def make_field(num_players: int, distribution: str, num_seeds: int, rng: random.Random) -> list[dict]:
+    """
+    Build a synthetic list of players in the shape create_tournament_bracket expects.
+
+    Args:
+        num_players (int): Number of players in the field.
+        distribution (str): How players are spread over schools:
+                            'uniform'    - schools of 8 players,
+                            'skewed'     - school sizes follow a Zipf-like curve,
+                            'dominant'   - one school has 40% of the field, the rest are pairs,
+                            'singletons' - every player comes from a different school.
+        num_seeds (int): Number of seeded players (capped at the field size).
+        rng (random.Random): Random source, so fields are reproducible.
+
+    Returns:
+        list[dict]: Player dictionaries with 'id', 'name', 'school' and 'is_seeded'.
+    """
+    if distribution == 'uniform':
+        schools = [f"school-{i // 8}" for i in range(num_players)]
+    elif distribution == 'skewed':
+        num_schools = max(1, num_players // 6)
+        weights = [1 / (rank + 1) for rank in range(num_schools)]
+        schools = [f"school-{i}" for i in rng.choices(range(num_schools), weights=weights, k=num_players)]
+    elif distribution == 'dominant':
+        big = int(num_players * 0.4)
+        schools = ["school-big"] * big + [f"school-{i // 2}" for i in range(num_players - big)]
+    elif distribution == 'singletons':
+        schools = [f"school-{i}" for i in range(num_players)]
+    else:
+        raise ValueError(f"Unknown school distribution: {distribution}")
+
+    rng.shuffle(schools)
+    seeded = set(rng.sample(range(num_players), min(num_seeds, num_players)))
+    return [
+        {
+            'id': f"player-{i}",
+            'name': f"Player {i}",
+            'school': school,
+            'is_seeded': i in seeded,
+        }
+        for i, school in enumerate(schools)
+    ]
+
+
+def _earliest_meeting(slots: list[int]) -> int | None:
+    """Earliest round in which any two of the given first-round slots can meet."""
+    if len(slots) < 2:
+        return None
+    slots = sorted(slots)
+    # The smallest XOR in a set is always between neighbours in sorted order
+    return min(meeting_round(a, b) for a, b in zip(slots, slots[1:]))
+
+
+def bracket_quality(matches: list[dict], players: list[dict]) -> dict:
+    """
+    Measure how well a generated bracket separates schools and seeds.
+
+    Args:
+        matches (list[dict]): Output of create_tournament_bracket.
+        players (list[dict]): The field the bracket was generated from.
+
+    Returns:
+        dict: first_round_same_school (int), earliest_same_school_round and
+              seed_collision_round (int or None), and the best values any draw
+              could reach for the same field, for reference.
+    """
+    players_by_id = {p['id']: p for p in players}
+    first_round = sorted((m for m in matches if m['round_number'] == 1), key=lambda m: m['match_number'])
+    num_rounds = max((m['round_number'] for m in matches), default=0)
+
+    school_slots = defaultdict(list)
+    seed_slots = []
+    first_round_same_school = 0
+    for m in first_round:
+        base = 2 * (m['match_number'] - 1)
+        p1 = players_by_id.get(m['player1_id'])
+        p2 = players_by_id.get(m['player2_id'])
+        for offset, player in ((0, p1), (1, p2)):
+            if player is None:
+                continue
+            school_slots[player['school']].append(base + offset)
+            if player.get('is_seeded'):
+                seed_slots.append(base + offset)
+        if p1 and p2 and p1['school'] == p2['school']:
+            first_round_same_school += 1
+
+    same_school_rounds = [r for r in map(_earliest_meeting, school_slots.values()) if r is not None]
+    largest_school = max((len(s) for s in school_slots.values()), default=0)
+
+    return {
+        'first_round_same_school': first_round_same_school,
+        'earliest_same_school_round': min(same_school_rounds, default=None),
+        'best_same_school_round': num_rounds - math.ceil(math.log2(largest_school)) + 1 if largest_school > 1 else None,
+        'seed_collision_round': _earliest_meeting(seed_slots),
+        'best_seed_collision_round': num_rounds - math.ceil(math.log2(len(seed_slots))) + 1 if len(seed_slots) > 1 else None,
+        'placed_players': sum(len(s) for s in school_slots.values()),
+    }
+
+
+def run_case(num_players: int, distribution: str, num_seeds: int, repeat: int, rng_seed: int) -> dict:
+    """
+    Benchmark one field configuration.
+
+    Wall time is the best of `repeat` runs without tracing. Peak memory and
+    quality come from one extra run under tracemalloc with the same RNG seed.
+    """
+    field = make_field(num_players, distribution, num_seeds, random.Random(rng_seed))
+
+    timings = []
+    for _ in range(repeat):
+        random.seed(rng_seed)
+        players = [dict(p) for p in field]
+        start = time.perf_counter()
+        create_tournament_bracket('benchmark', players)
+        timings.append(time.perf_counter() - start)
+
+    random.seed(rng_seed)
+    players = [dict(p) for p in field]
+    tracemalloc.start()
+    matches = create_tournament_bracket('benchmark', players)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'num_players': num_players,
+        'distribution': distribution,
+        'num_seeds': min(num_seeds, num_players),
+        'wall_time_ms': round(min(timings) * 1000, 3),
+        'wall_time_ms_median': round(sorted(timings)[len(timings) // 2] * 1000, 3),
+        'peak_memory_kib': round(peak / 1024, 1),
+        'num_matches': len(matches),
+    }
+    result.update(bracket_quality(matches, field))
+    return result
+
+
+def _case_key(result: dict) -> tuple:
+    return (result['num_players'], result['distribution'], result['num_seeds'])
+
+
+def compare_results(current: list[dict], baseline: list[dict], time_tolerance: float, min_time_ms: float = 1.0) -> list[str]:
+    """
+    List regressions of current results against a baseline run.
+
+    A case regresses if it is more than `time_tolerance` (a fraction) slower,
+    pairs more schoolmates in round 1, or lets schoolmates or seeds meet earlier.
+    Cases that now run faster than `min_time_ms` are too noisy to compare on time.
+    """
+    baseline_by_key = {_case_key(r): r for r in baseline}
+    regressions = []
+    for result in current:
+        before = baseline_by_key.get(_case_key(result))
+        if before is None:
+            continue
+        label = "{} players, {}, {} seeds".format(*_case_key(result))
+        if result['wall_time_ms'] >= min_time_ms and result['wall_time_ms'] > before['wall_time_ms'] * (1 + time_tolerance):
+            regressions.append(f"{label}: wall time {before['wall_time_ms']} -> {result['wall_time_ms']} ms")
+        if result['first_round_same_school'] > before['first_round_same_school']:
+            regressions.append(f"{label}: first-round same-school pairings {before['first_round_same_school']} -> {result['first_round_same_school']}")
+        for field in ('earliest_same_school_round', 'seed_collision_round'):
+            if before[field] is not None and result[field] is not None and result[field] < before[field]:
+                regressions.append(f"{label}: {field} {before[field]} -> {result[field]}")
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark create_tournament_bracket on synthetic fields.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Field sizes to run.")
+    parser.add_argument('--distributions', nargs='+', default=DEFAULT_DISTRIBUTIONS,
+                        choices=DEFAULT_DISTRIBUTIONS, help="School-size distributions to run.")
+    parser.add_argument('--seeds', type=int, nargs='+', default=DEFAULT_SEED_COUNTS, help="Seeded player counts to run.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (best is reported).")
+    parser.add_argument('--rng-seed', type=int, default=2025, help="Seed for fields and draws.")
+    parser.add_argument('--output', default=None, help="JSON file to write (default: bracket_benchmark_<commit>.json).")
+    parser.add_argument('--compare', default=None, help="Baseline JSON file to check for regressions.")
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help="Allowed slowdown against the baseline, as a fraction (default 0.25).")
+    parser.add_argument('--min-time-ms', type=float, default=1.0,
+                        help="Ignore time regressions on cases faster than this (default 1 ms).")
+    args = parser.parse_args(argv)
+
+    # Bracket generation logs every run at INFO level; keep the output readable
+    logging.getLogger().setLevel(logging.WARNING)
+
+    commit = _git_commit()
+    # Seed counts are capped at the field size, so small fields can repeat a case
+    cases = dict.fromkeys((n, d, min(s, n)) for n in args.sizes for d in args.distributions for s in args.seeds)
+    results = []
+    for num_players, distribution, num_seeds in cases:
+        result = run_case(num_players, distribution, num_seeds, args.repeat, args.rng_seed)
+        results.append(result)
+        print(f"{num_players:>6} {distribution:<10} seeds={result['num_seeds']:<3} "
+              f"{result['wall_time_ms']:>10.2f} ms {result['peak_memory_kib']:>10.1f} KiB  "
+              f"r1-same={result['first_round_same_school']:<4} "
+              f"school-meet=R{result['earliest_same_school_round']} (best R{result['best_same_school_round']})  "
+              f"seed-meet=R{result['seed_collision_round']} (best R{result['best_seed_collision_round']})")
+
+    report = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rng_seed': args.rng_seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    output = args.output or f"bracket_benchmark_{commit or 'local'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline.get('results', []), args.time_tolerance, args.min_time_ms)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.compare} ({baseline.get('commit')}):")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"No regressions against {args.compare} ({baseline.get('commit')}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
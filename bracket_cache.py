@@ -0,0 +1,242 @@
+# Read-through cache for bracket payloads
+#
+# Spectators poll /api/tournament/<id>/bracket, and every poll used to load
+# all players and matches and rebuild the name join. The assembled payload is
+# kept here, JSON-encoded, per tournament and tagged with the tournament's
+# bracket_version (see storage.BRACKET_VERSION_FIELD). A request still reads
+# the tournament record, but when its version matches the cached one the
+# bracket itself is not loaded again. Writes in any gunicorn worker bump the
+# version in the database, so other workers drop their copy on the next
+# request; writes in this worker also invalidate the entry directly. Each
+# entry also records where the matches changed since the last reset sit in
+# the encoded payload, so ?since=<version> deltas are cut from it directly.
+#
+# Misses are coalesced (single flight): when a round ends and every phone in
+# the hall refreshes at once, concurrent requests for the same tournament and
+# version wait for one load and share its encoded bytes, instead of each
+# running the same queries. This works between the greenlets or threads of
+# a worker; each worker still loads once per version.
+#
+# The cache is bounded by entry count and by the total size of the encoded
+# payloads, evicting least recently used entries first. Entries also expire
+# after a TTL, which limits how long a change made behind the app's back
+# (e.g. in the Firestore console) can go unnoticed. Settings:
+#
+#   BRACKET_CACHE_MAX_ENTRIES   - default 128 tournaments
+#   BRACKET_CACHE_MAX_MB        - default 64 MB of encoded payloads
+#   BRACKET_CACHE_TTL           - seconds, default 300 (0 disables the cache,
+#                                 misses are still coalesced)
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+
+class CachedBracket:
+    """
+    An encoded bracket payload.
+
+    changes holds the (version, start, end) byte range in body of every match
+    stamped after the tournament's last reset, ordered by version. error is
+    the payload's error message, if any.
+    """
+    __slots__ = ('body', 'changes', 'error', '_versions')
+
+    def __init__(self, body: bytes, changes: list[tuple[int, int, int]] | None = None, error: str | None = None):
+        self.body = body
+        self.error = error
+        self.changes = sorted(changes or ())
+        self._versions = [change[0] for change in self.changes]
+
+    @property
+    def size(self) -> int:
+        """Approximate memory use in bytes."""
+        return len(self.body) + 64 * len(self.changes)
+
+    def changed_since(self, version: int) -> list[bytes]:
+        """Encoded matches stamped with a version greater than `version`."""
+        body = self.body
+        return [body[start:end] for _, start, end in self.changes[bisect_right(self._versions, version):]]
+
+
+class _Flight:
+    """A bracket load in progress, waited on by coalesced requests."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.cached = None
+        self.error = None
+
+
+class BracketCache:
+    """Thread-safe LRU cache of encoded bracket payloads, keyed by tournament ID."""
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0,
+                 coalesce_timeout: float = 30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.coalesce_timeout = coalesce_timeout
+        self._entries = OrderedDict() # tournament_id -> (version, CachedBracket, expires_at)
+        self._size = 0
+        self._flights = {} # (tournament_id, version) -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> 'BracketCache':
+        return cls(max_entries=int(environ.get('BRACKET_CACHE_MAX_ENTRIES', 128)),
+                   max_bytes=int(float(environ.get('BRACKET_CACHE_MAX_MB', 64)) * 1024 * 1024),
+                   ttl=float(environ.get('BRACKET_CACHE_TTL', 300)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, tournament_id: str, version: int) -> CachedBracket | None:
+        """
+        Return the cached payload of a tournament if it is current.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            version (int): The tournament's bracket_version as just read from storage.
+
+        Returns:
+            CachedBracket | None: The encoded payload, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(tournament_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_version, cached, expires_at = entry
+            expired = time.monotonic() >= expires_at
+            if cached_version != version or expired:
+                # A request that read an older version (e.g. one that raced a
+                # write) misses but leaves the newer entry in place
+                if cached_version < version or expired:
+                    self._remove(tournament_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(tournament_id)
+            self.hits += 1
+            return cached
+
+    def load(self, tournament_id: str, version: int, loader) -> tuple[dict | None, CachedBracket]:
+        """
+        Return a tournament's payload from the cache, or load it with single flight.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            version (int): The tournament's bracket_version as just read from storage.
+            loader (callable): Builds the payload; returns (payload, CachedBracket,
+                               whether it may be cached).
+
+        Returns:
+            tuple[dict | None, CachedBracket]: The payload and its encoding. The
+                                               payload dict is only returned to the
+                                               request that ran the loader; the
+                                               others get None.
+        """
+        cached = self.get(tournament_id, version)
+        if cached is not None:
+            return None, cached
+
+        key = (tournament_id, version)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                entry = self._entries.get(tournament_id)
+                if entry is not None and entry[0] == version and time.monotonic() < entry[2]:
+                    return None, entry[1] # Stored by a load that just finished
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.loads += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if flight.done.wait(self.coalesce_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return None, flight.cached
+            logging.warning(f"Bracket load for tournament {tournament_id} still running after {self.coalesce_timeout}s, loading separately")
+            payload, cached, _ = loader()
+            return payload, cached
+
+        try:
+            payload, cached, cacheable = loader()
+            flight.cached = cached
+            if cacheable:
+                # Stored before the flight ends, so later requests hit the cache
+                self.put(tournament_id, version, cached)
+            return payload, cached
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def put(self, tournament_id: str, version: int, cached: CachedBracket) -> None:
+        """Store the encoded payload of a tournament at the given version."""
+        if not self.enabled:
+            return
+        if cached.size > self.max_bytes:
+            logging.info(f"Bracket payload of tournament {tournament_id} ({cached.size} bytes) exceeds the cache size, not cached")
+            return
+        with self._lock:
+            current = self._entries.get(tournament_id)
+            if current is not None and current[0] > version:
+                return # A newer version was stored meanwhile
+            self._remove(tournament_id)
+            self._entries[tournament_id] = (version, cached, time.monotonic() + self.ttl)
+            self._size += cached.size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, tournament_id: str) -> None:
+        """Drop the cached payload of a tournament."""
+        with self._lock:
+            self._remove(tournament_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """
+        Counters since startup.
+
+        'hit_ratio' is the share of requests answered from the cache and
+        'coalescing_ratio' the share of misses that waited for another
+        request's load instead of querying storage themselves.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            misses = self.loads + self.coalesced
+            return {'entries': len(self._entries), 'bytes': self._size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'loads': self.loads, 'coalesced': self.coalesced,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                    'coalescing_ratio': round(self.coalesced / misses, 4) if misses else None}
+
+    def _remove(self, tournament_id: str) -> None:
+        entry = self._entries.pop(tournament_id, None)
+        if entry is not None:
+            self._size -= entry[1].size
+
+
+# Cache of this process
+bracket_cache = BracketCache.from_env()
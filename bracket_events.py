@@ -0,0 +1,197 @@
+# Live bracket events (Server-Sent Events)
+#
+# /api/tournament/<id>/events pushes the bracket deltas of
+# tournament.get_tournament_bracket_delta_json to spectator screens as soon
+# as a result is committed. Each process keeps one channel per watched
+# tournament, shared by all of its clients:
+#
+#   - writes made by this process publish to the channel directly;
+#   - writes made by other workers are picked up by one Firestore snapshot
+#     listener on the tournament document, or, for backends without
+#     listeners, by polling the tournament's bracket_version every
+#     SSE_POLL_INTERVAL seconds (default 2).
+#
+# A change is turned into one encoded event and handed to every client, so
+# an idle connection only holds its generator and a position in the
+# channel's short event history. Clients resume with Last-Event-ID (the
+# bracket version they last saw) and get a heartbeat comment every
+# SSE_HEARTBEAT seconds (default 15), which also detects closed connections.
+#
+# The shipped gunicorn config runs gevent workers, where a stream only holds
+# a greenlet; SSE_MAX_CLIENTS caps the streams per process at 900 by default,
+# below the worker's 1000 connections (see gunicorn.conf.py for the capacity
+# of a node). Without gevent (python main.py, or a threaded gunicorn worker)
+# every stream occupies a thread and the default cap is 4, which leaves the
+# other threads to ordinary requests. Clients past the cap get 503 with
+# Retry-After and poll the bracket API with ?since= meanwhile (static/js/main.js).
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+
+from storage import get_repository
+from tournament import get_tournament_bracket_delta_json
+
+HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT', 15))
+POLL_SECONDS = float(os.environ.get('SSE_POLL_INTERVAL', 2))
+RETRY_AFTER_SECONDS = 30 # Suggested to clients refused by the cap
+RETRY_MILLISECONDS = 3000 # Reconnect delay suggested to EventSource
+_HISTORY = 64 # Events kept per channel for clients that fall slightly behind
+
+
+def _uses_gevent() -> bool:
+    """Whether this process runs on gevent (e.g. gunicorn -k gevent), where a stream holds no thread."""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 900 if _uses_gevent() else 4))
+
+
+def _format_event(version: int, data: bytes, event: str = 'delta') -> bytes:
+    return f"id: {version}\nevent: {event}\ndata: ".encode('utf-8') + data + b"\n\n"
+
+
+class _Channel:
+    """Bracket events of one tournament in this process."""
+
+    def __init__(self, tournament_id: str, version: int):
+        self.tournament_id = tournament_id
+        self.version = version
+        self.events = deque(maxlen=_HISTORY) # (since, version, encoded event)
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.closed_event = None # Final event once the tournament is gone
+        self.stop = threading.Event()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Add an event if the tournament's bracket_version moved past the channel's."""
+        with self._refresh_lock:
+            since = self.version
+            try:
+                data = get_tournament_bracket_delta_json(self.tournament_id, since)
+                delta = json.loads(data)
+            except Exception as e:
+                logging.error(f"Error refreshing bracket events for tournament {self.tournament_id}: {e}")
+                return
+            with self.condition:
+                if delta.get('error'):
+                    self.closed_event = _format_event(since, data, event='tournament_error')
+                elif delta['version'] > since:
+                    self.events.append((since, delta['version'], _format_event(delta['version'], data)))
+                    self.version = delta['version']
+                else:
+                    return
+                self.condition.notify_all()
+
+
+class EventHub:
+    """Channels of this process, created for the first client of a tournament and closed after the last."""
+
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.clients = 0
+
+    def publish(self, tournament_id: str) -> None:
+        """Tell this process's clients about a write just committed here (no-op without clients)."""
+        channel = self._channels.get(tournament_id)
+        if channel is not None:
+            # Off the request thread, so the write returns right away
+            threading.Thread(target=channel.refresh, daemon=True).start()
+
+    def stream(self, tournament_id: str, version: int, last_event_id: int | None):
+        """
+        Generate the SSE byte stream for one client.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            version (int): The tournament's current bracket_version.
+            last_event_id (int | None): The version the client already has
+                                        (Last-Event-ID or ?since=); None to
+                                        start from the current version.
+        """
+        channel = self._subscribe(tournament_id, version)
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n".encode('utf-8')
+            client_version = channel.version if last_event_id is None else last_event_id
+            while True:
+                with channel.condition:
+                    if channel.version <= client_version and channel.closed_event is None:
+                        channel.condition.wait(HEARTBEAT_SECONDS)
+                    closed_event = channel.closed_event
+                    current = channel.version
+                    pending = [event for event in channel.events if event[1] > client_version]
+                if closed_event is not None:
+                    yield closed_event
+                    return
+                if current <= client_version:
+                    # Nothing new (or this worker has not caught up with the client yet)
+                    yield b": heartbeat\n\n"
+                elif pending and pending[0][0] == client_version:
+                    # The usual case: the shared events follow on from what the client has
+                    for _, event_version, event in pending:
+                        yield event
+                    client_version = pending[-1][1]
+                else:
+                    # Resumed from an older version, or ahead of this worker's channel
+                    data = get_tournament_bracket_delta_json(tournament_id, client_version)
+                    delta = json.loads(data)
+                    if delta.get('error'):
+                        yield _format_event(client_version, data, event='tournament_error')
+                        return
+                    if delta['version'] != client_version:
+                        yield _format_event(delta['version'], data)
+                        client_version = delta['version']
+                    else:
+                        yield b": heartbeat\n\n"
+        finally:
+            self._unsubscribe(channel)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'clients': self.clients, 'channels': len(self._channels)}
+
+    def _subscribe(self, tournament_id: str, version: int) -> _Channel:
+        with self._lock:
+            channel = self._channels.get(tournament_id)
+            if channel is None:
+                channel = self._channels[tournament_id] = _Channel(tournament_id, version)
+                self._watch(channel)
+            channel.subscribers += 1
+            self.clients += 1
+            return channel
+
+    def _unsubscribe(self, channel: _Channel) -> None:
+        with self._lock:
+            channel.subscribers -= 1
+            self.clients -= 1
+            if channel.subscribers == 0:
+                channel.stop.set()
+                del self._channels[channel.tournament_id]
+                logging.debug(f"Closed bracket event channel for tournament {channel.tournament_id}")
+
+    def _watch(self, channel: _Channel) -> None:
+        """Start listening for writes from other processes."""
+        repo = get_repository()
+        unsubscribe = repo.watch_tournament(channel.tournament_id, channel.refresh) if repo else None
+        if unsubscribe is not None:
+            def stop_listener():
+                channel.stop.wait()
+                unsubscribe()
+            threading.Thread(target=stop_listener, daemon=True).start()
+            return
+
+        def poll():
+            while not channel.stop.wait(POLL_SECONDS):
+                channel.refresh()
+        threading.Thread(target=poll, daemon=True).start()
+
+
+# Hub of this process
+event_hub = EventHub()
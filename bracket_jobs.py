@@ -0,0 +1,476 @@
+# Background bracket generation
+#
+# Drawing a large bracket (best-of-K candidates, thousands of match
+# documents) can outlast gunicorn's request timeout, so
+# POST /tournament/<id>/generate_bracket only queues a job and returns its
+# ID, and GET /api/jobs/<id> reports the job's phase and progress.
+#
+# Jobs are kept in a local SQLite file shared by the gunicorn workers of a
+# node, so a job outlives the request, and the worker, that queued it. Each
+# worker runs runner threads that claim queued jobs; a running job whose
+# heartbeat is older than BRACKET_JOB_STALE seconds (its worker died) is
+# queued again. A tournament has at most one queued or running job, and it
+# keeps showing its previous bracket until the new one is written completely
+# (see Repository.save_bracket).
+#
+# The same file keeps bracket previews: a draft drawn in memory without
+# touching the tournament's matches, stored under a token so that organisers
+# can look at several draws and then commit the one they like. Committing
+# queues an ordinary job that saves exactly the stored draft. Settings:
+#
+#   BRACKET_JOBS_PATH    - job database, default instance/jobs.db
+#   BRACKET_JOB_THREADS  - runner threads per worker, default 1
+#   BRACKET_JOB_STALE    - seconds, default 120
+#   BRACKET_PREVIEW_TTL  - seconds a preview can be committed, default 3600
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+DEFAULT_JOBS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'jobs.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    tournament_id TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    phase TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_tournament ON jobs (tournament_id, status);
+CREATE TABLE IF NOT EXISTS previews (
+    token TEXT PRIMARY KEY,
+    tournament_id TEXT NOT NULL,
+    players_fingerprint TEXT NOT NULL,
+    matches TEXT NOT NULL,
+    players TEXT NOT NULL,
+    stats TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_previews_expires ON previews (expires_at);
+"""
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+_MAX_ATTEMPTS = 3 # Runs of a job whose worker keeps dying before it is marked failed
+_KEEP_FINISHED_SECONDS = 7 * 24 * 3600
+_PROGRESS_INTERVAL = 0.5 # Minimum seconds between progress writes within a phase
+
+# Share of the progress bar given to each phase of a generation job
+_PHASES = {
+    'loading_players': (0, 5),
+    'drawing': (5, 40),
+    'saving': (40, 95),
+    'finishing': (95, 100),
+}
+
+
+def _iso(timestamp: float | None) -> str | None:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+def players_fingerprint(players_list: list[dict]) -> str:
+    """Digest of the fields a draw depends on, to tell whether a preview still fits the players."""
+    digest = hashlib.sha1()
+    for player in sorted(players_list, key=lambda p: p['id']):
+        digest.update(json.dumps([player['id'], player.get('school'), bool(player.get('is_seeded'))]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _row_to_job(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['progress'] = round(job['progress'], 1)
+    job['created_at'] = _iso(job['created_at'])
+    job['updated_at'] = _iso(job['updated_at'])
+    return job
+
+
+class JobQueue:
+    """Persistent queue of bracket generation jobs with runner threads in this process."""
+
+    def __init__(self, path: str, threads: int = 1, stale_seconds: float = 120.0, poll_seconds: float = 1.0,
+                 preview_ttl: float = 3600.0):
+        self.path = path
+        self.threads = max(1, threads)
+        self.stale_seconds = stale_seconds
+        self.preview_ttl = preview_ttl
+        self.poll_seconds = poll_seconds
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> 'JobQueue':
+        return cls(environ.get('BRACKET_JOBS_PATH', DEFAULT_JOBS_PATH),
+                   threads=int(environ.get('BRACKET_JOB_THREADS', 1)),
+                   stale_seconds=float(environ.get('BRACKET_JOB_STALE', 120)),
+                   preview_ttl=float(environ.get('BRACKET_PREVIEW_TTL', 3600)))
+
+    def submit(self, tournament_id: str, params: dict) -> tuple[dict, bool]:
+        """
+        Queue a bracket generation job, unless the tournament already has one.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            params (dict): Generation options ('candidates', 'time_budget').
+
+        Returns:
+            tuple[dict, bool]: The job, and whether it was created (False if an
+                               existing queued or running job was returned).
+        """
+        self.start()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE tournament_id = ? AND status IN (?, ?)",
+                               (tournament_id, QUEUED, RUNNING)).fetchone()
+            if row is not None:
+                return _row_to_job(row), False
+            job_id = secrets.token_hex(8)
+            now = time.time()
+            conn.execute("INSERT INTO jobs (id, kind, tournament_id, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, 'generate_bracket', tournament_id, json.dumps(params), now, now))
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self._wake.set()
+        logging.info(f"Queued bracket generation job {job_id} for tournament {tournament_id}")
+        return _row_to_job(row), True
+
+    def get(self, job_id: str) -> dict | None:
+        self.start()
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def active_job(self, tournament_id: str) -> dict | None:
+        """The queued or running job of a tournament, if any."""
+        row = self._connection().execute("SELECT * FROM jobs WHERE tournament_id = ? AND status IN (?, ?)",
+                                         (tournament_id, QUEUED, RUNNING)).fetchone()
+        return _row_to_job(row) if row else None
+
+    # --- Previews ---
+
+    def save_preview(self, tournament_id: str, matches: list[dict], players_list: list[dict], stats: dict) -> dict:
+        """
+        Store a draft bracket under a new token.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            matches (list[dict]): Output of create_tournament_bracket.
+            players_list (list[dict]): Players the draft was drawn from.
+            stats (dict): Draw quality figures shown with the preview.
+
+        Returns:
+            dict: 'token' and 'expires_at'.
+        """
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        players = {p['id']: {'name': p['name'], 'school': p['school']} for p in players_list}
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM previews WHERE expires_at < ?", (now,))
+            conn.execute("INSERT INTO previews (token, tournament_id, players_fingerprint, matches, players, stats, "
+                         "created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (token, tournament_id, players_fingerprint(players_list), json.dumps(matches),
+                          json.dumps(players, ensure_ascii=False), json.dumps(stats), now, now + self.preview_ttl))
+        logging.info(f"Stored bracket preview {token} for tournament {tournament_id} ({len(matches)} matches)")
+        return {'token': token, 'expires_at': _iso(now + self.preview_ttl)}
+
+    def get_preview(self, token: str, tournament_id: str) -> dict | None:
+        """
+        The unexpired preview stored under a token for this tournament.
+
+        Returns:
+            dict | None: 'token', 'tournament_id', 'players_fingerprint',
+                         'matches', 'players', 'stats', 'created_at' and
+                         'expires_at'; None if unknown or expired.
+        """
+        row = self._connection().execute("SELECT * FROM previews WHERE token = ? AND tournament_id = ? AND expires_at >= ?",
+                                         (token, tournament_id, time.time())).fetchone()
+        if row is None:
+            return None
+        preview = dict(row)
+        for key in ('matches', 'players', 'stats'):
+            preview[key] = json.loads(preview[key])
+        preview['created_at'] = _iso(preview['created_at'])
+        preview['expires_at'] = _iso(preview['expires_at'])
+        return preview
+
+    def delete_preview(self, token: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM previews WHERE token = ?", (token,))
+
+    def start(self) -> None:
+        """Start this process's runner threads (once)."""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                             (SUCCEEDED, FAILED, time.time() - _KEEP_FINISHED_SECONDS))
+            for index in range(self.threads):
+                threading.Thread(target=self._run_forever, name=f"bracket-job-runner-{index}", daemon=True).start()
+            logging.info(f"Started {self.threads} bracket job runner thread(s) on {self.path}")
+
+    # --- Runner ---
+
+    def _run_forever(self) -> None:
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Error claiming bracket job: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _claim(self) -> dict | None:
+        """Mark the oldest queued job (or a stale running one) as running and return it."""
+        now = time.time()
+        with self._transaction() as conn:
+            # Jobs left running by a worker that died
+            conn.execute("UPDATE jobs SET status = ?, phase = ? WHERE status = ? AND updated_at < ? AND attempts < ?",
+                         (QUEUED, QUEUED, RUNNING, now - self.stale_seconds, _MAX_ATTEMPTS))
+            conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                         (FAILED, 'Bracket generation was interrupted repeatedly.', now, RUNNING, now - self.stale_seconds))
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                         (RUNNING, now, row['id']))
+        return _row_to_job(row)
+
+    def _run(self, job: dict) -> None:
+        job_id = job['id']
+        last_write = {'phase': None, 'at': 0.0}
+
+        def report(phase: str, fraction: float = 0.0, message: str | None = None) -> None:
+            """Record progress; fraction is how far along the phase is (0 to 1)."""
+            now = time.monotonic()
+            if phase == last_write['phase'] and now - last_write['at'] < _PROGRESS_INTERVAL and fraction < 1:
+                return
+            last_write.update(phase=phase, at=now)
+            low, high = _PHASES[phase]
+            self._update(job_id, phase=phase, progress=low + (high - low) * min(max(fraction, 0.0), 1.0), message=message)
+
+        # Heartbeat, so other workers don't take a long phase for a dead worker
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.stale_seconds / 4):
+                self._update(job_id)
+
+        logging.info(f"Running bracket generation job {job_id} for tournament {job['tournament_id']}")
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            with _profiling(job):
+                result = run_generation(job['tournament_id'], job['params'], report)
+        except ValueError as e:
+            logging.error(f"Bracket generation job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+            return
+        except Exception as e:
+            logging.exception(f"Bracket generation job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e))
+            return
+        finally:
+            stop.set()
+        self._update(job_id, status=SUCCEEDED, phase='done', progress=100.0,
+                     message=result.pop('message', None), result=json.dumps(result))
+        logging.info(f"Bracket generation job {job_id} finished")
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    # --- Database ---
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def draw_bracket(tournament_id: str, players_list: list[dict], params: dict, on_progress=None) -> tuple[list[dict], dict | None]:
+    """
+    Draw a bracket in memory, without storing anything.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        players_list (list[dict]): Players, as for create_tournament_bracket.
+        params (dict): 'candidates' (best-of-K draws) and 'time_budget' (seconds).
+        on_progress (callable): Optional; called with (candidates finished, candidates requested).
+
+    Returns:
+        tuple[list[dict], dict | None]: The matches and, in best-of-K mode, the
+                                        score of the draw (see generate_best_bracket).
+    """
+    # Imported here: these pull in the storage backend and the process pool
+    from bracket_search import generate_best_bracket
+    from tournament import create_tournament_bracket
+
+    # Optional best-of-K mode: draw several candidates in a process pool and keep the fairest
+    candidates = int(params.get('candidates') or 1)
+    if candidates > 1:
+        return generate_best_bracket(tournament_id, players_list, candidates=candidates,
+                                     time_budget=float(params.get('time_budget') or 5.0), on_progress=on_progress)
+    return create_tournament_bracket(tournament_id, players_list), None
+
+
+def create_preview(tournament_id: str, params: dict) -> dict:
+    """
+    Draw a bracket in memory and store it as a preview; nothing is written to the tournament.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        params (dict): 'candidates' (best-of-K draws) and 'time_budget' (seconds).
+
+    Returns:
+        dict: The draft in the format of get_tournament_bracket, plus
+              'preview': {'token', 'expires_at', 'stats'}. The stats are those
+              of score_bracket (and generate_best_bracket in best-of-K mode)
+              with the number of 'players', 'matches', 'rounds' and 'byes'.
+
+    Raises:
+        NotFoundError: If the tournament does not exist.
+        ValueError: If the tournament has fewer than 2 players.
+    """
+    from bracket_search import score_bracket
+    from storage import NotFoundError, get_repository
+    from tournament import get_bracket_preview
+
+    repo = get_repository()
+    if repo is None:
+        raise RuntimeError('Database connection not available.')
+    if repo.get_tournament(tournament_id) is None:
+        raise NotFoundError(f"Tournament {tournament_id} not found")
+    players_list = repo.list_players(tournament_id)
+    if len(players_list) < 2:
+        raise ValueError('At least 2 players are required to generate a bracket')
+
+    matches, draw_score = draw_bracket(tournament_id, players_list, params)
+    rounds = max(m['round_number'] for m in matches)
+    stats = {'players': len(players_list), 'matches': len(matches), 'rounds': rounds,
+             'byes': (1 << rounds) - len(players_list), **(draw_score or score_bracket(matches, players_list))}
+    stored = job_queue.save_preview(tournament_id, matches, players_list, stats)
+    preview = get_bracket_preview(tournament_id, matches, {p['id']: {'name': p['name'], 'school': p['school']}
+                                                           for p in players_list}, stored['token'])
+    preview['preview'] = {**stored, 'stats': stats}
+    return preview
+
+
+def _profiling(job: dict):
+    """Profile a job queued by a profiled request (see profiler), else do nothing."""
+    if not job['params'].get('profile'):
+        return nullcontext()
+    from profiler import profiler
+    return profiler.profile_block('bracket_job', tournament_id=job['tournament_id'], job_id=job['id'])
+
+
+def run_generation(tournament_id: str, params: dict, report) -> dict:
+    """
+    Draw and store a tournament's bracket; the body of a generation job.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        params (dict): 'candidates' (best-of-K draws) and 'time_budget' (seconds),
+                       or 'preview', the token of a stored draft to save as it is.
+        report (callable): Called with (phase, fraction of the phase done).
+
+    Returns:
+        dict: 'matches' stored, 'draw_score' (best-of-K only) and a 'message' for the user.
+
+    Raises:
+        ValueError: If the tournament is gone, has fewer than 2 players, or
+                    the preview has expired or no longer fits the players.
+    """
+    from bracket_cache import bracket_cache
+    from bracket_events import event_hub
+    from storage import get_repository
+
+    repo = get_repository()
+    if repo is None:
+        raise RuntimeError('Database connection not available.')
+    report('loading_players')
+    if repo.get_tournament(tournament_id) is None:
+        raise ValueError('Tournament not found. It may have been deleted.')
+    players_list = repo.list_players(tournament_id)
+    if len(players_list) < 2:
+        raise ValueError('At least 2 players are required to generate a bracket')
+
+    report('drawing')
+    preview_token = params.get('preview')
+    if preview_token:
+        preview = job_queue.get_preview(preview_token, tournament_id)
+        if preview is None:
+            raise ValueError('Bracket preview not found. It may have expired or been committed already.')
+        if preview['players_fingerprint'] != players_fingerprint(players_list):
+            raise ValueError('Players have changed since the preview was drawn. Please preview the bracket again.')
+        matches = preview['matches']
+        draw_score = preview['stats'] if 'candidates_scored' in preview['stats'] else None
+    else:
+        matches, draw_score = draw_bracket(tournament_id, players_list, params,
+                                           on_progress=lambda done, total: report('drawing', done / total))
+
+    # The tournament keeps its previous bracket until this returns
+    report('saving')
+    repo.save_bracket(tournament_id, matches, players_list,
+                      on_progress=lambda done, total: report('saving', done / max(total, 1)))
+    report('finishing')
+    repo.update_tournament(tournament_id, {'status': 'in_progress'})
+    bracket_cache.invalidate(tournament_id)
+    event_hub.publish(tournament_id)
+    if preview_token:
+        # A preview is saved once; committing it again would wipe the results recorded since
+        job_queue.delete_preview(preview_token)
+
+    if draw_score:
+        earliest = draw_score['earliest_same_school_round']
+        message = (f"Tournament bracket generated successfully (best of {draw_score['candidates_scored']} draws, "
+                   f"schoolmates meet no earlier than round {earliest if earliest else '-'}, "
+                   f"draw seed {draw_score['rng_seed']})")
+    else:
+        message = 'Tournament bracket generated successfully'
+    return {'matches': len(matches), 'draw_score': draw_score, 'message': message}
+
+
+# Queue of this process
+job_queue = JobQueue.from_env()
@@ -0,0 +1,294 @@
+# PDF export of brackets
+#
+# WeasyPrint needs a lot of CPU (seconds for a large bracket) and memory, so
+# it never runs in a request worker: the HTML is rendered from
+# templates/exports/bracket_pdf.html in the request, then laid out by a
+# dedicated process pool that writes the PDF straight into the cache
+# directory. Brackets larger than one sheet are cut into A4 landscape pages
+# of at most ROUNDS_PER_PAGE rounds, each page showing one sub-bracket.
+#
+# Files are cached on disk under the tournament ID and bracket_version (see
+# storage.BRACKET_VERSION_FIELD), so they stay valid until a result or a new
+# bracket changes what the chart shows. Concurrent downloads of the same
+# chart share one render: threads of a worker wait for the same flight, and
+# workers on the node wait on a lock file next to the PDF. Both last until
+# the render finishes, even after the download that started it has timed
+# out, so a slow chart is laid out once. Settings:
+#
+#   PDF_CACHE_DIR       - default instance/pdf_cache
+#   PDF_RENDER_WORKERS  - render processes per worker, default 1
+#   PDF_RENDER_TIMEOUT  - seconds a download waits for a render, default 120
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from storage import BRACKET_VERSION_FIELD
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'pdf_cache')
+CACHE_DIR = os.environ.get('PDF_CACHE_DIR', DEFAULT_CACHE_DIR)
+RENDER_TIMEOUT = float(os.environ.get('PDF_RENDER_TIMEOUT', 120))
+# Rounds per page; a page's first column then holds up to 2 ** (ROUNDS_PER_PAGE - 1) matches
+ROUNDS_PER_PAGE = 5
+
+_pool = None
+_pool_lock = threading.Lock()
+_flights = {} # cache path -> Future of the render
+_flights_lock = threading.Lock()
+
+
+class PdfUnavailableError(RuntimeError):
+    """Raised when this server cannot render PDFs (WeasyPrint or its libraries are missing)."""
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Return the render pool of this worker, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(os.environ.get('PDF_RENDER_WORKERS', 1))
+            _pool = ProcessPoolExecutor(max_workers=max_workers)
+            logging.info(f"Started PDF render pool with {max_workers} processes")
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _render_pdf(html: str, base_url: str, path: str) -> int:
+    """Lay out the HTML and write the PDF to path. Runs inside a pool process."""
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError) as e:
+        # OSError: WeasyPrint is installed but Pango is not
+        raise PdfUnavailableError(f"WeasyPrint is not available: {e}")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    HTML(string=html, base_url=base_url).write_pdf(temp_path)
+    os.replace(temp_path, path) # Readers never see a half-written file
+    return os.path.getsize(path)
+
+
+def round_label(round_number: int, num_rounds: int) -> str:
+    if round_number == num_rounds:
+        return 'Final'
+    if round_number == num_rounds - 1:
+        return 'Semi-finals'
+    if round_number == num_rounds - 2:
+        return 'Quarter-finals'
+    return f'Round {round_number}'
+
+
+def paginate_bracket(rounds: dict, rounds_per_page: int = ROUNDS_PER_PAGE) -> list[dict]:
+    """
+    Cut a bracket into pages of sub-brackets.
+
+    Rounds are grouped in bands of rounds_per_page. Each match in the last
+    round of a band gets a page with the matches leading up to it from the
+    band's earlier rounds, so every page has the same shape.
+
+    Args:
+        rounds (dict): Round number to matches, as in get_tournament_bracket.
+
+    Returns:
+        list[dict]: Pages of {'title', 'rounds': [{'number', 'label', 'matches'}]};
+                    a match missing from the data is None.
+    """
+    if not rounds:
+        return []
+    num_rounds = max(rounds)
+    by_number = {round_number: {match['match_number']: match for match in matches}
+                 for round_number, matches in rounds.items()}
+    pages = []
+    for first in range(1, num_rounds + 1, rounds_per_page):
+        last = min(first + rounds_per_page - 1, num_rounds)
+        sections = 1 << (num_rounds - last)
+        for section in range(sections):
+            page_rounds = []
+            for round_number in range(first, last + 1):
+                count = 1 << (last - round_number) # Matches of this round in one section
+                matches = by_number.get(round_number, {})
+                page_rounds.append({
+                    'number': round_number,
+                    'label': round_label(round_number, num_rounds),
+                    'matches': [matches.get(number) for number in range(section * count + 1, (section + 1) * count + 1)],
+                })
+            title = f'Rounds {first}-{last}' if first != last else round_label(first, num_rounds)
+            if sections > 1:
+                title += f' · Section {section + 1} of {sections}'
+            pages.append({'title': title, 'rounds': page_rounds})
+    return pages
+
+
+def cache_key(tournament: dict, variant: str = '') -> str:
+    """
+    Name of a tournament's chart at its current bracket_version, also usable as an ETag.
+
+    Args:
+        tournament (dict): The tournament record.
+        variant (str): Anything else the PDF depends on, e.g. a digest of the
+                       template, so a redeploy does not serve stale layouts.
+    """
+    # Name, date and status are printed on the chart but don't bump the version
+    details = hashlib.sha1(repr((tournament.get('name'), str(tournament.get('date')), tournament.get('status'),
+                                 variant)).encode('utf-8')).hexdigest()[:10]
+    return f"{tournament['id']}-v{tournament.get(BRACKET_VERSION_FIELD, 0)}-{details}"
+
+
+def cache_path(tournament: dict, variant: str = '') -> str:
+    """Cache file of a tournament's chart (see cache_key)."""
+    return os.path.join(CACHE_DIR, f"{cache_key(tournament, variant)}.pdf")
+
+
+def get_pdf(tournament: dict, build_html, base_url: str, variant: str = '') -> str:
+    """
+    Return the path of the tournament's PDF chart, rendering it if it isn't cached.
+
+    Args:
+        tournament (dict): The tournament record, as read for this request.
+        build_html (callable): Returns the chart's HTML; only called on a miss.
+        base_url (str): Base for relative URLs in the HTML (stylesheets, images).
+        variant (str): See cache_key.
+
+    Raises:
+        TimeoutError: If the render takes longer than PDF_RENDER_TIMEOUT; it
+                      carries on, and a later download finds the file.
+        PdfUnavailableError: If WeasyPrint cannot run on this server.
+    """
+    path = cache_path(tournament, variant)
+    if os.path.exists(path):
+        return path
+
+    deadline = time.monotonic() + RENDER_TIMEOUT
+    with _flights_lock:
+        flight = _flights.get(path)
+        owner = flight is None
+        if owner:
+            flight = _flights[path] = Future()
+    if owner:
+        try:
+            _render_once(tournament['id'], tournament.get(BRACKET_VERSION_FIELD, 0), path, build_html, base_url,
+                         flight, deadline)
+        except BaseException as e:
+            _land(path, flight, exception=e)
+    return flight.result(timeout=max(0.0, deadline - time.monotonic()))
+
+
+def _land(path: str, flight: Future, result: str | None = None, exception: BaseException | None = None) -> None:
+    """End a flight; the next download of this chart starts a new one (or finds the file)."""
+    with _flights_lock:
+        _flights.pop(path, None)
+    if exception is not None:
+        flight.set_exception(exception)
+    else:
+        flight.set_result(result)
+
+
+def _render_once(tournament_id: str, version: int, path: str, build_html, base_url: str, flight: Future,
+                 deadline: float) -> None:
+    """
+    Start rendering into path unless another worker is already doing so, in which case wait for its file.
+
+    The lock file is held, and the flight stays open, until the render
+    finishes, even when the download that started it stops waiting.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_path = f"{path}.lock"
+    while not os.path.exists(path):
+        if _claim(lock_path):
+            try:
+                render = None if os.path.exists(path) else _get_pool().submit(_render_pdf, build_html(), base_url, path)
+            except BaseException:
+                _release(lock_path)
+                raise
+            if render is None:
+                _release(lock_path)
+                break
+            start = time.monotonic()
+            render.add_done_callback(lambda future: _finish(tournament_id, version, path, lock_path, flight, future, start))
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for the PDF of tournament {tournament_id}")
+        time.sleep(0.2)
+    _land(path, flight, result=path)
+
+
+def _claim(lock_path: str) -> bool:
+    """Create the lock file; False if another live process holds it (a dead one's lock is taken over)."""
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+    try:
+        with open(lock_path) as f:
+            holder = f.read()
+        if holder:
+            if int(holder) != os.getpid(): # (On Windows, os.kill would end the process)
+                os.kill(int(holder), 0)
+            return False
+        if time.time() - os.path.getmtime(lock_path) < RENDER_TIMEOUT:
+            return False # Just created; the holder has not written its PID yet
+    except FileNotFoundError:
+        return False # Released meanwhile; claimed on the next try
+    except (ProcessLookupError, ValueError):
+        pass
+    except PermissionError:
+        return False # The holder is alive, under another user
+    _release(lock_path) # Left by a worker that died mid-render
+    return False # Claimed on the next try
+
+
+def _release(lock_path: str) -> None:
+    try:
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+
+def _finish(tournament_id: str, version: int, path: str, lock_path: str, flight: Future, render: Future,
+            start: float) -> None:
+    """Done callback of a render: clean up, release the lock and land the flight."""
+    try:
+        size = render.result()
+        logging.info(f"Rendered PDF of tournament {tournament_id} ({size // 1024} KB) in {time.monotonic() - start:.2f}s")
+    except BaseException as e:
+        if isinstance(e, BrokenProcessPool):
+            # A render process died (e.g. out of memory); start a fresh pool next time
+            _reset_pool()
+        _release(lock_path)
+        _land(path, flight, exception=e)
+        return
+    _remove_older_versions(tournament_id, version)
+    _release(lock_path)
+    _land(path, flight, result=path)
+
+
+def _remove_older_versions(tournament_id: str, version: int) -> None:
+    """
+    Delete the tournament's charts at lower bracket versions, which will not be asked for again.
+
+    Only lower versions: a slow render of an old version may finish after a
+    newer chart was cached, and must leave it alone.
+    """
+    pattern = re.compile(rf"{re.escape(tournament_id)}-v(\d+)-[0-9a-f]+\.pdf")
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match and int(match.group(1)) < version:
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except OSError:
+                pass
@@ -0,0 +1,261 @@
+# Best-of-K bracket generation
+# Placement in create_tournament_bracket is randomized, so some draws separate
+# schools better than others. This module generates several candidates in a
+# process pool, scores them with a vectorized evaluator and keeps the best one.
+#
+# Pool processes are started by a forkserver (spawn where there is none): a
+# forked child of a gunicorn worker would inherit the locks of its runner and
+# gRPC threads. If a pool process dies (e.g. out of memory) the pool is
+# broken for good, so it is dropped, the next draw starts a fresh one, and
+# the candidates it lost are drawn in this process instead. Settings:
+#
+#   BRACKET_POOL_WORKERS - candidate processes per worker, default min(4, CPUs)
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from tournament import create_tournament_bracket
+
+MAX_CANDIDATES = 64
+MAX_TIME_BUDGET = 30.0 # seconds
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Return the process pool shared by all requests of this worker, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(os.environ.get('BRACKET_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+            logging.info(f"Started bracket candidate pool with {max_workers} processes ({start_method})")
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next draw starts a fresh one (unless another thread already has)."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def _meetings_per_round(slots: np.ndarray, groups: np.ndarray, num_rounds: int) -> np.ndarray:
+    """
+    Count pairs from the same group by the round in which they can first meet.
+
+    Args:
+        slots (np.ndarray): First-round slot of each player.
+        groups (np.ndarray): Group code (e.g. school) of each player, same length.
+        num_rounds (int): Number of rounds in the bracket.
+
+    Returns:
+        np.ndarray: Entry r - 1 is the number of same-group pairs meeting first in round r.
+    """
+    pairs_within = np.zeros(num_rounds + 1, dtype=np.int64)
+    if len(slots) < 2:
+        return np.diff(pairs_within)
+
+    # Sorting by (group, slot) once keeps every subtree of every group contiguous
+    order = np.lexsort((slots, groups))
+    slots = slots[order]
+    groups = groups[order]
+    total_slots = 1 << num_rounds
+    for r in range(1, num_rounds + 1):
+        keys = groups * (total_slots >> r) + (slots >> r)
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        counts = np.diff(np.append(starts, len(keys)))
+        pairs_within[r] = int((counts * (counts - 1) // 2).sum())
+    return np.diff(pairs_within)
+
+
+def score_bracket(matches: list[dict], players: list[dict]) -> dict:
+    """
+    Score a generated bracket on school and seed separation. Lower penalty is better.
+
+    Every pair of players from the same school, and every pair of seeds, that can
+    meet in a round counts as a clash in that round. Brackets are compared by
+    'clashes_by_round', earliest round first, so one first-round clash outweighs
+    any number of clashes a round later. 'penalty' summarises the same counts
+    with weights growing fourfold per earlier round, for logs; it does not give
+    that strict order (four second-round clashes weigh as much as one in the
+    first round).
+
+    Args:
+        matches (list[dict]): Output of create_tournament_bracket.
+        players (list[dict]): Players the bracket was generated from.
+
+    Returns:
+        dict: 'penalty' (float), 'clashes_by_round' (list[int], school and seed
+              clashes in each round), 'first_round_same_school' (int),
+              'earliest_same_school_round' and 'seed_collision_round' (int or None),
+              'same_school_meetings' (list[int], pairs first meeting in each round).
+    """
+    players_by_id = {p['id']: p for p in players}
+    first_round = [m for m in matches if m['round_number'] == 1]
+    num_rounds = (2 * len(first_round)).bit_length() - 1
+
+    school_codes = {}
+    slots, schools, seeds = [], [], []
+    for m in first_round:
+        base = 2 * (m['match_number'] - 1)
+        for offset, key in ((0, 'player1_id'), (1, 'player2_id')):
+            player = players_by_id.get(m.get(key))
+            if player is None:
+                continue
+            slots.append(base + offset)
+            schools.append(school_codes.setdefault(player['school'], len(school_codes)))
+            seeds.append(bool(player.get('is_seeded')))
+
+    slots = np.asarray(slots, dtype=np.int64)
+    schools = np.asarray(schools, dtype=np.int64)
+    seeds = np.asarray(seeds, dtype=bool)
+
+    school_meetings = _meetings_per_round(slots, schools, num_rounds)
+    seed_meetings = _meetings_per_round(slots[seeds], np.zeros(int(seeds.sum()), dtype=np.int64), num_rounds)
+    weights = 4.0 ** np.arange(num_rounds - 1, -1, -1)
+
+    def earliest(meetings):
+        rounds = np.flatnonzero(meetings)
+        return int(rounds[0]) + 1 if len(rounds) else None
+
+    return {
+        'penalty': float(school_meetings @ weights + seed_meetings @ weights),
+        'clashes_by_round': (school_meetings + seed_meetings).tolist(),
+        'first_round_same_school': int(school_meetings[0]) if num_rounds else 0,
+        'earliest_same_school_round': earliest(school_meetings),
+        'seed_collision_round': earliest(seed_meetings),
+        'same_school_meetings': school_meetings.tolist(),
+    }
+
+
+def _rank(score: dict) -> tuple:
+    """Sort key for candidates: fewest clashes in the earliest round, then the lowest RNG seed."""
+    return tuple(score['clashes_by_round']), score['rng_seed']
+
+
+def _generate_candidate(tournament_id: str, players: list[dict], rng_seed: int) -> tuple[list[dict], dict]:
+    """Generate and score one candidate bracket. Runs inside a pool process."""
+    random.seed(rng_seed)
+    matches = create_tournament_bracket(tournament_id, players)
+    score = score_bracket(matches, players)
+    score['rng_seed'] = rng_seed
+    return matches, score
+
+
+def _generate_in_process(tournament_id: str, players: list[dict], seeds: list[int], deadline: float,
+                         on_progress=None) -> list[tuple[list[dict], dict]]:
+    """Draw candidates one after another in this process until the deadline (at least one)."""
+    results = []
+    state = random.getstate() # _generate_candidate reseeds the module RNG, which this process shares
+    try:
+        for count, seed in enumerate(seeds, start=1):
+            if count > 1 and time.monotonic() > deadline:
+                break
+            try:
+                results.append(_generate_candidate(tournament_id, players, seed))
+            except Exception as e:
+                logging.error(f"Bracket candidate failed for tournament {tournament_id}: {e}")
+            if on_progress:
+                on_progress(count)
+    finally:
+        random.setstate(state)
+    return results
+
+
+def generate_best_bracket(tournament_id: str, players_list: list[dict], candidates: int = 8,
+                          time_budget: float = 5.0, base_seed: int | None = None,
+                          on_progress=None) -> tuple[list[dict], dict]:
+    """
+    Generate several candidate brackets in parallel and return the best one.
+
+    Candidate i is drawn with RNG seed base_seed + i, so any result can be
+    reproduced. Candidates still running when the time budget is spent are
+    dropped, but at least one candidate is always waited for. If the pool
+    breaks, the candidates it lost are drawn in this process, one at a time
+    within the time budget (at least one).
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        players_list (list[dict]): Players, as for create_tournament_bracket.
+        candidates (int): Number of candidates to draw (1 to MAX_CANDIDATES).
+        time_budget (float): Seconds to wait for candidates (capped at MAX_TIME_BUDGET).
+        base_seed (int | None): First RNG seed; a random one is picked if None.
+        on_progress (callable): Optional; called with (candidates finished,
+                                candidates requested) as candidates complete.
+
+    Returns:
+        tuple[list[dict], dict]: The best match list and its score, which also
+                                 carries 'rng_seed', 'candidates_scored' and
+                                 'candidates_requested'.
+    """
+    candidates = max(1, min(int(candidates), MAX_CANDIDATES))
+    time_budget = max(0.0, min(float(time_budget), MAX_TIME_BUDGET))
+    if base_seed is None:
+        base_seed = random.SystemRandom().randrange(2 ** 31)
+
+    start = time.monotonic()
+    deadline = start + time_budget
+    seeds = [base_seed + i for i in range(candidates)]
+    pool = _get_pool()
+    try:
+        futures = {pool.submit(_generate_candidate, tournament_id, players_list, seed): seed for seed in seeds}
+    except BrokenProcessPool:
+        futures = {}
+
+    done, not_done = set(), set(futures)
+    while not_done:
+        finished, not_done = wait(not_done, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not finished:
+            break
+        done |= finished
+        if on_progress:
+            on_progress(len(done), candidates)
+    if futures and not done:
+        # Nothing finished in time; take whichever candidate finishes first
+        done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+    for future in not_done:
+        future.cancel()
+
+    results = []
+    lost_seeds = [] if futures else seeds
+    for future in done:
+        try:
+            results.append(future.result())
+        except BrokenProcessPool:
+            lost_seeds.append(futures[future])
+        except Exception as e:
+            logging.error(f"Bracket candidate failed for tournament {tournament_id}: {e}")
+    if lost_seeds:
+        # A pool process died; this pool is unusable from now on
+        _reset_pool(pool)
+        logging.warning(f"Bracket candidate pool broke; drawing {len(lost_seeds)} candidate(s) "
+                        f"for tournament {tournament_id} in this process")
+        finished = len(done) - len(lost_seeds)
+        progress = (lambda count: on_progress(finished + count, candidates)) if on_progress else None
+        results += _generate_in_process(tournament_id, players_list, sorted(lost_seeds), deadline, progress)
+
+    best_matches, best_score = None, None
+    for matches, score in results:
+        if best_score is None or _rank(score) < _rank(best_score):
+            best_matches, best_score = matches, score
+
+    if best_score is None:
+        raise RuntimeError("All bracket candidates failed")
+
+    best_score['candidates_scored'] = len(results)
+    best_score['candidates_requested'] = candidates
+    logging.info(f"Picked bracket candidate seed {best_score['rng_seed']} for tournament {tournament_id} "
+                 f"(penalty {best_score['penalty']:.0f}, {len(results)}/{candidates} candidates "
+                 f"in {time.monotonic() - start:.2f}s)")
+    return best_matches, best_score
@@ -0,0 +1,530 @@
+# Single-document bracket storage for Firestore
+#
+# Instead of one document per match, the whole bracket of a tournament (the
+# heap-ordered arrays of models.Bracket plus a player name/school table) is
+# kept in brackets/{tournament_id}. Loading a bracket then costs one read and
+# entering a result one transaction on one or two documents.
+#
+# Large brackets are split by subtree so no document gets near Firestore's
+# 1 MiB limit: with 2**shard_bits shards, the matches above the shard roots
+# stay in the main document, and shard k holds the whole subtree under match
+# node 2**shard_bits + k (plus the players drawn into it) in
+# brackets/{tournament_id}/shards/{k}. A result update touches the main
+# document (for the version) and at most one shard, plus the tournament
+# document for its bracket_version.
+import json
+import logging
+import os
+import sys
+from array import array
+from bisect import bisect_right
+
+from google.cloud import firestore
+from google.api_core.exceptions import NotFound
+
+from models import Bracket, STATUS_COMPLETED
+from storage import BRACKET_VERSION_FIELD, CHAMPION_ID_FIELD, CHAMPION_NAME_FIELD, COMPLETED_MATCHES_FIELD, count_change
+
+STORAGE_FIELD = 'bracket_storage' # Field on the tournament document
+SINGLE_DOCUMENT = 'single'
+MATCH_DOCUMENTS = 'documents'
+
+# Keep every stored document comfortably below the 1 MiB limit
+SHARD_TARGET_BYTES = 700 * 1024
+_BYTES_PER_NODE = 17 # 4 x int32 (players, winner, version) + status byte
+
+
+def default_storage_mode() -> str:
+    """Storage mode for newly generated brackets, from the BRACKET_STORAGE environment variable."""
+    mode = os.environ.get('BRACKET_STORAGE', MATCH_DOCUMENTS)
+    return SINGLE_DOCUMENT if mode == SINGLE_DOCUMENT else MATCH_DOCUMENTS
+
+
+def uses_single_document(tournament_data: dict | None) -> bool:
+    return bool(tournament_data) and tournament_data.get(STORAGE_FIELD) == SINGLE_DOCUMENT
+
+
+# --- Match IDs ---
+# Matches have no documents of their own, so their API IDs encode the
+# tournament and heap node. Firestore auto IDs never contain a '.'.
+
+def match_id(tournament_id: str, node: int) -> str:
+    return f"{tournament_id}.{node}"
+
+
+def parse_match_id(value: str) -> tuple[str, int] | None:
+    """Return (tournament_id, node) for a single-document match ID, or None for a match document ID."""
+    tournament_id, sep, node = value.rpartition('.')
+    if not sep or not tournament_id or not node.isdigit():
+        return None
+    return tournament_id, int(node)
+
+
+# --- Encoding ---
+
+def _pack(values) -> bytes:
+    packed = array('i', values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(data: bytes) -> array:
+    values = array('i')
+    values.frombytes(bytes(data))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _shard_bits_for(num_rounds: int, players_bytes: int) -> int:
+    """Smallest number of shard bits that keeps each shard under SHARD_TARGET_BYTES."""
+    total = _BYTES_PER_NODE * (1 << num_rounds) + players_bytes
+    bits = 0
+    while total >> bits > SHARD_TARGET_BYTES and bits < num_rounds - 1:
+        bits += 1
+    return bits
+
+
+def _part_nodes(num_rounds: int, shard_bits: int, part: int | None):
+    """
+    Yield (global_start, local_start, length) runs of the match nodes in one part.
+
+    part None is the top of the tree (nodes above the shard roots); part k is
+    the subtree rooted at node 2**shard_bits + k, numbered as its own heap.
+    """
+    if part is None:
+        if shard_bits:
+            yield 1, 1, (1 << shard_bits) - 1
+        return
+    root = (1 << shard_bits) + part
+    for depth in range(num_rounds - shard_bits):
+        yield root << depth, 1 << depth, 1 << depth
+
+
+def _locate(node: int, shard_bits: int) -> tuple[int | None, int]:
+    """Return (part, local index) of a match node."""
+    depth = node.bit_length() - 1
+    if depth < shard_bits:
+        return None, node
+    below = depth - shard_bits
+    root = node >> below
+    return root - (1 << shard_bits), node - ((root - 1) << below)
+
+
+class _Part:
+    """
+    Decoded arrays of one stored part, in its local heap numbering.
+
+    'versions' (the bracket_version stamp of each match) is only stored once
+    a result has been entered in the part; until then every stamp is 0.
+    """
+    __slots__ = ('player1', 'player2', 'winner', 'status', 'versions')
+
+    def __init__(self, data: dict):
+        self.player1 = _unpack(data['player1'])
+        self.player2 = _unpack(data['player2'])
+        self.winner = _unpack(data['winner'])
+        self.status = bytearray(data['status'])
+        self.versions = _unpack(data['versions']) if data.get('versions') else array('i', [0]) * len(self.status)
+
+    def encode(self) -> dict:
+        return {
+            'player1': _pack(self.player1),
+            'player2': _pack(self.player2),
+            'winner': _pack(self.winner),
+            'status': bytes(self.status),
+            'versions': _pack(self.versions),
+        }
+
+
+# --- Saving and loading ---
+
+def save_bracket(db, tournament_id: str, bracket: Bracket, players: dict) -> int:
+    """
+    Store a bracket in single-document form, replacing any previous one.
+
+    Args:
+        db: Firestore client.
+        tournament_id (str): The ID of the tournament.
+        bracket (Bracket): The bracket to store.
+        players (dict): Player ID -> player dict with 'name' and 'school'.
+
+    Returns:
+        int: The new bracket version.
+    """
+    num_rounds = bracket.num_rounds
+    total_slots = bracket.total_slots
+
+    # Renumber players in first-round slot order, so the players of every
+    # subtree (and so every shard) form one contiguous block of codes
+    order = []
+    renumber = {-1: -1}
+    half = total_slots >> 1
+    for node in range(half, total_slots):
+        for code in (bracket.player1[node], bracket.player2[node]):
+            if code >= 0 and code not in renumber:
+                renumber[code] = len(order)
+                order.append(code)
+    for column in (bracket.player1, bracket.player2, bracket.winner):
+        for code in column:
+            if code not in renumber:
+                renumber[code] = len(order)
+                order.append(code)
+
+    def player_row(code):
+        player_id = bracket.player_ids[code]
+        info = players.get(player_id, {})
+        return [player_id, info.get('name', 'Unknown'), info.get('school', '')]
+
+    player_rows = [player_row(code) for code in order]
+    players_bytes = len(json.dumps(player_rows, ensure_ascii=False).encode('utf-8'))
+    shard_bits = _shard_bits_for(num_rounds, players_bytes)
+    num_shards = 1 << shard_bits
+
+    def encode_part(part):
+        size = (1 << shard_bits) if part is None else (1 << (num_rounds - shard_bits))
+        player1 = [-1] * size
+        player2 = [-1] * size
+        winner = [-1] * size
+        status = bytearray(size)
+        for start, local, length in _part_nodes(num_rounds, shard_bits, part):
+            for offset in range(length):
+                node = start + offset
+                player1[local + offset] = renumber[bracket.player1[node]]
+                player2[local + offset] = renumber[bracket.player2[node]]
+                winner[local + offset] = renumber[bracket.winner[node]]
+                status[local + offset] = bracket.status[node]
+        return {'player1': _pack(player1), 'player2': _pack(player2), 'winner': _pack(winner), 'status': bytes(status)}
+
+    # Codes follow slot order, so shard k owns the codes of the players drawn
+    # into its first-round matches; the last shard also keeps any player that
+    # only appears in later rounds
+    boundaries = [0]
+    matches_per_shard = half >> shard_bits
+    for part in range(num_shards):
+        start = half + part * matches_per_shard
+        boundaries.append(boundaries[-1] + sum(
+            (bracket.player1[node] >= 0) + (bracket.player2[node] >= 0)
+            for node in range(start, start + matches_per_shard)))
+    boundaries[-1] = len(player_rows)
+
+    def part_players(part):
+        first, last = boundaries[part], boundaries[part + 1]
+        return first, player_rows[first:last]
+
+    main_ref = db.collection('brackets').document(tournament_id)
+    previous = main_ref.get()
+    previous_data = previous.to_dict() if previous.exists else {}
+    version = int(previous_data.get('version', 0)) + 1
+    previous_shards = int(previous_data.get('shard_count', 1))
+
+    main_data = {
+        'tournament_id': tournament_id,
+        'version': version,
+        'num_rounds': num_rounds,
+        'shard_bits': shard_bits,
+        'shard_count': num_shards,
+        'code_offsets': boundaries, # First player code of each shard, plus the total
+    }
+    batch = db.batch()
+    if shard_bits == 0:
+        offset, rows = part_players(0)
+        main_data.update(encode_part(0))
+        main_data.update({'code_offset': offset, 'players': json.dumps(rows, ensure_ascii=False).encode('utf-8')})
+    else:
+        main_data.update(encode_part(None))
+        for part in range(num_shards):
+            offset, rows = part_players(part)
+            shard_data = encode_part(part)
+            shard_data.update({'code_offset': offset, 'players': json.dumps(rows, ensure_ascii=False).encode('utf-8')})
+            batch.set(main_ref.collection('shards').document(str(part)), shard_data)
+    batch.set(main_ref, main_data)
+    # Drop shards left over from a previous, larger bracket
+    for part in range(num_shards if shard_bits else 0, previous_shards if previous_data.get('shard_bits') else 0):
+        batch.delete(main_ref.collection('shards').document(str(part)))
+    batch.commit()
+
+    logging.info(f"Stored bracket for tournament {tournament_id} as version {version} in {1 + (num_shards if shard_bits else 0)} document(s)")
+    return version
+
+
+def load_bracket(db, tournament_id: str) -> tuple[Bracket, dict, int] | None:
+    """
+    Load a single-document bracket.
+
+    Returns:
+        tuple | None: (bracket, players, version), where players maps player ID
+                      to {'name', 'school'}, or None if no bracket is stored.
+    """
+    main_ref = db.collection('brackets').document(tournament_id)
+    main_doc = main_ref.get()
+    if not main_doc.exists:
+        return None
+    main_data = main_doc.to_dict()
+    num_rounds = int(main_data['num_rounds'])
+    shard_bits = int(main_data.get('shard_bits', 0))
+
+    if shard_bits == 0:
+        parts = [(0, main_data)]
+    else:
+        parts = [(None, main_data)]
+        shard_refs = [main_ref.collection('shards').document(str(part)) for part in range(1 << shard_bits)]
+        for doc in db.get_all(shard_refs):
+            if not doc.exists:
+                raise ValueError(f"Bracket shard {doc.id} of tournament {tournament_id} is missing")
+            parts.append((int(doc.id), doc.to_dict()))
+
+    # Player table, in code order
+    rows = []
+    for part, data in sorted((p for p in parts if 'players' in p[1]), key=lambda p: p[1].get('code_offset', 0)):
+        rows.extend(json.loads(bytes(data['players']).decode('utf-8')))
+
+    bracket = Bracket(num_rounds, [row[0] for row in rows])
+    for part, data in parts:
+        decoded = _Part(data)
+        for start, local, length in _part_nodes(num_rounds, shard_bits, part):
+            bracket.player1[start:start + length] = decoded.player1[local:local + length]
+            bracket.player2[start:start + length] = decoded.player2[local:local + length]
+            bracket.winner[start:start + length] = decoded.winner[local:local + length]
+            bracket.status[start:start + length] = decoded.status[local:local + length]
+            bracket.versions[start:start + length] = decoded.versions[local:local + length]
+    bracket.match_ids = [None] + [match_id(tournament_id, node) for node in range(1, bracket.total_slots)]
+
+    players = {row[0]: {'name': row[1], 'school': row[2]} for row in rows}
+    return bracket, players, int(main_data.get('version', 0))
+
+
+def delete_bracket(db, tournament_id: str, batch=None) -> None:
+    """Delete a stored bracket. Deletes are added to `batch` if given, else committed directly."""
+    main_ref = db.collection('brackets').document(tournament_id)
+    main_doc = main_ref.get()
+    if not main_doc.exists:
+        return
+    main_data = main_doc.to_dict()
+    own_batch = batch is None
+    batch = batch or db.batch()
+    if main_data.get('shard_bits'):
+        for part in range(int(main_data.get('shard_count', 0))):
+            batch.delete(main_ref.collection('shards').document(str(part)))
+    batch.delete(main_ref)
+    if own_batch:
+        batch.commit()
+
+
+def update_player(db, tournament_id: str, player_id: str, name: str, school: str) -> None:
+    """Update a player's name and school in a stored bracket's player table, if the player is in it."""
+    main_ref = db.collection('brackets').document(tournament_id)
+
+    @firestore.transactional
+    def update_in_transaction(transaction):
+        main_doc = main_ref.get(transaction=transaction)
+        if not main_doc.exists:
+            return False
+        main_data = main_doc.to_dict()
+        candidates = [(main_ref, main_data)] if 'players' in main_data else []
+        if main_data.get('shard_bits'):
+            shard_refs = [main_ref.collection('shards').document(str(part))
+                          for part in range(int(main_data.get('shard_count', 0)))]
+            candidates.extend((doc.reference, doc.to_dict())
+                              for doc in db.get_all(shard_refs, transaction=transaction) if doc.exists)
+        for ref, data in candidates:
+            rows = json.loads(bytes(data['players']).decode('utf-8'))
+            for row in rows:
+                if row[0] == player_id:
+                    row[1], row[2] = name, school
+                    players_update = {'players': json.dumps(rows, ensure_ascii=False).encode('utf-8')}
+                    main_update = {'version': int(main_data.get('version', 0)) + 1}
+                    if ref is main_ref:
+                        main_update.update(players_update)
+                    else:
+                        transaction.update(ref, players_update)
+                    transaction.update(main_ref, main_update)
+                    return True
+        return False
+
+    if update_in_transaction(db.transaction()):
+        logging.info(f"Updated player {player_id} in stored bracket of tournament {tournament_id}")
+
+
+# --- Result updates ---
+
+def update_result(db, tournament_id: str, node: int, winner_id: str | None) -> int:
+    """
+    Record a match result and advance the winner, in one transaction.
+
+    Mirrors the match-document path: the winner only fills an empty slot in
+    the next match, clearing a result does not pull the player back, and a
+    decided final marks the tournament completed. The tournament's
+    bracket_version is incremented in the same transaction and the changed
+    matches are stamped with it.
+
+    Returns:
+        int: The new bracket_version of the tournament.
+
+    Raises:
+        NotFound: If the bracket or match does not exist.
+        ValueError: If the winner is not one of the match's players.
+    """
+    bracket_version, errors = update_results(db, tournament_id, [(node, winner_id)])
+    if errors[0] is not None:
+        raise errors[0]
+    return bracket_version
+
+
+def update_results(db, tournament_id: str, results: list[tuple[int, str | None]]) -> tuple[int, list[Exception | None]]:
+    """
+    Record several results of one bracket and advance their winners, in one transaction.
+
+    Results are applied in order, so a winner advanced by an earlier result
+    can be decided on by a later one. Invalid results are skipped; the others
+    share one new bracket_version. Nothing is written if none is valid.
+
+    Args:
+        db: Firestore client.
+        tournament_id (str): The ID of the tournament.
+        results (list[tuple[int, str | None]]): (heap node, winner ID or None) pairs.
+
+    Returns:
+        tuple[int, list[Exception | None]]: The tournament's bracket_version after
+            the update and, per result, None or the NotFound / ValueError that
+            rejected it.
+
+    Raises:
+        NotFound: If the bracket or tournament does not exist.
+    """
+    main_ref = db.collection('brackets').document(tournament_id)
+    tournament_ref = db.collection('tournaments').document(tournament_id)
+
+    @firestore.transactional
+    def update_in_transaction(transaction):
+        main_doc = main_ref.get(transaction=transaction)
+        if not main_doc.exists:
+            raise NotFound(f"Bracket for tournament {tournament_id} not found")
+        tournament_doc = tournament_ref.get(transaction=transaction)
+        if not tournament_doc.exists:
+            raise NotFound(f"Tournament {tournament_id} not found")
+        bracket_version = (tournament_doc.to_dict().get(BRACKET_VERSION_FIELD) or 0) + 1
+        main_data = main_doc.to_dict()
+        num_rounds = int(main_data['num_rounds'])
+        shard_bits = int(main_data.get('shard_bits', 0))
+
+        # Every document involved is read before any is written; parts are
+        # decoded once and shared by all results
+        refs = {}
+        stored = {}
+        parts = {}
+
+        def read_part(part):
+            if part not in stored:
+                if part is None or shard_bits == 0:
+                    refs[part], stored[part] = main_ref, main_data
+                else:
+                    shard_ref = main_ref.collection('shards').document(str(part))
+                    shard_doc = shard_ref.get(transaction=transaction)
+                    if not shard_doc.exists:
+                        raise NotFound(f"Bracket shard {part} of tournament {tournament_id} not found")
+                    refs[part], stored[part] = shard_ref, shard_doc.to_dict()
+            return stored[part]
+
+        def decoded(part):
+            if part not in parts:
+                parts[part] = _Part(read_part(part))
+            return parts[part]
+
+        errors = []
+        completed = False
+        played = 0 # Change in the number of decided games, for the tournament summary
+        final_changed = False
+        for node, winner_id in results:
+            try:
+                if not 1 <= node < (1 << num_rounds):
+                    raise NotFound(f"Match {match_id(tournament_id, node)} not found")
+                played += _apply_result(decoded, read_part, main_data, tournament_id, shard_bits, node, winner_id, bracket_version)
+            except (NotFound, ValueError) as e:
+                errors.append(e)
+                continue
+            errors.append(None)
+            completed = completed or (node == 1 and winner_id is not None)
+            final_changed = final_changed or node == 1
+
+        if all(error is not None for error in errors):
+            return bracket_version - 1, errors
+
+        tournament_update = {BRACKET_VERSION_FIELD: bracket_version,
+                             **count_change(tournament_doc.to_dict(), COMPLETED_MATCHES_FIELD, played)}
+        if final_changed:
+            part, local = _locate(1, shard_bits)
+            code = decoded(part).winner[local]
+            row = _player_row(read_part, main_data, code) if code >= 0 else (None, None)
+            tournament_update.update({CHAMPION_ID_FIELD: row[0], CHAMPION_NAME_FIELD: row[1]})
+
+        main_update = {'version': int(main_data.get('version', 0)) + 1}
+        for key, part in parts.items():
+            if refs[key] is main_ref:
+                main_update.update(part.encode())
+            else:
+                transaction.update(refs[key], part.encode())
+        transaction.update(main_ref, main_update)
+
+        if completed:
+            tournament_update['status'] = 'completed'
+        transaction.update(tournament_ref, tournament_update)
+        return bracket_version, errors
+
+    return update_in_transaction(db.transaction())
+
+
+def _apply_result(decoded, read_part, main_data: dict, tournament_id: str, shard_bits: int,
+                  node: int, winner_id: str | None, bracket_version: int) -> int:
+    """
+    Apply one result to the decoded parts, stamping the changed matches with bracket_version.
+
+    Returns:
+        int: The change in the number of decided games (not byes): 1, 0 or -1.
+    """
+    part, local = _locate(node, shard_bits)
+    current = decoded(part)
+    parent = node >> 1
+    both_players = current.player1[local] >= 0 and current.player2[local] >= 0
+    was_played = both_players and current.status[local] == STATUS_COMPLETED
+
+    winner_code = -1
+    if winner_id is not None:
+        for code in (current.player1[local], current.player2[local]):
+            if code >= 0 and _player_id(read_part, main_data, code) == winner_id:
+                winner_code = code
+        if winner_code < 0:
+            raise ValueError(f"Player {winner_id} is not in match {match_id(tournament_id, node)}")
+
+    current.winner[local] = winner_code
+    current.status[local] = STATUS_COMPLETED if winner_code >= 0 else 0
+    current.versions[local] = bracket_version
+
+    if parent and winner_code >= 0:
+        parent_part, parent_local = _locate(parent, shard_bits)
+        target = decoded(parent_part)
+        slots = target.player2 if node & 1 else target.player1
+        if slots[parent_local] < 0:
+            slots[parent_local] = winner_code
+            target.versions[parent_local] = bracket_version
+        elif slots[parent_local] != winner_code:
+            logging.warning(f"Next match {match_id(tournament_id, parent)} slot already filled, cannot advance {winner_id}")
+    return (both_players and winner_code >= 0) - was_played
+
+
+def _player_id(read_part, main_data: dict, code: int) -> str:
+    """Player ID of a code, reading the shard that holds it through `read_part`."""
+    return _player_row(read_part, main_data, code)[0]
+
+
+def _player_row(read_part, main_data: dict, code: int) -> list:
+    """[ID, name, school] of the player with a code, reading the shard that holds it through `read_part`."""
+    if main_data.get('shard_bits'):
+        offsets = main_data['code_offsets']
+        part = bisect_right(offsets, code) - 1
+        data = read_part(min(part, len(offsets) - 2))
+    else:
+        data = read_part(0)
+    rows = json.loads(bytes(data['players']).decode('utf-8'))
+    return rows[code - int(data.get('code_offset', 0))]
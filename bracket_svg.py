@@ -0,0 +1,219 @@
+# SVG image export of brackets
+#
+# Drawing the chart with html2image meant starting a headless browser per
+# image. This module lays the bracket out directly from get_tournament_bracket
+# data and writes SVG text: one pass over the matches places them (a match
+# sits halfway between the two it follows) and emits boxes, names and
+# connector lines, so a 256-player chart takes a few milliseconds. It uses no
+# threads, pools or subprocesses and is safe to use in forked workers.
+#
+# Text width is estimated per character: CJK ideographs and other wide
+# characters take a full em, Latin letters about half of one. Columns are
+# sized to the longest name and school (within limits) and longer ones are
+# cut with an ellipsis.
+#
+# Images are cached in memory per tournament and bracket_version (the key of
+# bracket_pdf.cache_key). PNG output needs the optional cairosvg package.
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from bracket_pdf import cache_key, round_label
+
+FONT_FAMILY = "'Noto Sans TC', 'Microsoft JhengHei', 'PingFang TC', sans-serif"
+NAME_SIZE = 13
+SCHOOL_SIZE = 10
+ROW_HEIGHT = 22 # One player line of a match box
+MATCH_GAP = 10 # Between first-round boxes
+COLUMN_GAP = 36 # Room for connector lines
+MARGIN = 20
+HEADER_HEIGHT = 56
+MIN_BOX_WIDTH, MAX_BOX_WIDTH = 120, 280
+_PADDING = 6
+
+_NARROW = set("iljtfr.,:;|!'`()[] ")
+_CACHE_ENTRIES = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ImageUnavailableError(RuntimeError):
+    """Raised when PNG output is asked for but cairosvg cannot run here."""
+
+
+def char_width(ch: str) -> float:
+    """Approximate advance of a character, in ems."""
+    if unicodedata.combining(ch):
+        return 0.0
+    if unicodedata.east_asian_width(ch) in ('W', 'F'):
+        return 1.0
+    if ch in _NARROW:
+        return 0.3
+    if ch.isupper() or ch.isdigit() or ch in 'mw':
+        return 0.65
+    return 0.52
+
+
+def text_width(text: str, font_size: float) -> float:
+    """Approximate rendered width of text, in pixels."""
+    return sum(map(char_width, text)) * font_size
+
+
+def fit_text(text: str, font_size: float, max_width: float) -> str:
+    """Text cut with an ellipsis so that it fits max_width."""
+    if text_width(text, font_size) <= max_width:
+        return text
+    budget = max_width - text_width('…', font_size)
+    width = 0.0
+    for index, ch in enumerate(text):
+        width += char_width(ch) * font_size
+        if width > budget:
+            return text[:index] + '…'
+    return text
+
+
+def _player_line(match: dict, prefix: str, round_number: int) -> tuple[str, str, bool]:
+    """(name, school, is winner) shown for one player slot of a match."""
+    player_id = match.get(f'{prefix}_id')
+    if not player_id:
+        return ('Bye' if round_number == 1 else 'TBD'), '', False
+    return match.get(f'{prefix}_name') or 'Unknown', match.get(f'{prefix}_school') or '', match.get('winner_id') == player_id
+
+
+def render_svg(tournament: dict, bracket_data: dict) -> bytes:
+    """
+    Lay out a bracket as an SVG image.
+
+    Args:
+        tournament (dict): The tournament record (for the title).
+        bracket_data (dict): Output of get_tournament_bracket.
+
+    Returns:
+        bytes: The UTF-8 encoded SVG document.
+    """
+    rounds = bracket_data.get('rounds') or {}
+    num_rounds = max(rounds, default=0)
+    first_round = 1 << (num_rounds - 1) if num_rounds else 0
+    box_height = 2 * ROW_HEIGHT
+
+    # Column width from the longest player line (name plus school)
+    widest = max((text_width(match.get(f'{prefix}_name') or '', NAME_SIZE) +
+                  text_width(match.get(f'{prefix}_school') or '', SCHOOL_SIZE) + 3 * _PADDING
+                  for matches in rounds.values() for match in matches for prefix in ('player1', 'player2')),
+                 default=MIN_BOX_WIDTH)
+    box_width = min(max(widest, MIN_BOX_WIDTH), MAX_BOX_WIDTH)
+
+    width = 2 * MARGIN + num_rounds * box_width + max(num_rounds - 1, 0) * COLUMN_GAP
+    height = HEADER_HEIGHT + MARGIN + first_round * (box_height + MATCH_GAP) - MATCH_GAP + MARGIN
+    width = max(width, 2 * MARGIN + text_width(tournament.get('name') or '', 20))
+
+    title = escape(f"中國象棋錦標賽 - {tournament.get('name') or ''}")
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+        f'viewBox="0 0 {width:.0f} {height:.0f}" font-family="{FONT_FAMILY}">',
+        '<style>.box{fill:#fff;stroke:#ced4da}.final{stroke:#0d6efd;stroke-width:2}.win{fill:#e8f3ee}'
+        '.name{font-size:%dpx;fill:#121212}.winner{font-weight:bold}.school{font-size:%dpx;fill:#6c757d}'
+        '.empty{fill:#adb5bd;font-style:italic}.link{fill:none;stroke:#adb5bd}'
+        '.round{font-size:12px;font-weight:bold;fill:#495057;text-anchor:middle}</style>' % (NAME_SIZE, SCHOOL_SIZE),
+        '<rect width="100%" height="100%" fill="#fff"/>',
+        f'<text x="{MARGIN}" y="28" font-size="20" font-weight="bold" fill="#0d6efd">{title}</text>',
+    ]
+
+    # Vertical centre of every match of the previous round, by match number
+    previous = {}
+    for round_number in range(1, num_rounds + 1):
+        x = MARGIN + (round_number - 1) * (box_width + COLUMN_GAP)
+        parts.append(f'<text class="round" x="{x + box_width / 2:.1f}" y="{HEADER_HEIGHT - 8}">'
+                     f'{escape(round_label(round_number, num_rounds))}</text>')
+        centres = {}
+        for match in rounds.get(round_number, ()):
+            number = match['match_number']
+            if round_number == 1:
+                centre = HEADER_HEIGHT + MARGIN + (number - 1) * (box_height + MATCH_GAP) + box_height / 2
+            else:
+                # Halfway between the two matches it follows, whether or not they are stored
+                span = (box_height + MATCH_GAP) * (1 << (round_number - 1))
+                centre = (previous.get(2 * number - 1, HEADER_HEIGHT + MARGIN + (number - 1) * span + box_height / 2) +
+                          previous.get(2 * number, HEADER_HEIGHT + MARGIN + (number - 0.5) * span + box_height / 2)) / 2
+                # Connectors from the two earlier matches
+                middle = x - COLUMN_GAP / 2
+                for child in (2 * number - 1, 2 * number):
+                    if child in previous:
+                        parts.append(f'<path class="link" d="M{x - COLUMN_GAP:.1f} {previous[child]:.1f}'
+                                     f'H{middle:.1f}V{centre:.1f}H{x:.1f}"/>')
+            centres[number] = centre
+            top = centre - box_height / 2
+            box_class = 'box final' if round_number == num_rounds else 'box'
+            parts.append(f'<rect class="{box_class}" x="{x:.1f}" y="{top:.1f}" width="{box_width:.1f}" '
+                         f'height="{box_height}" rx="4"/>')
+            for row, prefix in enumerate(('player1', 'player2')):
+                name, school, is_winner = _player_line(match, prefix, round_number)
+                row_top = top + row * ROW_HEIGHT
+                if is_winner:
+                    parts.append(f'<rect class="win" x="{x + 1:.1f}" y="{row_top + 1:.1f}" '
+                                 f'width="{box_width - 2:.1f}" height="{ROW_HEIGHT - 2}"/>')
+                baseline = row_top + ROW_HEIGHT / 2 + NAME_SIZE * 0.35
+                name_width = box_width - 2 * _PADDING
+                if school:
+                    name_width -= min(text_width(school, SCHOOL_SIZE), box_width / 3) + _PADDING
+                name = fit_text(name, NAME_SIZE, name_width)
+                name_class = 'name winner' if is_winner else ('name' if match.get(f'{prefix}_id') else 'name empty')
+                parts.append(f'<text class="{name_class}" x="{x + _PADDING:.1f}" y="{baseline:.1f}">{escape(name)}</text>')
+                if school:
+                    school = fit_text(school, SCHOOL_SIZE, box_width / 3)
+                    parts.append(f'<text class="school" x="{x + box_width - _PADDING:.1f}" y="{baseline:.1f}" '
+                                 f'text-anchor="end">{escape(school)}</text>')
+        previous = centres
+
+    if not num_rounds:
+        parts.append(f'<text class="name empty" x="{MARGIN}" y="{HEADER_HEIGHT + MARGIN}">No bracket has been generated yet.</text>')
+    parts.append('</svg>')
+    return ''.join(parts).encode('utf-8')
+
+
+def rasterize(svg: bytes, scale: float = 2.0) -> bytes:
+    """Convert an SVG image to PNG with cairosvg."""
+    try:
+        import cairosvg
+    except (ImportError, OSError) as e:
+        # OSError: cairosvg is installed but the Cairo library is not
+        raise ImageUnavailableError(f"cairosvg is not available: {e}")
+    return cairosvg.svg2png(bytestring=svg, scale=scale)
+
+
+def get_image(tournament: dict, load_bracket, fmt: str = 'svg') -> bytes:
+    """
+    Return a tournament's chart as SVG or PNG, from the cache if its bracket_version was drawn before.
+
+    Args:
+        tournament (dict): The tournament record, as read for this request.
+        load_bracket (callable): Returns the get_tournament_bracket data; only called on a miss.
+        fmt (str): 'svg' or 'png'.
+
+    Raises:
+        ImageUnavailableError: For PNG when cairosvg cannot run on this server.
+    """
+    key = (cache_key(tournament, 'image'), fmt)
+    with _cache_lock:
+        image = _cache.get(key)
+        if image is not None:
+            _cache.move_to_end(key)
+            return image
+
+    if fmt == 'png':
+        svg = get_image(tournament, load_bracket, 'svg')
+        start = time.perf_counter()
+        image = rasterize(svg)
+    else:
+        start = time.perf_counter()
+        image = render_svg(tournament, load_bracket())
+    logging.info(f"Drew {fmt} chart of tournament {tournament['id']} ({len(image) // 1024} KB) "
+                 f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+    with _cache_lock:
+        _cache[key] = image
+        while len(_cache) > _CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return image
@@ -0,0 +1,164 @@
+# Chunked, parallel Firestore writes
+#
+# A Firestore commit holds at most 500 writes, but generating or deleting a
+# large bracket touches one document per match and player (4,095 matches for
+# 4,096 players). BulkWriter queues writes, cuts them into chunks below the
+# limit and commits the chunks concurrently from a small thread pool while
+# the caller keeps queueing. A chunk that fails with a transient error is
+# retried with exponential backoff and jitter.
+#
+# Chunks commit independently, so a bulk write is not atomic: callers only
+# queue idempotent writes (set, update, delete), which can be retried safely
+# even if a commit reported as failed did go through, and write whatever
+# makes the data visible (the tournament's bracket_version, the tournament
+# document itself) after close() returns. Settings:
+#
+#   BULK_WRITE_CHUNK     - writes per commit, default 500 (Firestore's limit)
+#   BULK_WRITE_WORKERS   - concurrent commits, default 8
+#   BULK_WRITE_ATTEMPTS  - attempts per chunk, default 5
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import (Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted,
+                                        ServiceUnavailable)
+
+MAX_WRITES_PER_COMMIT = 500
+# Errors worth retrying; anything else fails the chunk right away
+RETRYABLE_ERRORS = (Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable)
+
+
+class BulkWriter:
+    """
+    Queue of writes committed in parallel chunks.
+
+    Usage:
+        writer = BulkWriter.from_env(client)
+        for ref in refs:
+            writer.delete(ref)
+        stats = writer.close() # Waits for every chunk, raises the first failure
+    """
+
+    def __init__(self, client, chunk_size: int = MAX_WRITES_PER_COMMIT, workers: int = 8,
+                 max_attempts: int = 5, base_delay: float = 0.2, description: str = 'bulk write',
+                 on_progress=None):
+        self.client = client
+        self.chunk_size = max(1, min(chunk_size, MAX_WRITES_PER_COMMIT))
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.description = description
+        self.on_progress = on_progress # Called with (writes committed, writes queued) after each commit
+        self._pending = []
+        self._futures = []
+        self._pool = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.committed = 0
+        self.commits = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls, client, description: str = 'bulk write', on_progress=None, environ=os.environ) -> 'BulkWriter':
+        return cls(client, chunk_size=int(environ.get('BULK_WRITE_CHUNK', MAX_WRITES_PER_COMMIT)),
+                   workers=int(environ.get('BULK_WRITE_WORKERS', 8)),
+                   max_attempts=int(environ.get('BULK_WRITE_ATTEMPTS', 5)),
+                   description=description, on_progress=on_progress)
+
+    def set(self, reference, document_data: dict) -> None:
+        self._queue(('set', reference, document_data))
+
+    def update(self, reference, field_updates: dict) -> None:
+        self._queue(('update', reference, field_updates))
+
+    def delete(self, reference) -> None:
+        self._queue(('delete', reference, None))
+
+    def close(self) -> dict:
+        """
+        Commit the remaining writes and wait for every chunk.
+
+        Returns:
+            dict: 'writes', 'commits', 'retries', 'seconds' and 'writes_per_second'.
+
+        Raises:
+            Exception: The error of the first chunk that failed after all its
+                       attempts (the other chunks are still waited for).
+        """
+        error = None
+        pending, self._pending = self._pending, []
+        if pending and self._pool is None:
+            # Everything fits in one commit: no threads needed
+            self.commits += 1
+            try:
+                self._commit(pending)
+            except Exception as e:
+                error = e
+        elif pending:
+            self._submit(pending)
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+        seconds = time.perf_counter() - self._started
+        stats = {'writes': self.writes, 'commits': self.commits, 'retries': self.retries,
+                 'seconds': round(seconds, 3),
+                 'writes_per_second': round(self.writes / seconds) if seconds > 0 else None}
+        self._futures = []
+        if error is not None:
+            logging.error(f"{self.description} failed after {stats['commits']} commits: {error}")
+            raise error
+        if self.writes:
+            logging.info(f"{self.description}: {stats['writes']} writes in {stats['commits']} commits "
+                         f"({stats['retries']} retries) in {seconds:.2f}s, {stats['writes_per_second']} writes/s")
+        return stats
+
+    def _queue(self, write: tuple) -> None:
+        self._pending.append(write)
+        self.writes += 1
+        if len(self._pending) >= self.chunk_size:
+            self._submit(self._pending)
+            self._pending = []
+
+    def _submit(self, writes: list) -> None:
+        # Started on the first full chunk, so small writes cost no threads
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bulk-writer')
+        self.commits += 1
+        # In the caller's context, so the commits count towards its request (see metrics)
+        self._futures.append(self._pool.submit(contextvars.copy_context().run, self._commit, writes))
+
+    def _commit(self, writes: list) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            batch = self.client.batch()
+            for op, reference, data in writes:
+                if op == 'delete':
+                    batch.delete(reference)
+                else:
+                    getattr(batch, op)(reference, data)
+            try:
+                batch.commit()
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_attempts:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                delay = self.base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logging.warning(f"{self.description}: commit of {len(writes)} writes failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+        with self._lock:
+            self.committed += len(writes)
+            committed = self.committed
+        if self.on_progress:
+            self.on_progress(committed, self.writes)
@@ -0,0 +1,154 @@
+# Streaming data export (CSV / NDJSON)
+#
+# The league office pulls players, matches and final placings of many
+# tournaments at once. Rows are generated one at a time from
+# Repository.iter_players / iter_matches, which fetch a page of records per
+# query, and encoded into chunks of about EXPORT_CHUNK_BYTES for a streamed
+# Flask response, so memory stays flat however many matches the
+# tournaments have. Only the players of the tournament being exported are
+# held in memory: their names to label the matches, and one row each to sort
+# the placings.
+#
+# CSV files start with a UTF-8 byte order mark so that Excel shows Chinese
+# names correctly; NDJSON has one JSON object per line.
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+_TOURNAMENT_COLUMNS = ('tournament_id', 'tournament_name', 'tournament_date')
+COLUMNS = {
+    'players': _TOURNAMENT_COLUMNS + ('player_id', 'name', 'school', 'is_seeded'),
+    'matches': _TOURNAMENT_COLUMNS + ('match_id', 'round_number', 'match_number', 'player1_id', 'player1_name',
+                                      'player1_school', 'player2_id', 'player2_name', 'player2_school',
+                                      'winner_id', 'winner_name', 'status'),
+    'placings': _TOURNAMENT_COLUMNS + ('placing', 'player_id', 'name', 'school', 'is_seeded',
+                                       'eliminated_in_round', 'status'),
+}
+
+
+def _tournament_fields(tournament: dict) -> dict:
+    tournament_date = tournament.get('date')
+    if isinstance(tournament_date, (date, datetime)):
+        tournament_date = tournament_date.strftime('%Y-%m-%d')
+    return {'tournament_id': tournament['id'], 'tournament_name': tournament.get('name'),
+            'tournament_date': tournament_date}
+
+
+def _player_rows(repo, tournament: dict):
+    head = _tournament_fields(tournament)
+    for player in repo.iter_players(tournament['id']):
+        yield {**head, 'player_id': player['id'], 'name': player.get('name'), 'school': player.get('school'),
+               'is_seeded': bool(player.get('is_seeded'))}
+
+
+def _match_rows(repo, tournament: dict):
+    head = _tournament_fields(tournament)
+    players = {player['id']: (player.get('name'), player.get('school')) for player in repo.iter_players(tournament['id'])}
+    for match in repo.iter_matches(tournament):
+        row = {**head, 'match_id': match['id'], 'round_number': match.get('round_number'),
+               'match_number': match.get('match_number')}
+        for prefix in ('player1', 'player2', 'winner'):
+            player_id = match.get(f'{prefix}_id')
+            name, school = players.get(player_id, (None, None))
+            row[f'{prefix}_id'] = player_id
+            row[f'{prefix}_name'] = name
+            if prefix != 'winner':
+                row[f'{prefix}_school'] = school
+        row['status'] = match.get('status')
+        yield row
+
+
+def _placing_rows(repo, tournament: dict):
+    """
+    Final placings of a single-elimination bracket: 1 for the champion, 2 for
+    the runner-up, 3 for both semi-final losers, 5 for the quarter-final
+    losers and so on. Players still in the tournament have no placing yet.
+    """
+    head = _tournament_fields(tournament)
+    eliminated = {} # player ID -> round in which they lost
+    num_rounds, latest_winner = 0, (0, None)
+    for match in repo.iter_matches(tournament):
+        round_number = match.get('round_number') or 0
+        num_rounds = max(num_rounds, round_number)
+        winner_id = match.get('winner_id')
+        if not winner_id or not match.get('player1_id') or not match.get('player2_id'):
+            continue # No result yet, or a bye
+        loser_id = match['player2_id'] if winner_id == match['player1_id'] else match['player1_id']
+        eliminated[loser_id] = round_number
+        latest_winner = max(latest_winner, (round_number, winner_id))
+    # Matches come in no particular order: the champion is known once the last round has a result
+    champion_id = latest_winner[1] if latest_winner[0] == num_rounds else None
+
+    rows = []
+    for player in repo.iter_players(tournament['id']):
+        player_id = player['id']
+        row = {**head, 'placing': None, 'player_id': player_id, 'name': player.get('name'),
+               'school': player.get('school'), 'is_seeded': bool(player.get('is_seeded')),
+               'eliminated_in_round': eliminated.get(player_id), 'status': 'active'}
+        if player_id == champion_id:
+            row['placing'], row['status'] = 1, 'champion'
+        elif player_id in eliminated:
+            row['placing'], row['status'] = (1 << (num_rounds - eliminated[player_id])) + 1, 'eliminated'
+        rows.append(row)
+    # One row per player is needed anyway to sort them by placing
+    rows.sort(key=lambda row: (row['placing'] is None, row['placing'] or 0, row['name'] or ''))
+    yield from rows
+
+
+_ROWS = {'players': _player_rows, 'matches': _match_rows, 'placings': _placing_rows}
+
+
+def export_rows(repo, kind: str, tournaments):
+    """
+    Yield the export rows of one kind for several tournaments.
+
+    Args:
+        repo (Repository): The storage backend.
+        kind (str): 'players', 'matches' or 'placings' (see COLUMNS).
+        tournaments (iterable): Tournament records, as returned by get_tournament.
+
+    Yields:
+        dict: One row, keyed by the kind's COLUMNS.
+    """
+    for tournament in tournaments:
+        yield from _ROWS[kind](repo, tournament)
+
+
+def encode(rows, fmt: str, columns: tuple):
+    """
+    Encode rows as CSV (with a header) or NDJSON, in chunks of about EXPORT_CHUNK_BYTES.
+
+    Errors are logged and re-raised. The response status has already been
+    sent by then, so raising makes the server abort the chunked response:
+    the client sees a failed download rather than a truncated file that
+    looks complete.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore') if fmt == 'csv' else None
+    if writer is not None:
+        buffer.write('\ufeff') # Byte order mark
+        writer.writeheader()
+    try:
+        for row in rows:
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False, default=str))
+                buffer.write('\n')
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        logging.error(f"Export failed after it started streaming: {e}", exc_info=True)
+        raise
+    yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,561 @@
+# In-memory stand-in for the Firestore client
+#
+# Covers the part of the google.cloud.firestore client API this app uses:
+# collection().where().order_by().limit().start_after().stream(),
+# document().get/set/update/delete/create, collection().add(), get_all(),
+# batch() and transactions run through the real @firestore.transactional
+# decorator. Like Firestore's server client libraries, transactions lock the
+# documents they read until they commit, so concurrent transactions on the
+# same document queue up; a lock wait that times out (e.g. a deadlock) or a
+# read changed by a plain write raises Aborted and the decorator retries.
+#
+# Every round trip can be given an injected latency, and operation counters
+# record what each request cost, so bracket generation, reads and result
+# updates can be load-tested and profiled without a cloud project. The
+# client's observer, if set, is told about every round trip under the name
+# of the RPC the real client would make (see metrics.instrument_firestore):
+#
+#   STORAGE_BACKEND=memory FIRESTORE_FAKE_LATENCY_MS=20 python main.py
+import copy
+import itertools
+import logging
+import random
+import secrets
+import string
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import Aborted, AlreadyExists, InvalidArgument, NotFound
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, SERVER_TIMESTAMP, Increment
+
+MAX_BATCH_WRITES = 500 # Firestore's limit per commit
+DESCENDING = 'DESCENDING'
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+
+def _auto_id() -> str:
+    return ''.join(secrets.choice(_ID_ALPHABET) for _ in range(20))
+
+
+_MISSING = object()
+
+
+def _get_field(data: dict, field_path: str, default=None):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
+
+
+def _order_key(value) -> tuple:
+    """Sort key following Firestore's ordering of mixed types: null, bool, number, timestamp, string, bytes."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    return (6, repr(value))
+
+
+def _set_field(data: dict, field_path: str, value) -> None:
+    *parents, last = field_path.split('.')
+    for part in parents:
+        data = data.setdefault(part, {})
+    if value is DELETE_FIELD:
+        data.pop(last, None)
+    elif value is SERVER_TIMESTAMP:
+        data[last] = datetime.now(timezone.utc)
+    elif isinstance(value, Increment):
+        current = data.get(last)
+        data[last] = (current if isinstance(current, (int, float)) else 0) + value.value
+    else:
+        data[last] = copy.deepcopy(value)
+
+
+def _apply_transforms(data: dict) -> dict:
+    """Copy a set() payload, resolving sentinels. Keys are field names, not paths."""
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            result[key] = _apply_transforms(value)
+        elif value is SERVER_TIMESTAMP:
+            result[key] = datetime.now(timezone.utc)
+        elif isinstance(value, Increment):
+            result[key] = value.value
+        elif value is not DELETE_FIELD:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class FakeStats:
+    """Operation counters of a FakeFirestoreClient."""
+    __slots__ = ('round_trips', 'document_reads', 'document_writes', 'queries', 'commits',
+                 'transactions', 'aborted', 'latency_seconds')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FakeFirestoreClient:
+    """
+    In-memory Firestore client.
+
+    Args:
+        latency (float): Seconds added to every round trip (get, query, commit, ...).
+        jitter (float): Extra random latency of up to this many seconds per round trip.
+        per_document_latency (float): Seconds added per document a query or get_all returns.
+        seed (int | None): Seed for the jitter, so runs are reproducible.
+        lock_timeout (float): Seconds a transaction waits for a document lock before aborting.
+
+    Attributes:
+        observer (callable | None): Called after each round trip as
+            observer(operation, seconds, reads=, writes=, retry=, error=).
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, per_document_latency: float = 0.0,
+                 seed: int | None = None, lock_timeout: float = 5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.per_document_latency = per_document_latency
+        self.stats = FakeStats()
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        # Collection path -> document ID -> [data, update counter]
+        self._collections = {}
+        self._counter = itertools.count(1)
+        self.lock_timeout = lock_timeout
+        self._document_locks = {}
+        self.observer = None
+
+    # --- Client API ---
+
+    def collection(self, path: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self, path)
+
+    def document(self, path: str) -> 'FakeDocumentReference':
+        collection_path, _, document_id = path.rpartition('/')
+        return FakeDocumentReference(self, collection_path, document_id)
+
+    def batch(self) -> 'FakeWriteBatch':
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> 'FakeTransaction':
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        start = time.perf_counter()
+        self._round_trip(len(references))
+        snapshots = [ref._snapshot(transaction) for ref in references]
+        self._observe('batch_get_documents', start, reads=len(snapshots))
+        yield from snapshots
+
+    def reset(self) -> None:
+        """Drop all data and counters."""
+        with self._lock:
+            self._collections.clear()
+        self.stats.reset()
+
+    # --- Internals ---
+
+    def _round_trip(self, documents: int = 0) -> None:
+        delay = self.latency + documents * self.per_document_latency
+        if self.jitter:
+            delay += self._rng.uniform(0, self.jitter)
+        with self._lock:
+            self.stats.round_trips += 1
+            self.stats.latency_seconds += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def _observe(self, operation: str, start: float, **counts) -> None:
+        if self.observer is not None:
+            self.observer(operation, time.perf_counter() - start, **counts)
+
+    def _read(self, collection_path: str, document_id: str):
+        """Return (data copy or None, update counter) of a document."""
+        with self._lock:
+            self.stats.document_reads += 1
+            entry = self._collections.get(collection_path, {}).get(document_id)
+            if entry is None:
+                return None, 0
+            return copy.deepcopy(entry[0]), entry[1]
+
+    def _document_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._document_locks.setdefault(key, threading.Lock())
+
+    def _version(self, collection_path: str, document_id: str) -> int:
+        entry = self._collections.get(collection_path, {}).get(document_id)
+        return entry[1] if entry else 0
+
+    def _apply(self, writes: list) -> None:
+        """Apply (op, ref, data) writes atomically. Caller holds the lock."""
+        # Validate everything first so a failing write leaves no partial commit
+        for op, ref, _ in writes:
+            exists = ref.id in self._collections.get(ref._collection_path, {})
+            if op == 'update' and not exists:
+                raise NotFound(f"No document to update: {ref.path}")
+            if op == 'create' and exists:
+                raise AlreadyExists(f"Document already exists: {ref.path}")
+        for op, ref, data in writes:
+            documents = self._collections.setdefault(ref._collection_path, {})
+            if op == 'delete':
+                documents.pop(ref.id, None)
+            elif op in ('set', 'create'):
+                documents[ref.id] = [_apply_transforms(data), next(self._counter)]
+            elif op == 'merge':
+                current = documents.get(ref.id, [{}, 0])[0]
+                for key, value in data.items():
+                    _set_field(current, key, value)
+                documents[ref.id] = [current, next(self._counter)]
+            elif op == 'update':
+                current = documents[ref.id][0]
+                for key, value in data.items():
+                    _set_field(current, key, value)
+                documents[ref.id] = [current, next(self._counter)]
+            self.stats.document_writes += 1
+
+    def _commit(self, writes: list, read_versions: dict | None = None) -> list:
+        if len(writes) > MAX_BATCH_WRITES:
+            raise InvalidArgument(f"maximum {MAX_BATCH_WRITES} writes allowed per request")
+        start = time.perf_counter()
+        self._round_trip()
+        try:
+            with self._lock:
+                self.stats.commits += 1
+                for (collection_path, document_id), version in (read_versions or {}).items():
+                    if self._version(collection_path, document_id) != version:
+                        self.stats.aborted += 1
+                        raise Aborted("Transaction lock timeout / contention on a document read in this transaction")
+                self._apply(writes)
+        except Exception:
+            self._observe('commit', start, writes=len(writes), error=True)
+            raise
+        self._observe('commit', start, writes=len(writes))
+        now = datetime.now(timezone.utc)
+        return [now] * len(writes)
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', data: dict | None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> dict | None:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        return _get_field(self._data or {}, field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, client: FakeFirestoreClient, collection_path: str, document_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+
+    def collection(self, name: str) -> 'FakeCollectionReference':
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def _snapshot(self, transaction=None) -> FakeDocumentSnapshot:
+        if transaction is not None:
+            transaction._lock(self)
+        data, version = self._client._read(self._collection_path, self.id)
+        if transaction is not None:
+            transaction._record_read(self, version)
+        return FakeDocumentSnapshot(self, data)
+
+    def get(self, field_paths=None, transaction=None) -> FakeDocumentSnapshot:
+        start = time.perf_counter()
+        self._client._round_trip(1)
+        snapshot = self._snapshot(transaction)
+        self._client._observe('batch_get_documents', start, reads=1)
+        return snapshot
+
+    def set(self, document_data: dict, merge: bool = False):
+        return self._client._commit([('merge' if merge else 'set', self, document_data)])[0]
+
+    def create(self, document_data: dict):
+        return self._client._commit([('create', self, document_data)])[0]
+
+    def update(self, field_updates: dict):
+        return self._client._commit([('update', self, field_updates)])[0]
+
+    def delete(self):
+        return self._client._commit([('delete', self, None)])[0]
+
+
+class FakeQuery:
+    def __init__(self, client: FakeFirestoreClient, collection_path: str, filters=(), orders=(),
+                 limit=None, cursor=None, projection=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes) -> 'FakeQuery':
+        state = {'filters': self._filters, 'orders': self._orders, 'limit': self._limit, 'cursor': self._cursor,
+                 'projection': self._projection}
+        state.update(changes)
+        return FakeQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path: str = None, op_string: str = None, value=None, filter=None) -> 'FakeQuery':
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = 'ASCENDING') -> 'FakeQuery':
+        return self._copy(orders=self._orders + ((field_path, direction == DESCENDING),))
+
+    def select(self, field_paths) -> 'FakeQuery':
+        """Return only these fields of each document."""
+        return self._copy(projection=tuple(field_paths))
+
+    def limit(self, count: int) -> 'FakeQuery':
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields) -> 'FakeQuery':
+        """Continue after a snapshot (or a dict of the ordered fields)."""
+        if isinstance(document_fields, FakeDocumentSnapshot):
+            values = {field: document_fields.get(field) for field, _ in self._orders}
+            values['__name__'] = document_fields.id
+        else:
+            values = dict(document_fields)
+        return self._copy(cursor=values)
+
+    def _matches(self, data: dict) -> bool:
+        for field_path, op, value in self._filters:
+            actual = _get_field(data, field_path)
+            if op == '==' and actual != value: return False
+            if op == '!=' and (actual is None or actual == value): return False
+            if op in ('<', '<=', '>', '>='):
+                if actual is None or value is None:
+                    return False
+                if op == '<' and not actual < value: return False
+                if op == '<=' and not actual <= value: return False
+                if op == '>' and not actual > value: return False
+                if op == '>=' and not actual >= value: return False
+            if op == 'in' and actual not in value: return False
+            if op == 'not-in' and (actual is None or actual in value): return False
+            if op == 'array_contains' and (not isinstance(actual, list) or value not in actual): return False
+            if op == 'array_contains_any' and (not isinstance(actual, list) or not set(value) & set(actual)): return False
+        return True
+
+    def _sort_key(self, document_id: str, data: dict) -> tuple:
+        return tuple(_get_field(data, field) for field, _ in self._orders) + (document_id,)
+
+    def _results(self) -> list[tuple[str, dict]]:
+        with self._client._lock:
+            documents = self._client._collections.get(self._collection_path, {})
+            rows = [(doc_id, copy.deepcopy(entry[0])) for doc_id, entry in documents.items() if self._matches(entry[0])]
+        # Firestore leaves out documents missing an ordered field
+        rows = [row for row in rows if all(_get_field(row[1], field, _MISSING) is not _MISSING for field, _ in self._orders)]
+        # Stable sorts from the last key to the first give mixed directions; ties
+        # are ordered by document ID in the direction of the last order_by
+        rows.sort(key=lambda row: row[0], reverse=bool(self._orders) and self._orders[-1][1])
+        for index in range(len(self._orders) - 1, -1, -1):
+            field, descending = self._orders[index]
+            rows.sort(key=lambda row: _order_key(_get_field(row[1], field)), reverse=descending)
+        if self._cursor is not None:
+            rows = rows[self._cursor_position(rows):]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self._projection is not None:
+            rows = [(doc_id, {field: data[field] for field in self._projection if field in data}) for doc_id, data in rows]
+        return rows
+
+    def _cursor_position(self, rows: list) -> int:
+        """Index of the first row strictly after the cursor."""
+        cursor = self._cursor
+        for position, (doc_id, data) in enumerate(rows):
+            for field, descending in self._orders:
+                value, bound = _order_key(_get_field(data, field)), _order_key(cursor.get(field))
+                if value != bound:
+                    if (value > bound) != descending:
+                        return position
+                    break
+            else:
+                # Ties are ordered by document ID in the direction of the last order_by
+                descending = self._orders[-1][1] if self._orders else False
+                if '__name__' not in cursor or (doc_id < cursor['__name__'] if descending else doc_id > cursor['__name__']):
+                    return position
+        return len(rows)
+
+    def stream(self, transaction=None):
+        start = time.perf_counter()
+        rows = self._results()
+        self._client.stats.queries += 1
+        self._client._round_trip(len(rows))
+        self._client._observe('run_query', start, reads=len(rows))
+        for doc_id, data in rows:
+            ref = FakeDocumentReference(self._client, self._collection_path, doc_id)
+            with self._client._lock:
+                self._client.stats.document_reads += 1
+                version = self._client._version(self._collection_path, doc_id)
+            if transaction is not None:
+                transaction._lock(ref)
+                transaction._record_read(ref, version)
+            yield FakeDocumentSnapshot(ref, data)
+
+    def get(self, transaction=None) -> list[FakeDocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: FakeFirestoreClient, path: str):
+        super().__init__(client, path)
+        self.id = path.rpartition('/')[2]
+
+    def document(self, document_id: str | None = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, self._collection_path, document_id or _auto_id())
+
+    def add(self, document_data: dict, document_id: str | None = None):
+        ref = self.document(document_id)
+        update_time = ref.create(document_data)
+        return update_time, ref
+
+    def list_documents(self):
+        with self._client._lock:
+            ids = list(self._client._collections.get(self._collection_path, {}))
+        return [self.document(doc_id) for doc_id in ids]
+
+
+class FakeWriteBatch:
+    def __init__(self, client: FakeFirestoreClient):
+        self._client = client
+        self._writes = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._writes.append(('merge' if merge else 'set', reference, copy.deepcopy(document_data)))
+        return self
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(('create', reference, copy.deepcopy(document_data)))
+        return self
+
+    def update(self, reference, field_updates: dict):
+        self._writes.append(('update', reference, copy.deepcopy(field_updates)))
+        return self
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None))
+        return self
+
+    def commit(self) -> list:
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transaction driven by the real @firestore.transactional decorator.
+
+    Reads lock each document until commit or rollback (read-only transactions
+    take no locks) and record its version; commit aborts if a plain write
+    changed one of them, which makes the decorator retry the whole function.
+    """
+
+    def __init__(self, client: FakeFirestoreClient, max_attempts: int = 5, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+        self._held_locks = []
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def _lock(self, reference: FakeDocumentReference) -> None:
+        key = (reference._collection_path, reference.id)
+        if self._read_only or key in self._read_versions:
+            return
+        lock = self._client._document_lock(key)
+        if lock in self._held_locks:
+            return
+        if not lock.acquire(timeout=self._client.lock_timeout):
+            raise Aborted(f"Transaction lock timeout on {reference.path}")
+        self._held_locks.append(lock)
+
+    def _record_read(self, reference: FakeDocumentReference, version: int) -> None:
+        if self._writes:
+            raise ValueError("Firestore transactions require all reads to be executed before all writes.")
+        self._read_versions.setdefault((reference._collection_path, reference.id), version)
+
+    # Hooks used by google.cloud.firestore's _Transactional
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+        for lock in self._held_locks:
+            lock.release()
+        self._held_locks = []
+
+    def _begin(self, retry_id=None) -> None:
+        start = time.perf_counter()
+        self._client._round_trip()
+        with self._client._lock:
+            self._client.stats.transactions += 1
+        self._client._observe('begin_transaction', start, retry=retry_id is not None)
+        self._id = f"fake-tx-{next(self._client._counter)}".encode()
+
+    def _commit(self) -> list:
+        if self._read_only and self._writes:
+            raise ValueError("Cannot perform write operation in read-only transaction.")
+        try:
+            return self._client._commit(self._writes, self._read_versions)
+        finally:
+            self._clean_up()
+
+    def _rollback(self) -> None:
+        self._clean_up()
+
+    def commit(self) -> list:
+        return self._commit()
+
+
+def client_from_env(environ) -> FakeFirestoreClient:
+    """Build a fake client configured by FIRESTORE_FAKE_LATENCY_MS and FIRESTORE_FAKE_JITTER_MS."""
+    latency = float(environ.get('FIRESTORE_FAKE_LATENCY_MS', 0)) / 1000
+    jitter = float(environ.get('FIRESTORE_FAKE_JITTER_MS', 0)) / 1000
+    logging.info(f"Using in-memory Firestore with {latency * 1000:.0f} ms latency (+{jitter * 1000:.0f} ms jitter)")
+    return FakeFirestoreClient(latency=latency, jitter=jitter)
@@ -0,0 +1,52 @@
+# Gunicorn settings (gunicorn reads ./gunicorn.conf.py on its own, so the
+# start command in render.yaml needs no extra option)
+#
+# Workers are gevent workers: a request, and in particular an idle live-event
+# stream (bracket_events), holds a greenlet rather than a thread. Each worker
+# serves up to worker_connections open connections, of which
+# SSE_MAX_CLIENTS (default 900) may be event streams; the rest are left to
+# ordinary requests. With --workers 4 (render.yaml) a node therefore pushes
+# results to about 3,600 spectators at once; viewers past that poll the
+# bracket API every 10 seconds (static/js/main.js). CPU-heavy work does not
+# stall the other greenlets for long: best-of-K draws and PDF layout run in
+# process pools, and a single draw takes well under a second.
+#
+# Each worker keeps its own Prometheus metrics. With PROMETHEUS_MULTIPROC_DIR
+# set, prometheus_client writes them to files in that directory and /metrics
+# adds up the files of all workers (see metrics.py), so it does not matter
+# which worker answers the scrape. The directory is emptied when gunicorn
+# starts; files of workers that exit stay, so their counts are not lost.
+import os
+import shutil
+import tempfile
+
+worker_class = 'gevent'
+worker_connections = 1000
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'chinese-bracket-metrics'))
+
+
+def post_fork(server, worker):
+    # gRPC (Firestore) has to be switched to gevent before the worker imports
+    # the app, which creates the Firestore client. The worker patches the
+    # standard library itself, but only after this hook
+    if server.cfg.worker_class_str != 'gevent':
+        return
+    from gevent import monkey
+    monkey.patch_all()
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+
+def on_starting(server):
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
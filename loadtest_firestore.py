@@ -0,0 +1,168 @@
+# Offline load test for the bracket endpoints
+#
+# Runs generate_bracket, get_bracket, update_match and delete_tournament
+# through the Flask test client against the in-memory Firestore stand-in
+# (firestore_fake), with an injected round-trip latency, and reports
+# per-request timings, write throughput and Firestore operation counts:
+#
+#   python loadtest_firestore.py --players 512 --latency-ms 20 --threads 8
+#   python loadtest_firestore.py --bracket-storage single --profile profile.out
+import argparse
+import cProfile
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+os.environ['STORAGE_BACKEND'] = 'memory'
+# Jobs of in-memory tournaments have no business in the app's job database
+os.environ.setdefault('BRACKET_JOBS_PATH', os.path.join(tempfile.gettempdir(), 'loadtest_bracket_jobs.db'))
+
+
+def _summary(timings: list[float]) -> dict:
+    timings = sorted(timings)
+    if not timings:
+        return {'count': 0}
+    return {
+        'count': len(timings),
+        'p50_ms': round(statistics.median(timings) * 1000, 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 2),
+        'max_ms': round(timings[-1] * 1000, 2),
+    }
+
+
+def _stats_delta(before: dict, after: dict, requests: int) -> dict:
+    """Firestore operations per request between two counter snapshots."""
+    return {key: round((after[key] - before[key]) / max(requests, 1), 2) for key in after}
+
+
+def run(args) -> dict:
+    # Imported here so STORAGE_BACKEND is set before the repository is created
+    from app import app
+    import routes  # noqa: F401
+    from storage import get_repository
+    from bracket_cache import bracket_cache
+
+    logging.getLogger().setLevel(logging.WARNING)
+    repo = get_repository()
+    client = repo.client
+    os.environ['BRACKET_STORAGE'] = args.bracket_storage
+
+    rng = random.Random(args.rng_seed)
+    schools = [f"學校{i}" for i in range(max(1, args.players // 6))]
+    tournament_id = repo.create_tournament({'name': 'Load test', 'date': datetime.now(), 'status': 'setup'})
+    for i in range(args.players):
+        repo.add_player({'name': f"選手{i}", 'school': rng.choice(schools), 'is_seeded': i < args.seeds,
+                         'tournament_id': tournament_id})
+
+    # Latency applies from here on, so setting up large fields stays quick
+    client.latency = args.latency_ms / 1000
+    client.jitter = args.jitter_ms / 1000
+    test_client = app.test_client()
+    report = {'players': args.players, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+              'bracket_storage': args.bracket_storage, 'threads': args.threads}
+
+    # 1. Generate
+    client.stats.reset()
+    start = time.perf_counter()
+    response = test_client.post(f'/tournament/{tournament_id}/generate_bracket', json={})
+    if response.status_code != 202:
+        raise RuntimeError(f"generate_bracket failed (status {response.status_code}): {response.get_json()}")
+    # Generation runs as a background job; poll it like the players page does
+    job_url = response.get_json()['progress_url']
+    while True:
+        job = test_client.get(job_url).get_json()
+        if job['status'] in ('succeeded', 'failed'):
+            break
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    if job['status'] != 'succeeded':
+        raise RuntimeError(f"generate_bracket failed: {job['error']}")
+    stats = client.stats.as_dict()
+    report['generate_bracket'] = {'ms': round(elapsed * 1000, 2), 'firestore': stats,
+                                  'writes_per_second': round(stats['document_writes'] / elapsed) if elapsed else None}
+
+    # 2. Concurrent reads
+    def get_bracket(_):
+        start = time.perf_counter()
+        response = test_client.get(f'/api/tournament/{tournament_id}/bracket')
+        if response.status_code != 200:
+            raise RuntimeError(f"get_bracket failed with status {response.status_code}")
+        return time.perf_counter() - start
+
+    before = client.stats.as_dict()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        timings = list(pool.map(get_bracket, range(args.reads)))
+    report['get_bracket'] = {**_summary(timings), 'firestore_per_request': _stats_delta(before, client.stats.as_dict(), args.reads),
+                             'bracket_cache': bracket_cache.stats()}
+
+    # 3. Concurrent result updates on first-round matches
+    bracket = test_client.get(f'/api/tournament/{tournament_id}/bracket').get_json()
+    first_round = [m for m in bracket['rounds'].get('1', []) if m['player1_id'] and m['player2_id']]
+    matches = first_round[:args.updates]
+
+    def update_match(match):
+        winner = rng.choice((match['player1_id'], match['player2_id']))
+        start = time.perf_counter()
+        response = test_client.post(f"/api/match/{match['id']}/update", json={'winner_id': winner})
+        if response.status_code != 200:
+            raise RuntimeError(f"update_match failed with status {response.status_code}: {response.get_json()}")
+        return time.perf_counter() - start
+
+    before = client.stats.as_dict()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        timings = list(pool.map(update_match, matches))
+    report['update_match'] = {**_summary(timings), 'firestore_per_request': _stats_delta(before, client.stats.as_dict(), len(matches))}
+
+    # 4. Delete the tournament with its players and matches
+    client.stats.reset()
+    start = time.perf_counter()
+    response = test_client.post(f'/tournament/{tournament_id}/delete')
+    elapsed = time.perf_counter() - start
+    if repo.get_tournament(tournament_id) is not None:
+        raise RuntimeError(f"delete_tournament failed (status {response.status_code}), see the log for the error")
+    stats = client.stats.as_dict()
+    report['delete_tournament'] = {'ms': round(elapsed * 1000, 2), 'firestore': stats,
+                                   'writes_per_second': round(stats['document_writes'] / elapsed) if elapsed else None}
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the bracket endpoints against an in-memory Firestore.")
+    parser.add_argument('--players', type=int, default=256, help="Players in the test tournament.")
+    parser.add_argument('--seeds', type=int, default=8, help="Seeded players.")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Injected latency per Firestore round trip.")
+    parser.add_argument('--jitter-ms', type=float, default=5.0, help="Extra random latency per round trip, up to this much.")
+    parser.add_argument('--reads', type=int, default=50, help="Bracket reads to run.")
+    parser.add_argument('--updates', type=int, default=50, help="Result updates to run (first-round matches).")
+    parser.add_argument('--threads', type=int, default=4, help="Concurrent requests.")
+    parser.add_argument('--bracket-storage', choices=['documents', 'single'], default='documents',
+                        help="Bracket storage mode (see bracket_store).")
+    parser.add_argument('--rng-seed', type=int, default=2025, help="Seed for the field and winners.")
+    parser.add_argument('--profile', default=None, help="Write a cProfile dump of the run to this file.")
+    parser.add_argument('--output', default=None, help="Also write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        report = profiler.runcall(run, args)
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+    else:
+        report = run(args)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
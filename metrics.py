@@ -0,0 +1,317 @@
+# Request and Firestore metrics
+#
+# Every request gets a RequestStats (held in a context variable) that the
+# instrumented Firestore client adds to: documents read and written, round
+# trips by operation, transaction retries and the time spent waiting on
+# Firestore. When the request ends its latency and totals go to Prometheus
+# histograms labelled with the Flask endpoint, and a Server-Timing header
+# shows the split in the browser's network panel. Routes can add a 'size'
+# label with tag_request() (get_bracket tags the bracket size), so e.g.
+#
+#   http_request_firestore_reads_sum{endpoint="get_bracket",size="64"}
+#     / http_request_firestore_reads_count{endpoint="get_bracket",size="64"}
+#
+# is the number of reads one bracket request costs at 64 players. Firestore
+# calls made outside a request (bracket jobs, threads started without a copy
+# of the request's context) are labelled endpoint="background".
+#
+# The real client is instrumented by wrapping the RPC methods of its GAPIC
+# client, the in-memory fake through its observer hook. GET /metrics serves
+# the Prometheus text format. Settings:
+#
+#   METRICS_ENABLED           - 0 turns recording and /metrics off, default 1
+#   PROMETHEUS_MULTIPROC_DIR  - directory where each gunicorn worker writes its
+#                               metrics, so /metrics on any worker reports all
+#                               of them (set and emptied by gunicorn.conf.py);
+#                               unset, /metrics shows the answering process only
+#
+# Without the prometheus-client package requests are still counted (the
+# Server-Timing header and request_stats() keep working) but /metrics is off.
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+if ENABLED and MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+BACKGROUND = 'background'
+# Seconds; the defaults stop at 10 s, which bracket generation can pass
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DOCUMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COMMIT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class RequestStats:
+    """Firestore usage of one request, filled in by the instrumented client."""
+    __slots__ = ('endpoint', 'size', 'reads', 'writes', 'round_trips', 'retries', 'errors',
+                 'firestore_seconds', 'operations', 'started')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.size = ''
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+        self.retries = 0
+        self.errors = 0
+        self.firestore_seconds = 0.0
+        self.operations = {} # Operation name -> round trips
+        self.started = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        return {'endpoint': self.endpoint, 'size': self.size, 'reads': self.reads, 'writes': self.writes,
+                'round_trips': self.round_trips, 'retries': self.retries, 'errors': self.errors,
+                'firestore_ms': round(self.firestore_seconds * 1000, 2), 'operations': dict(self.operations)}
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+_stats_lock = threading.Lock()
+
+
+def request_stats() -> RequestStats | None:
+    """The stats of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+@contextmanager
+def tracking(endpoint: str):
+    """
+    Count the Firestore calls of work done outside a request (e.g. a bracket
+    job) in a RequestStats of its own; yields the stats.
+
+    Args:
+        endpoint (str): Label of the work, used for the operation metrics.
+    """
+    stats = RequestStats(endpoint)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def tag_request(size=None) -> None:
+    """
+    Add labels to the metrics of the current request.
+
+    Args:
+        size: Size of the tournament the request worked on (e.g. the
+              bracket size); kept to a few values so label sets stay small.
+    """
+    stats = _current.get()
+    if stats is not None and size is not None:
+        stats.size = str(size)
+
+
+if ENABLED and prometheus_client is not None:
+    from prometheus_client import Counter, Histogram
+
+    REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency until the response is returned',
+                                ['method', 'endpoint', 'status'], buckets=LATENCY_BUCKETS)
+    REQUEST_READS = Histogram('http_request_firestore_reads', 'Firestore documents read per request',
+                              ['endpoint', 'size'], buckets=DOCUMENT_BUCKETS)
+    REQUEST_WRITES = Histogram('http_request_firestore_writes', 'Firestore documents written per request',
+                               ['endpoint', 'size'], buckets=DOCUMENT_BUCKETS)
+    REQUEST_ROUND_TRIPS = Histogram('http_request_firestore_round_trips', 'Firestore RPCs per request',
+                                    ['endpoint', 'size'], buckets=DOCUMENT_BUCKETS)
+    REQUEST_FIRESTORE_SECONDS = Histogram('http_request_firestore_seconds', 'Time per request spent in Firestore calls',
+                                          ['endpoint', 'size'], buckets=LATENCY_BUCKETS)
+    OPERATION_SECONDS = Histogram('firestore_operation_duration_seconds', 'Firestore RPC latency',
+                                  ['operation', 'endpoint'], buckets=LATENCY_BUCKETS)
+    DOCUMENT_READS = Counter('firestore_document_reads', 'Firestore documents read', ['operation', 'endpoint'])
+    DOCUMENT_WRITES = Counter('firestore_document_writes', 'Firestore documents written', ['endpoint'])
+    COMMIT_WRITES = Histogram('firestore_commit_writes', 'Writes per Firestore commit', ['endpoint'],
+                              buckets=COMMIT_BUCKETS)
+    TRANSACTION_RETRIES = Counter('firestore_transaction_retries', 'Transactions begun again after an abort',
+                                  ['endpoint'])
+    OPERATION_ERRORS = Counter('firestore_operation_errors', 'Firestore RPCs that raised', ['operation', 'endpoint'])
+    EXPORTING = True
+else:
+    EXPORTING = False
+
+
+def record_operation(operation: str, seconds: float, reads: int = 0, writes: int = 0,
+                     retry: bool = False, error: bool = False) -> None:
+    """
+    Record one Firestore RPC for the current request (see instrument_firestore).
+
+    Args:
+        operation (str): RPC name, e.g. 'run_query' or 'commit'.
+        seconds (float): Time from the call until its last result.
+        reads (int): Documents returned.
+        writes (int): Writes in a commit.
+        retry (bool): A transaction begun again after an abort.
+        error (bool): The call raised.
+    """
+    stats = _current.get()
+    if stats is not None:
+        with _stats_lock: # Bulk writer threads share their request's stats
+            stats.round_trips += 1
+            stats.operations[operation] = stats.operations.get(operation, 0) + 1
+            stats.reads += reads
+            stats.writes += 0 if error else writes
+            stats.retries += retry
+            stats.errors += error
+            stats.firestore_seconds += seconds
+    if not EXPORTING:
+        return
+    endpoint = stats.endpoint if stats is not None else BACKGROUND
+    OPERATION_SECONDS.labels(operation, endpoint).observe(seconds)
+    if reads:
+        DOCUMENT_READS.labels(operation, endpoint).inc(reads)
+    if operation == 'commit' and not error:
+        DOCUMENT_WRITES.labels(endpoint).inc(writes)
+        COMMIT_WRITES.labels(endpoint).observe(writes)
+    if retry:
+        TRANSACTION_RETRIES.labels(endpoint).inc()
+    if error:
+        OPERATION_ERRORS.labels(operation, endpoint).inc()
+
+
+def _count_found(response) -> int:
+    """Documents in one BatchGetDocuments response; a missing document is billed as a read too."""
+    return 1 if response._pb.WhichOneof('result') in ('found', 'missing') else 0
+
+
+def _count_document(response) -> int:
+    """Documents in one RunQuery response (some carry only progress or a read time)."""
+    return 1 if response._pb.HasField('document') else 0
+
+
+def _wrap_stream(method, operation: str, count):
+    """Wrap a streaming RPC so the reads are counted as the caller consumes the stream."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            responses = method(*args, **kwargs)
+        except Exception:
+            record_operation(operation, time.perf_counter() - start, error=True)
+            raise
+        return _consume(responses, operation, count, start)
+    return wrapper
+
+
+def _consume(responses, operation: str, count, start: float):
+    reads, error = 0, False
+    try:
+        for response in responses:
+            reads += count(response)
+            yield response
+    except Exception:
+        error = True
+        raise
+    finally:
+        # Also runs when the caller stops early (DocumentReference.get reads one response)
+        record_operation(operation, time.perf_counter() - start, reads=reads, error=error)
+
+
+def _wrap_unary(method, operation: str):
+    @functools.wraps(method)
+    def wrapper(*args, request=None, **kwargs):
+        writes, retry = 0, False
+        if isinstance(request, dict):
+            writes = len(request.get('writes') or ())
+            options = request.get('options')
+            retry = bool(options is not None and options.read_write.retry_transaction)
+        start = time.perf_counter()
+        try:
+            response = method(*args, request=request, **kwargs)
+        except Exception:
+            record_operation(operation, time.perf_counter() - start, writes=writes, retry=retry, error=True)
+            raise
+        reads = 1 if operation == 'run_aggregation_query' else 0 # Billed as one read per 1,000 index entries
+        record_operation(operation, time.perf_counter() - start, reads=reads, writes=writes, retry=retry)
+        return response
+    return wrapper
+
+
+def instrument_firestore(client):
+    """
+    Make a Firestore client report its RPCs to record_operation.
+
+    Args:
+        client: A google.cloud.firestore Client, or a firestore_fake client.
+
+    Returns:
+        The same client.
+    """
+    if not ENABLED:
+        return client
+    if hasattr(client, 'observer'):
+        client.observer = record_operation # firestore_fake
+        return client
+    try:
+        api = client._firestore_api # GAPIC client, created on first access and kept by the client
+        for name, count in (('batch_get_documents', _count_found), ('run_query', _count_document)):
+            setattr(api, name, _wrap_stream(getattr(api, name), name, count))
+        for name in ('commit', 'begin_transaction', 'rollback', 'run_aggregation_query'):
+            setattr(api, name, _wrap_unary(getattr(api, name), name))
+    except Exception as e:
+        # The GAPIC client is not public API; run uninstrumented rather than fail
+        logging.warning(f"Could not instrument the Firestore client, Firestore metrics are off: {e}")
+    return client
+
+
+def init_app(app) -> None:
+    """Install the per-request hooks on a Flask app."""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start_request_stats():
+        g.request_stats = RequestStats(request.endpoint or 'unmatched')
+        _current.set(g.request_stats)
+
+    @app.after_request
+    def _record_request_stats(response):
+        stats = g.pop('request_stats', None)
+        if stats is not None:
+            _finish(stats, response.status_code)
+            response.headers['Server-Timing'] = (
+                f'app;dur={(time.perf_counter() - stats.started) * 1000:.1f}, '
+                f'firestore;dur={stats.firestore_seconds * 1000:.1f};desc="{stats.round_trips} calls, {stats.reads} reads"')
+        return response
+
+    @app.teardown_request
+    def _end_request_stats(error):
+        stats = g.pop('request_stats', None)
+        if stats is not None:
+            _finish(stats, 500) # after_request did not run: the view raised
+        _current.set(None)
+
+
+def _finish(stats: RequestStats, status: int) -> None:
+    if not EXPORTING:
+        return
+    REQUEST_SECONDS.labels(request.method, stats.endpoint, str(status)).observe(time.perf_counter() - stats.started)
+    REQUEST_READS.labels(stats.endpoint, stats.size).observe(stats.reads)
+    REQUEST_WRITES.labels(stats.endpoint, stats.size).observe(stats.writes)
+    REQUEST_ROUND_TRIPS.labels(stats.endpoint, stats.size).observe(stats.round_trips)
+    REQUEST_FIRESTORE_SECONDS.labels(stats.endpoint, stats.size).observe(stats.firestore_seconds)
+
+
+def exposition() -> tuple[bytes | None, str]:
+    """Return (metrics in the Prometheus text format, content type); None if metrics are off."""
+    if not EXPORTING:
+        return None, 'text/plain'
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
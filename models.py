@@ -1,3 +1,9 @@
+# Data models
+import logging
+from array import array
+from itertools import chain, count, repeat
+from operator import itemgetter
+
 # SQLAlchemy models have been removed as part of the migration to Firebase Firestore.
 # You will need to redefine your data structures and access logic
 # using the Firebase Admin SDK (db_firestore client) in your routes.
@@ -25,3 +31,260 @@
 
 # Access Firestore using the 'db_firestore' client initialized in app.py
 # from app import db_firestore
+
+# --- Compact bracket model ---
+
+STATUS_PENDING = 0
+STATUS_COMPLETED = 1
+_STATUS_NAMES = ('pending', 'completed')
+
+
+def _lookup(values: list, indices) -> tuple:
+    """values[i] for every i in indices, in one call."""
+    return itemgetter(*indices)(values) if len(indices) > 1 else tuple(values[i] for i in indices)
+
+
+class Bracket:
+    """
+    Single-elimination bracket stored in heap order in flat arrays.
+
+    Match node 1 is the final. The matches feeding node n are 2n (its winner
+    takes the player1 slot) and 2n + 1 (player2 slot), and the first round is
+    nodes total_slots // 2 .. total_slots - 1. Parent, children, round and
+    match number of any match are therefore plain index arithmetic.
+
+    Players are stored as indices into player_ids, with -1 for an empty slot
+    or a bye. match_ids holds the Firestore document ID of each match once known,
+    and versions the tournament bracket_version at which each match was last
+    written (0 if never since the bracket was generated).
+    """
+    __slots__ = ('num_rounds', 'player_ids', 'player1', 'player2', 'winner', 'status', 'versions', 'match_ids', '_index')
+
+    def __init__(self, num_rounds: int, player_ids: list[str] | None = None):
+        size = 1 << num_rounds # Nodes 1 .. size - 1 are matches; index 0 is unused
+        self.num_rounds = num_rounds
+        self.player_ids = list(player_ids or [])
+        self._index = None # player_ids -> code, built on first lookup
+        self.player1 = array('i', [-1]) * size
+        self.player2 = array('i', [-1]) * size
+        self.winner = array('i', [-1]) * size
+        self.status = bytearray(size)
+        self.versions = array('i', [0]) * size
+        self.match_ids = [None] * size
+
+    # --- Navigation ---
+
+    @staticmethod
+    def parent(node: int) -> int:
+        """Node of the match the winner of `node` plays next (0 after the final)."""
+        return node >> 1
+
+    @staticmethod
+    def children(node: int) -> tuple[int, int]:
+        """Nodes of the two matches feeding `node` (player1 side, player2 side)."""
+        return 2 * node, 2 * node + 1
+
+    @staticmethod
+    def next_slot_field(match_number: int) -> str:
+        """Slot in the next match taken by the winner of the given (1-based) match number."""
+        return 'player1_id' if match_number % 2 else 'player2_id'
+
+    @property
+    def total_slots(self) -> int:
+        return 1 << self.num_rounds
+
+    def round_of(self, node: int) -> int:
+        return self.num_rounds - node.bit_length() + 1
+
+    def match_number(self, node: int) -> int:
+        return node - (1 << (node.bit_length() - 1)) + 1
+
+    def node_for(self, round_number: int, match_number: int) -> int:
+        return (1 << (self.num_rounds - round_number)) + match_number - 1
+
+    def round_nodes(self, round_number: int) -> range:
+        start = 1 << (self.num_rounds - round_number)
+        return range(start, 2 * start)
+
+    # --- Players and results ---
+
+    def player_code(self, player_id: str | None) -> int:
+        """Index of player_id in player_ids (added if new), or -1 for None."""
+        if player_id is None:
+            return -1
+        if self._index is None:
+            self._index = {player_id: i for i, player_id in enumerate(self.player_ids)}
+        code = self._index.get(player_id)
+        if code is None:
+            code = len(self.player_ids)
+            self.player_ids.append(player_id)
+            self._index[player_id] = code
+        return code
+
+    def player_id(self, code: int) -> str | None:
+        return self.player_ids[code] if code >= 0 else None
+
+    def set_winner(self, node: int, code: int) -> int:
+        """
+        Record the winner of a match and move them into the next match.
+
+        The winner only fills an empty slot in the next match; an occupied
+        slot is left alone. Returns the next match node, or 0 after the final.
+        """
+        self.winner[node] = code
+        self.status[node] = STATUS_COMPLETED if code >= 0 else STATUS_PENDING
+        parent = node >> 1
+        if parent and code >= 0:
+            slots = self.player2 if node & 1 else self.player1
+            if slots[parent] < 0:
+                slots[parent] = code
+        return parent
+
+    # --- Conversion ---
+
+    @classmethod
+    def from_slots(cls, slot_player_ids: list[str | None]) -> 'Bracket':
+        """
+        Build a bracket from its first-round slots and advance players with a bye.
+
+        Args:
+            slot_player_ids (list): Player ID or None (bye) for each slot; the
+                                    length must be a power of two.
+        """
+        player_ids = dict.fromkeys(slot_player_ids)
+        player_ids.pop(None, None)
+        index = dict(zip(player_ids, count()))
+        # None is left out of the index, so a bye gets code -1
+        return cls.from_slot_codes(list(player_ids), list(map(index.get, slot_player_ids, repeat(-1))))
+
+    @classmethod
+    def from_slot_codes(cls, player_ids: list[str], slot_codes: list[int]) -> 'Bracket':
+        """
+        Same as from_slots, with each slot given as an index into player_ids.
+
+        Args:
+            player_ids (list[str]): Player IDs; they become the bracket's player_ids.
+            slot_codes (list[int]): Index into player_ids, or -1 (bye), for each slot;
+                                    the length must be a power of two.
+        """
+        total_slots = len(slot_codes)
+        bracket = cls(total_slots.bit_length() - 1)
+        bracket.player_ids = list(player_ids)
+        codes = array('i', slot_codes)
+        half = total_slots >> 1
+        bracket.player1[half:total_slots] = player1 = codes[0::2]
+        bracket.player2[half:total_slots] = player2 = codes[1::2]
+
+        if not codes.count(-1):
+            return bracket
+        for node, p1, p2 in zip(range(half, total_slots), player1, player2):
+            if p1 >= 0 and p2 >= 0:
+                continue
+            if p1 < 0 and p2 < 0:
+                # This shouldn't happen with correct bye logic, but handle defensively
+                logging.warning(f"Match {node - half + 1} in round 1 has two byes.")
+                bracket.status[node] = STATUS_COMPLETED
+            else:
+                bracket.set_winner(node, max(p1, p2))
+        return bracket
+
+    @classmethod
+    def from_match_dicts(cls, matches: list[dict]) -> 'Bracket':
+        """
+        Build a bracket from stored match dictionaries (e.g. Firestore documents).
+
+        Each match needs 'round_number' and 'match_number'; 'id' is kept in
+        match_ids. Matches with missing or out-of-range positions are skipped.
+        """
+        num_rounds = max((m.get('round_number') or 0 for m in matches), default=0)
+        bracket = cls(num_rounds)
+        for m in matches:
+            round_number = m.get('round_number')
+            match_number = m.get('match_number')
+            if not round_number or not match_number or match_number > (1 << (num_rounds - round_number)):
+                logging.warning(f"Match {m.get('id')} has an invalid position (round {round_number}, match {match_number}). Skipping.")
+                continue
+            node = bracket.node_for(round_number, match_number)
+            bracket.player1[node] = bracket.player_code(m.get('player1_id'))
+            bracket.player2[node] = bracket.player_code(m.get('player2_id'))
+            bracket.winner[node] = bracket.player_code(m.get('winner_id'))
+            bracket.status[node] = STATUS_COMPLETED if m.get('status') == 'completed' else STATUS_PENDING
+            bracket.versions[node] = m.get('version') or 0
+            bracket.match_ids[node] = m.get('id')
+        return bracket
+
+    def to_match_dicts(self, tournament_id: str) -> list[dict]:
+        """
+        Return one dictionary per match, round 1 first, each round by match number.
+
+        'next_match_index' is the list index of the match the winner goes to
+        (None for the final), and 'next_match_id' is filled in when match IDs are known.
+        """
+        ids = self.player_ids + [None] # Code -1 is the last entry
+        player1, player2, winner, status, versions = self.player1, self.player2, self.winner, self.status, self.versions
+        match_ids = self.match_ids
+        matches = []
+        offset = 0
+        for round_number in range(1, self.num_rounds + 1):
+            start = 1 << (self.num_rounds - round_number)
+            end = 2 * start
+            next_offset = offset + start
+            # The winner of match i (0-based) in this round plays match i // 2 of the next
+            if round_number == self.num_rounds:
+                next_indices = [None]
+            else:
+                next_round = range(next_offset, next_offset + (start >> 1))
+                next_indices = list(chain.from_iterable(zip(next_round, next_round)))
+            columns = zip(range(1, start + 1), _lookup(ids, player1[start:end]), _lookup(ids, player2[start:end]), next_indices)
+            if winner[start:end].count(-1) == status[start:end].count(STATUS_PENDING) == versions[start:end].count(0) == start:
+                # Nothing played yet in this round, as in a new bracket
+                matches += [
+                    {
+                        'tournament_id': tournament_id,
+                        'round_number': round_number,
+                        'match_number': match_number,
+                        'player1_id': p1,
+                        'player2_id': p2,
+                        'winner_id': None,
+                        'next_match_index': next_index,
+                        'status': _STATUS_NAMES[STATUS_PENDING],
+                        'version': 0,
+                    }
+                    for match_number, p1, p2, next_index in columns
+                ]
+            else:
+                matches += [
+                    {
+                        'tournament_id': tournament_id,
+                        'round_number': round_number,
+                        'match_number': match_number,
+                        'player1_id': p1,
+                        'player2_id': p2,
+                        'winner_id': w,
+                        'next_match_index': next_index,
+                        'status': state,
+                        'version': version,
+                    }
+                    for (match_number, p1, p2, next_index), w, state, version in zip(
+                        columns,
+                        _lookup(ids, winner[start:end]),
+                        _lookup(_STATUS_NAMES, status[start:end]),
+                        versions[start:end],
+                    )
+                ]
+            offset = next_offset
+
+        # Document IDs are only known for stored brackets
+        if match_ids.count(None) == len(match_ids):
+            return matches
+        offset = 0
+        for round_number in range(1, self.num_rounds + 1):
+            start = 1 << (self.num_rounds - round_number)
+            for node in range(start, 2 * start):
+                if match_ids[node] is not None:
+                    match = matches[offset + node - start]
+                    match['id'] = match_ids[node]
+                    if round_number != self.num_rounds:
+                        match['next_match_id'] = match_ids[node >> 1]
+            offset += start
+        return matches
@@ -0,0 +1,159 @@
+# Bulk player import (CSV / XLSX)
+#
+# Entering registrations one by one through add_player costs a duplicate
+# query and a write per player. An import instead reads the tournament's
+# existing (name, school) keys once, validates and dedupes every row of the
+# upload in memory, and hands the new players to Repository.add_players,
+# which writes them in chunked batch commits and bumps the bracket version
+# once. The upload is read row by row (CSV from the request stream, XLSX in
+# openpyxl's read-only mode), and nothing is written unless the whole file
+# could be read.
+#
+# The first row may name the columns (name / school / is_seeded, or 姓名 /
+# 學校 / 種子); without a recognised header the columns are taken in that
+# order and the first row is data.
+import csv
+import io
+import logging
+import os
+import zipfile
+
+MAX_IMPORT_ROWS = 5000
+MAX_FIELD_LENGTH = 100
+
+ADDED, DUPLICATE, INVALID = 'added', 'duplicate', 'invalid'
+
+_HEADERS = {
+    'name': {'name', 'player', 'player name', '姓名', '選手', '選手姓名', '选手', '选手姓名'},
+    'school': {'school', '學校', '学校', '學校名稱', '学校名称'},
+    'is_seeded': {'is_seeded', 'seeded', 'seed', '種子', '种子', '種子選手', '种子选手'},
+}
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', 'x', 'v', '✓', '是', '種子', '种子'}
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value) # Spreadsheets store 1 as 1.0
+    return str(value).strip()
+
+
+def _csv_rows(file, encoding: str):
+    stream = io.TextIOWrapper(file, encoding=encoding, newline='')
+    try:
+        yield from csv.reader(stream)
+    finally:
+        stream.detach() # Leave the upload open for its owner
+
+
+def _xlsx_rows(file):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError('XLSX import needs the openpyxl package; please upload a CSV file instead.')
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(file, filename: str, encoding: str = 'utf-8-sig'):
+    """
+    Yield the rows of an uploaded CSV or XLSX file as lists of cell values.
+
+    Args:
+        file: A binary file object (e.g. the uploaded FileStorage's stream).
+        filename (str): The upload's name; '.xlsx' files are read as workbooks
+                        (first sheet), anything else as CSV.
+        encoding (str): Text encoding of a CSV file (e.g. 'big5' for files
+                        saved by older Excel versions).
+    """
+    if os.path.splitext(filename or '')[1].lower() in ('.xlsx', '.xlsm'):
+        return _xlsx_rows(file)
+    return _csv_rows(file, encoding)
+
+
+def _column_map(header: list[str]) -> dict | None:
+    """Column index of each field if the row is a header naming at least name and school, else None."""
+    columns = {}
+    for index, title in enumerate(header):
+        title = title.lower()
+        for field, names in _HEADERS.items():
+            if title in names and field not in columns:
+                columns[field] = index
+    return columns if 'name' in columns and 'school' in columns else None
+
+
+def import_players(repo, tournament_id: str, rows) -> dict:
+    """
+    Validate, dedupe and add the players in the rows of an upload.
+
+    Args:
+        repo (Repository): The storage backend.
+        tournament_id (str): The ID of the tournament.
+        rows (iterable): Rows of cell values, as from read_rows.
+
+    Returns:
+        dict: 'added', 'duplicates' and 'invalid' counts, and 'rows', one
+              report per non-empty row: {'row' (line in the file), 'name',
+              'school', 'is_seeded', 'status' ('added', 'duplicate' or
+              'invalid'), 'error', 'player_id'}.
+
+    Raises:
+        ValueError: If the file cannot be read or has more than
+                    MAX_IMPORT_ROWS rows; nothing is written then.
+    """
+    existing = repo.player_keys(tournament_id)
+    seen = {} # (name, school) -> row number of its first occurrence in the file
+    reports, new_players, new_reports = [], [], []
+    columns = None
+    try:
+        for row_number, values in enumerate(rows, start=1):
+            cells = [_cell(value) for value in values]
+            if not any(cells):
+                continue
+            if columns is None:
+                columns = _column_map(cells)
+                if columns is not None:
+                    continue # Header row
+                columns = {'name': 0, 'school': 1, 'is_seeded': 2}
+            if len(reports) >= MAX_IMPORT_ROWS:
+                raise ValueError(f'The file has more than {MAX_IMPORT_ROWS} players; please split it.')
+
+            def column(field):
+                index = columns.get(field)
+                return cells[index] if index is not None and index < len(cells) else ''
+
+            name, school = column('name'), column('school')
+            report = {'row': row_number, 'name': name, 'school': school,
+                      'is_seeded': column('is_seeded').lower() in _TRUE_VALUES,
+                      'status': INVALID, 'error': None, 'player_id': None}
+            reports.append(report)
+            if not name or not school:
+                report['error'] = 'Player name and school are required'
+            elif len(name) > MAX_FIELD_LENGTH or len(school) > MAX_FIELD_LENGTH:
+                report['error'] = f'Name and school can have at most {MAX_FIELD_LENGTH} characters'
+            elif (name, school) in existing:
+                report['status'], report['error'] = DUPLICATE, 'Player already exists in this tournament'
+            elif (name, school) in seen:
+                report['status'], report['error'] = DUPLICATE, f'Same player as row {seen[(name, school)]}'
+            else:
+                seen[(name, school)] = row_number
+                new_players.append({'name': name, 'school': school, 'is_seeded': report['is_seeded']})
+                new_reports.append(report)
+    except UnicodeDecodeError:
+        raise ValueError('The file is not valid UTF-8 text. Save it as "CSV UTF-8" or choose its encoding.')
+    except (csv.Error, OSError, KeyError, IndexError, zipfile.BadZipFile) as e:
+        raise ValueError(f'Could not read the file: {e}')
+
+    if new_players:
+        player_ids = repo.add_players(tournament_id, new_players)
+        for report, player_id in zip(new_reports, player_ids):
+            report['status'], report['player_id'] = ADDED, player_id
+
+    counts = {status: sum(1 for report in reports if report['status'] == status) for status in (ADDED, DUPLICATE, INVALID)}
+    logging.info(f"Imported {counts[ADDED]} players into tournament {tournament_id} "
+                 f"({counts[DUPLICATE]} duplicates, {counts[INVALID]} invalid rows)")
+    return {'added': counts[ADDED], 'duplicates': counts[DUPLICATE], 'invalid': counts[INVALID], 'rows': reports}
@@ -0,0 +1,165 @@
+# Per-tournament player index
+#
+# The players page used to load every player of the tournament on each
+# visit, and add_player / edit_player each ran a query for players with the
+# same name and school. This worker now keeps the players of recently managed
+# tournaments in memory, sorted by name, with a (name, school) -> player ID
+# map: pages, prefix searches and seeded filters are cut from the sorted
+# list, and duplicate checks are dict lookups.
+#
+# Entries are tagged with the tournament's bracket_reset_version (see
+# storage.BRACKET_RESET_FIELD), which every player write bumps and results do
+# not, so a request checks an entry against the tournament record it reads
+# anyway. Writes made through this worker are applied to the entry in place
+# and move it to the version they produced; if anything else changed the
+# players meanwhile the versions no longer line up and the next request
+# reloads the list with one query. Settings:
+#
+#   PLAYER_INDEX_MAX_ENTRIES  - tournaments kept, default 64
+#   PLAYER_INDEX_TTL          - seconds, default 300 (limits how long a change
+#                               made behind the app's back goes unnoticed)
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from storage import BRACKET_RESET_FIELD, BRACKET_VERSION_FIELD
+
+
+def _fold(text) -> str:
+    """Search form of a name or school: case-insensitive, surrounding spaces ignored."""
+    return (text or '').strip().casefold()
+
+
+def _sort_key(player: dict) -> tuple:
+    return (_fold(player.get('name')), _fold(player.get('school')), player['id'])
+
+
+class PlayerList:
+    """
+    The players of one tournament, sorted by name then school. Never changed
+    once built; writes make a new list, so readers need no lock.
+    """
+    __slots__ = ('players', 'keys', '_sort_keys')
+
+    def __init__(self, players: list[dict]):
+        self.players = sorted(players, key=_sort_key)
+        self._sort_keys = [_sort_key(player) for player in self.players]
+        self.keys = {(player.get('name'), player.get('school')): player['id'] for player in self.players}
+
+    def __len__(self) -> int:
+        return len(self.players)
+
+    def find(self, name: str, school: str) -> str | None:
+        """ID of the player with exactly this name and school, if any."""
+        return self.keys.get((name, school))
+
+    def search(self, name: str = '', school: str = '', seeded: bool | None = None) -> list[dict]:
+        """
+        Players whose name and school start with the given prefixes (ignoring case).
+
+        Args:
+            name (str): Name prefix; found by bisection in the sorted list.
+            school (str): School prefix.
+            seeded (bool | None): Only seeded (True) or unseeded (False) players.
+        """
+        name, school = _fold(name), _fold(school)
+        players = self.players
+        if name:
+            start = bisect_left(self._sort_keys, (name,))
+            end = bisect_left(self._sort_keys, (name + '\U0010ffff',), start)
+            players = players[start:end]
+        if school:
+            players = [player for player in players if _fold(player.get('school')).startswith(school)]
+        if seeded is not None:
+            players = [player for player in players if bool(player.get('is_seeded')) == seeded]
+        return players
+
+    def replace(self, player_id: str, player: dict | None) -> 'PlayerList':
+        """A copy with the player added, changed (player given) or removed (player None)."""
+        players = [p for p in self.players if p['id'] != player_id]
+        if player is not None:
+            insort(players, {**player, 'id': player_id}, key=_sort_key)
+        return PlayerList(players)
+
+
+class PlayerIndex:
+    """Thread-safe LRU of PlayerLists, keyed by tournament ID."""
+
+    def __init__(self, max_entries: int = 64, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # tournament_id -> (reset version, PlayerList, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> 'PlayerIndex':
+        return cls(max_entries=int(environ.get('PLAYER_INDEX_MAX_ENTRIES', 64)),
+                   ttl=float(environ.get('PLAYER_INDEX_TTL', 300)))
+
+    def get(self, repo, tournament: dict) -> PlayerList:
+        """
+        Return the players of a tournament, loading them if the cached list is missing or stale.
+
+        Args:
+            repo (Repository): The storage backend.
+            tournament (dict): The tournament record, as just read for this request.
+        """
+        tournament_id = tournament['id']
+        version = tournament.get(BRACKET_RESET_FIELD) or 0
+        with self._lock:
+            entry = self._entries.get(tournament_id)
+            if entry is not None and entry[0] == version and time.monotonic() < entry[2]:
+                self._entries.move_to_end(tournament_id)
+                self.hits += 1
+                return entry[1]
+            self.loads += 1
+
+        start = time.perf_counter()
+        players = PlayerList(repo.list_players(tournament_id))
+        logging.info(f"Loaded {len(players)} players of tournament {tournament_id} "
+                     f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        self._store(tournament_id, version, players)
+        return players
+
+    def apply(self, tournament: dict, player_id: str, player: dict | None) -> None:
+        """
+        Apply a player write made by this worker (see PlayerList.replace).
+
+        Args:
+            tournament (dict): The tournament record as read before the write;
+                               the write moved it to bracket_version + 1.
+            player_id (str): The player added, changed or deleted.
+            player (dict | None): Its new fields, or None if it was deleted.
+        """
+        tournament_id = tournament['id']
+        with self._lock:
+            entry = self._entries.pop(tournament_id, None)
+        if entry is None or entry[0] != (tournament.get(BRACKET_RESET_FIELD) or 0):
+            return # Not cached, or already behind; the next request reloads it
+        new_version = (tournament.get(BRACKET_VERSION_FIELD) or 0) + 1
+        self._store(tournament_id, new_version, entry[1].replace(player_id, player))
+
+    def invalidate(self, tournament_id: str) -> None:
+        with self._lock:
+            self._entries.pop(tournament_id, None)
+
+    def _store(self, tournament_id: str, version: int, players: PlayerList) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            current = self._entries.get(tournament_id)
+            if current is not None and current[0] > version:
+                return # A newer list was stored meanwhile
+            self._entries[tournament_id] = (version, players, time.monotonic() + self.ttl)
+            self._entries.move_to_end(tournament_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Index of this process
+player_index = PlayerIndex.from_env()
@@ -0,0 +1,279 @@
+# Opt-in request profiler
+#
+# Slow pages in production are hard to reproduce locally, so an admin can
+# profile them where they are slow: a request carrying the admin token in an
+# X-Profile-Token header runs under cProfile (never a query parameter, which
+# would leave the token in access logs, browser history and Referer headers),
+# and PROFILE_SAMPLE_RATE profiles a random fraction of all other
+# requests as well. A bracket generation job queued by a profiled request is
+# profiled too, since create_tournament_bracket runs in the job, not in the
+# request; the bracket preview API draws within the request.
+#
+# Each profile is written to logs/profiles/ as <id>.prof (pstats format, for
+# pstats or snakeviz) and <id>.json: route, status, time, tournament size,
+# the request's Firestore operation counts (see metrics.request_stats) and
+# the functions with the most cumulative time. /admin/profiles lists the
+# recent ones and /admin/profiles/<id>.<prof|txt|json> downloads one; both
+# need the token. cProfile slows the profiled request down, and only one
+# profile runs at a time per worker (others go unprofiled). Settings:
+#
+#   PROFILE_TOKEN        - admin token; unset, profiling and /admin/profiles are off
+#   PROFILE_SAMPLE_RATE  - fraction of requests profiled without the flag, default 0
+#   PROFILE_MIN_MS       - sampled requests faster than this are not kept, default 500
+#   PROFILE_DIR          - default logs/profiles
+#   PROFILE_KEEP         - profiles kept, oldest deleted first, default 50
+import cProfile
+import glob
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import g, request
+
+import metrics
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'profiles')
+HEADER = 'X-Profile-Token'
+TOP_FUNCTIONS = 30
+FORMATS = ('prof', 'txt', 'json')
+_ID_PATTERN = re.compile(r'^[\w-]+$')
+# Never profiled: static files and the endpoints that read profiles and metrics
+_SKIP_PREFIXES = ('/static/', '/admin/', '/metrics')
+
+
+class Profiler:
+    """Runs flagged or sampled requests under cProfile and keeps the results on disk."""
+
+    def __init__(self, token: str | None = None, sample_rate: float = 0.0, min_ms: float = 500.0,
+                 directory: str = DEFAULT_PROFILE_DIR, keep: int = 50):
+        self.token = token or None
+        self.sample_rate = sample_rate
+        self.min_ms = min_ms
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock() # One profile at a time (cProfile on 3.12+ allows only one)
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> 'Profiler':
+        return cls(token=environ.get('PROFILE_TOKEN'),
+                   sample_rate=float(environ.get('PROFILE_SAMPLE_RATE', 0)),
+                   min_ms=float(environ.get('PROFILE_MIN_MS', 500)),
+                   directory=environ.get('PROFILE_DIR', DEFAULT_PROFILE_DIR),
+                   keep=int(environ.get('PROFILE_KEEP', 50)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.token is not None
+
+    def authorized(self) -> bool:
+        """Whether the current request carries the admin token in the X-Profile-Token header."""
+        given = request.headers.get(HEADER)
+        return self.enabled and bool(given) and hmac.compare_digest(given.encode(), self.token.encode())
+
+    def active(self) -> bool:
+        """Whether the current request is being profiled."""
+        return 'profile' in g
+
+    # --- Request hooks ---
+
+    def init_app(self, app) -> None:
+        """Install the request hooks on a Flask app (after metrics.init_app, so the Firestore counts are there)."""
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._abandon_request)
+
+    def _start_request(self) -> None:
+        if request.path.startswith(_SKIP_PREFIXES):
+            return
+        if self.authorized():
+            reason = 'flag'
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = 'sample'
+        else:
+            return
+        profile = self._start()
+        if profile is not None:
+            g.profile = (profile, reason, time.perf_counter())
+
+    def _finish_request(self, response):
+        entry = g.pop('profile', None)
+        if entry is None:
+            return response
+        profile, reason, start = entry
+        self._stop(profile)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if reason == 'sample' and duration_ms < self.min_ms:
+            return response
+        stats = metrics.request_stats()
+        tournament_id = (request.view_args or {}).get('tournament_id')
+        profile_id = self._save(profile, request.endpoint or 'unmatched', {
+            'reason': reason,
+            'method': request.method,
+            'path': request.path,
+            'args': request.args.to_dict(),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'firestore': stats.as_dict() if stats is not None else None,
+            'tournament_id': tournament_id,
+            'tournament': _tournament_size(tournament_id),
+        })
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def _abandon_request(self, error) -> None:
+        # after_request did not run (the request failed before a response was made)
+        entry = g.pop('profile', None)
+        if entry is not None:
+            self._stop(entry[0])
+
+    # --- Profiling outside requests ---
+
+    @contextmanager
+    def profile_block(self, label: str, tournament_id: str | None = None, **details):
+        """
+        Profile a block of work outside a request, e.g. a bracket job.
+
+        Args:
+            label (str): Name of the work, used in the profile ID.
+            tournament_id (str | None): The tournament worked on, for its size.
+            **details: Extra fields for the profile's metadata.
+        """
+        profile = self._start()
+        if profile is None:
+            logging.info(f"Not profiling {label}: another profile is running in this worker")
+            yield
+            return
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            with metrics.tracking(label) as stats:
+                yield
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self._stop(profile)
+            self._save(profile, label, {
+                'reason': 'flag', 'endpoint': label, 'status': status,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                'firestore': stats.as_dict(), 'tournament_id': tournament_id,
+                'tournament': _tournament_size(tournament_id), **details,
+            })
+
+    # --- Stored profiles ---
+
+    def list_profiles(self, limit: int = 50) -> list[dict]:
+        """Metadata of the most recent profiles, newest first."""
+        profiles = []
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json')), reverse=True)[:limit]:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable profile {path}: {e}")
+        return profiles
+
+    def path(self, profile_id: str, fmt: str = 'prof') -> str | None:
+        """Path of a stored profile's .prof or .json file, or None if there is no such profile."""
+        if not _ID_PATTERN.match(profile_id) or fmt not in ('prof', 'json'):
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.{fmt}')
+        return path if os.path.isfile(path) else None
+
+    def report(self, profile_id: str, limit: int = 80) -> str | None:
+        """Text report of a stored profile, sorted by cumulative time."""
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    # --- Internals ---
+
+    def _start(self) -> cProfile.Profile | None:
+        if not self._lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger's) is active in this process
+            self._lock.release()
+            logging.warning(f"Could not start profiling: {e}")
+            return None
+        return profile
+
+    def _stop(self, profile: cProfile.Profile) -> None:
+        profile.disable()
+        self._lock.release()
+
+    def _save(self, profile: cProfile.Profile, label: str, meta: dict) -> str | None:
+        """Write a profile and its metadata; returns its ID."""
+        now = datetime.now(timezone.utc)
+        profile_id = f"{now:%Y%m%d-%H%M%S}-{re.sub(r'[^A-Za-z0-9]+', '_', label)}-{secrets.token_hex(3)}"
+        meta = {'id': profile_id, 'created_at': now.isoformat(), **meta, 'top': _top_functions(profile)}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(os.path.join(self.directory, f'{profile_id}.prof'))
+            with open(os.path.join(self.directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=1, default=str)
+        except OSError as e:
+            logging.error(f"Could not write profile {profile_id}: {e}")
+            return None
+        logging.info(f"Profiled {label} ({meta.get('duration_ms')} ms) as {profile_id}")
+        self._prune()
+        return profile_id
+
+    def _prune(self) -> None:
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json')), reverse=True)[self.keep:]:
+            for stale in (path, path[:-len('.json')] + '.prof'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+def _top_functions(profile: cProfile.Profile, limit: int = TOP_FUNCTIONS) -> list[dict]:
+    """The functions with the most cumulative time, with their own (total) time and calls."""
+    rows = pstats.Stats(profile).stats.items()
+    top = sorted(rows, key=lambda row: row[1][3], reverse=True)[:limit]
+    return [{'function': pstats.func_std_string(func), 'calls': calls, 'total_ms': round(total * 1000, 3),
+             'cumulative_ms': round(cumulative * 1000, 3)}
+            for func, (_, calls, total, cumulative, _) in top]
+
+
+def _tournament_size(tournament_id: str | None) -> dict | None:
+    """Players and matches of the profiled tournament, from its summary fields."""
+    if not tournament_id:
+        return None
+    from storage import COMPLETED_MATCHES_FIELD, MATCH_COUNT_FIELD, PLAYER_COUNT_FIELD, get_repository
+    try:
+        # Not counted as part of the profiled request
+        with metrics.tracking('profiler'):
+            tournament = get_repository().get_tournament(tournament_id)
+    except Exception as e:
+        logging.warning(f"Could not read tournament {tournament_id} for its profile: {e}")
+        return None
+    if tournament is None:
+        return None
+    return {'players': tournament.get(PLAYER_COUNT_FIELD), 'matches': tournament.get(MATCH_COUNT_FIELD),
+            'completed_matches': tournament.get(COMPLETED_MATCHES_FIELD)}
+
+
+# Profiler of this process
+profiler = Profiler.from_env()
@@ -1,56 +1,114 @@
 # Application routes and views
+import hashlib
 import logging
-from flask import render_template, request, redirect, url_for, jsonify, flash, abort
+import os
+from flask import render_template, request, redirect, url_for, jsonify, flash, abort, Response, make_response, session, send_file
 from datetime import datetime
+from functools import lru_cache
 import json
-from google.cloud.firestore import Client, Transaction, DocumentReference, DocumentSnapshot, Query
-from google.cloud import firestore # <-- Add this import
-from google.api_core.exceptions import NotFound
 
-# Import the Firestore client from app.py
-from app import app, db_firestore
-# Removed SQLAlchemy model imports
-# from models import Player, Tournament, Match
-
-# Import functions from tournament.py (these might need adjustments later)
-# Assuming these functions will be adapted to work with Firestore data structures
-from tournament import create_tournament_bracket, update_match_result, get_tournament_bracket
-
-# --- Helper Functions for Firestore ---
-
-def _get_doc_or_404(doc_ref: DocumentReference) -> DocumentSnapshot:
-    """Gets a Firestore document or raises 404."""
+from app import app
+# Routes go through the storage layer (Firestore or SQLite, see storage.py)
+from storage import BRACKET_VERSION_FIELD, PLAYER_COUNT_FIELD, NotFoundError, get_repository
+
+from tournament import get_bracket_preview, get_tournament_bracket, get_tournament_bracket_delta_json, get_tournament_bracket_json
+import bracket_pdf
+import bracket_svg
+from bracket_cache import bracket_cache
+from bracket_events import MAX_CLIENTS as MAX_EVENT_CLIENTS, RETRY_AFTER_SECONDS as EVENTS_RETRY_AFTER, event_hub
+from bracket_jobs import create_preview, job_queue, players_fingerprint
+from player_import import import_players as import_players_from_rows, read_rows
+from player_index import player_index
+from data_export import COLUMNS as EXPORT_COLUMNS, FORMATS as EXPORT_FORMATS, encode as encode_export, export_rows
+import metrics
+from profiler import FORMATS as PROFILE_FORMATS, profiler
+
+# Request latency and Firestore usage per route, served at /metrics
+metrics.init_app(app)
+# Opt-in cProfile runs of flagged requests, listed at /admin/profiles
+profiler.init_app(app)
+
+# Largest batch accepted by the batch result endpoint
+MAX_BATCH_RESULTS = 1024
+# Tournaments per page of the home page
+TOURNAMENTS_PER_PAGE = 20
+# Players per page of the players page
+PLAYERS_PER_PAGE = 50
+
+# --- Helper Functions for Storage ---
+
+def _get_or_404(record: dict | None, description: str) -> dict:
+    """Returns a record fetched from the repository or raises 404."""
+    if record is None:
+        abort(404, description=f"Not found: {description}")
+    return record
+
+def _fetch_or_404(fetch, record_id: str, description: str) -> dict:
+    """Fetches a record by ID or raises 404 (or 500 if storage fails)."""
     try:
-        doc = doc_ref.get()
-        if not doc.exists:
-            abort(404, description=f"Document not found: {doc_ref.path}")
-        return doc
-    except NotFound:
-        abort(404, description=f"Document not found: {doc_ref.path}")
+        record = fetch(record_id)
     except Exception as e:
-        logging.error(f"Error fetching document {doc_ref.path}: {e}")
+        logging.error(f"Error fetching {description} {record_id}: {e}")
         abort(500, description="Error accessing database")
-
-def _doc_to_dict(doc: DocumentSnapshot) -> dict:
-    """Converts a Firestore document snapshot to a dict, adding the ID."""
-    data = doc.to_dict()
-    if data is not None:
-        data['id'] = doc.id
-    return data
+    return _get_or_404(record, f"{description} {record_id}")
+
+def _bracket_changed(tournament_id: str) -> None:
+    """Drops this worker's cached bracket and notifies its live event clients after a write."""
+    bracket_cache.invalidate(tournament_id)
+    event_hub.publish(tournament_id)
+
+def _not_modified(etag: str, cache_control: str) -> Response | None:
+    """Returns a 304 response if the request's If-None-Match already has this ETag."""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def _wants_json() -> bool:
+    """Whether the client asked for a JSON answer rather than a redirect."""
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+@lru_cache(maxsize=None)
+def _template_digest(*names: str) -> str:
+    """Short digest of template sources, so page ETags change when the app is redeployed."""
+    digest = hashlib.sha1()
+    for name in names:
+        with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:8]
+
+def _bracket_size(tournament: dict) -> int:
+    """Slots of the tournament's bracket (players rounded up to a power of two), for metric labels."""
+    players = tournament.get(PLAYER_COUNT_FIELD) or 0
+    return 1 << (players - 1).bit_length() if players > 1 else players
 
 # --- Routes ---
 
 @app.route('/')
 def index():
-    """Home page with list of tournaments"""
-    if not db_firestore:
+    """
+    Home page with a page of tournaments, newest first.
+
+    Pages are chained with ?cursor=<ID of the previous page's last
+    tournament>, and the summary columns come from the tournament records
+    themselves, so a page costs one bounded query however many tournaments
+    are stored.
+    """
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return render_template('index.html', tournaments=[])
+    cursor = request.args.get('cursor') or None
+    next_cursor = None
     try:
-        tournaments_ref = db_firestore.collection('tournaments').order_by('date', direction=Query.DESCENDING)
-        docs = tournaments_ref.stream()
-        tournaments = [_doc_to_dict(doc) for doc in docs]
-        # Convert Firestore Timestamp to Date string for template if needed
+        try:
+            tournaments, next_cursor = repo.list_tournaments_page(TOURNAMENTS_PER_PAGE, cursor)
+        except NotFoundError:
+            # The page started after a tournament that has since been deleted
+            return redirect(url_for('index'))
+        # Convert date to a string for the template if needed
         for t in tournaments:
             if 'date' in t and isinstance(t['date'], datetime):
                 t['date_str'] = t['date'].strftime('%Y-%m-%d') # Or keep as datetime object if template handles it
@@ -58,40 +116,40 @@ def index():
         logging.error(f"Error fetching tournaments: {e}")
         flash("Error fetching tournaments.", "error")
         tournaments = []
-    return render_template('index.html', tournaments=tournaments)
+    return render_template('index.html', tournaments=tournaments, next_cursor=next_cursor, is_first_page=cursor is None)
 
 @app.route('/tournament/new', methods=['POST'])
 def new_tournament():
     """Create a new tournament"""
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('index'))
     try:
         name = request.form.get('name')
         date_str = request.form.get('date')
-        
+
         if not name or not date_str:
             flash('Tournament name and date are required', 'error')
             return redirect(url_for('index'))
-        
-        # Convert date string to Firestore Timestamp (more flexible than Date)
+
+        # Convert date string to a datetime (stored as a Firestore Timestamp)
         try:
             tournament_date = datetime.strptime(date_str, '%Y-%m-%d')
         except ValueError:
             flash('Invalid date format. Please use YYYY-MM-DD.', 'error')
             return redirect(url_for('index'))
-        
+
         tournament_data = {
             'name': name,
-            'date': tournament_date, # Store as Firestore Timestamp
+            'date': tournament_date,
             'status': 'setup' # setup, in_progress, completed
         }
-        # Add new tournament document, Firestore auto-generates ID
-        update_time, doc_ref = db_firestore.collection('tournaments').add(tournament_data)
-        
+        tournament_id = repo.create_tournament(tournament_data)
+
         flash(f'Tournament "{name}" created successfully', 'success')
         # Redirect to player management for the new tournament ID (string)
-        return redirect(url_for('players', tournament_id=doc_ref.id))
+        return redirect(url_for('players', tournament_id=tournament_id))
     except Exception as e:
         logging.error(f"Error creating tournament: {e}")
         flash(f'Error creating tournament: {str(e)}', 'error')
@@ -99,80 +157,169 @@ def new_tournament():
 
 @app.route('/tournament/<string:tournament_id>/players')
 def players(tournament_id):
-    """Page for managing players in a tournament"""
-    if not db_firestore:
+    """
+    Page for managing players in a tournament.
+
+    Shows PLAYERS_PER_PAGE players at a time, filtered by ?name= and ?school=
+    prefixes and ?seeded=1/0, from this worker's player index. JSON clients
+    get the page of players with the counts.
+    """
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('index'))
 
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    tournament_doc = _get_doc_or_404(tournament_ref)
-    tournament = _doc_to_dict(tournament_doc)
-
-    players_list = []
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+
+    # Players only change with bracket_version, but the page also shows the status
+    # (set after a bracket is generated), a running generation job and, once,
+    # any flashed messages. JSON and HTML share the URL, so the ETag names the
+    # representation and caches are told the answer varies with Accept.
+    active_job = job_queue.active_job(tournament_id)
+    wants_json = _wants_json()
+    etag = (f"players-{'json' if wants_json else 'html'}-{tournament.get(BRACKET_VERSION_FIELD, 0)}-"
+            f"{tournament.get('status')}-{active_job['id'] if active_job else '-'}-"
+            f"{_template_digest('layout.html', 'players.html')}")
+    has_flashes = '_flashes' in session
+    if not has_flashes:
+        not_modified = _not_modified(etag, 'private, no-cache')
+        if not_modified:
+            not_modified.vary.add('Accept')
+            return not_modified
+
+    filters = {'name': request.args.get('name', '').strip(), 'school': request.args.get('school', '').strip(),
+               'seeded': request.args.get('seeded', '')}
+    seeded = {'1': True, '0': False}.get(filters['seeded'])
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    players_list, player_count, match_count = [], 0, 0
     try:
-        players_query = db_firestore.collection('players').where('tournament_id', '==', tournament_id).order_by('name')
-        docs = players_query.stream()
-        players_list = [_doc_to_dict(doc) for doc in docs]
+        all_players = player_index.get(repo, tournament)
+        matches = all_players.search(filters['name'], filters['school'], seeded)
+        player_count, match_count = len(all_players), len(matches)
+        page = min(page, max((match_count + PLAYERS_PER_PAGE - 1) // PLAYERS_PER_PAGE, 1))
+        players_list = matches[(page - 1) * PLAYERS_PER_PAGE:page * PLAYERS_PER_PAGE]
     except Exception as e:
         logging.error(f"Error fetching players for tournament {tournament_id}: {e}")
         flash("Error fetching players.", "error")
-
-    return render_template('players.html', tournament=tournament, players=players_list)
+        has_flashes = True
+    pages = max((match_count + PLAYERS_PER_PAGE - 1) // PLAYERS_PER_PAGE, 1)
+
+    if wants_json:
+        response = jsonify({'players': players_list, 'page': page, 'pages': pages, 'total': match_count,
+                            'player_count': player_count})
+    else:
+        response = make_response(render_template('players.html', tournament=tournament, players=players_list,
+                                                 player_count=player_count, match_count=match_count, page=page,
+                                                 pages=pages, filters=filters, active_job=active_job,
+                                                 filter_args={key: value for key, value in filters.items() if value}))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept')
+    if not has_flashes:
+        response.set_etag(etag)
+    return response
 
 @app.route('/tournament/<string:tournament_id>/add_player', methods=['POST'])
 def add_player(tournament_id):
     """Add a player to a tournament"""
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('players', tournament_id=tournament_id))
 
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    _get_doc_or_404(tournament_ref) # Ensure tournament exists
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament") # Ensure tournament exists
 
     try:
         name = request.form.get('name')
         school = request.form.get('school')
         is_seeded = request.form.get('is_seeded') == 'on'
-        
+
         if not name or not school:
             flash('Player name and school are required', 'error')
             return redirect(url_for('players', tournament_id=tournament_id))
-        
+
         # Check if a player with the same name and school already exists in this tournament
-        players_ref = db_firestore.collection('players')
-        existing_player_query = players_ref.where('tournament_id', '==', tournament_id).where('name', '==', name).where('school', '==', school).limit(1)
-        existing_docs = list(existing_player_query.stream()) # Use list() to execute query
-        
-        if existing_docs:
+        if player_index.get(repo, tournament).find(name, school):
             flash(f'A player named "{name}" from "{school}" already exists in this tournament', 'error')
             return redirect(url_for('players', tournament_id=tournament_id))
-        
+
         player_data = {
             'name': name,
             'school': school,
             'is_seeded': is_seeded,
             'tournament_id': tournament_id # Store tournament ID as string
-            # Consider adding an 'order' field if drag-and-drop requires it
         }
-        db_firestore.collection('players').add(player_data)
-        
+        player_id = repo.add_player(player_data)
+        player_index.apply(tournament, player_id, player_data)
+        _bracket_changed(tournament_id)
+
         flash(f'Player "{name}" added successfully', 'success')
     except Exception as e:
         logging.error(f"Error adding player to tournament {tournament_id}: {e}")
         flash(f'Error adding player: {str(e)}', 'error')
-    
+
+    return redirect(url_for('view_tournament', tournament_id=tournament_id))
+
+@app.route('/tournament/<string:tournament_id>/import_players', methods=['POST'])
+def import_players(tournament_id):
+    """
+    Add players from an uploaded CSV or XLSX file (see player_import).
+
+    JSON clients get the per-row report; forms are sent back to the players
+    page with a summary.
+    """
+    repo = get_repository()
+    wants_json = _wants_json()
+    if not repo:
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Database connection not available.'}), 503
+        flash("Database connection not available.", "error")
+        return redirect(url_for('players', tournament_id=tournament_id))
+
+    _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+
+    upload = request.files.get('file')
+    try:
+        if upload is None or not upload.filename:
+            raise ValueError('Please choose a CSV or XLSX file to import')
+        rows = read_rows(upload.stream, upload.filename, request.form.get('encoding') or 'utf-8-sig')
+        report = import_players_from_rows(repo, tournament_id, rows)
+    except (ValueError, LookupError) as e:
+        # LookupError: unknown encoding name
+        if wants_json:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('players', tournament_id=tournament_id))
+    except Exception as e:
+        logging.error(f"Error importing players into tournament {tournament_id}: {e}", exc_info=True)
+        if wants_json:
+            return jsonify({'success': False, 'error': f'Error importing players: {str(e)}'}), 500
+        flash(f'Error importing players: {str(e)}', 'error')
+        return redirect(url_for('players', tournament_id=tournament_id))
+
+    if report['added']:
+        player_index.invalidate(tournament_id)
+        _bracket_changed(tournament_id)
+    if wants_json:
+        return jsonify({'success': True, **report})
+    flash(f"Imported {report['added']} players ({report['duplicates']} duplicates, {report['invalid']} invalid rows skipped)",
+          'success' if report['added'] else 'info')
+    problems = [row for row in report['rows'] if row['error']]
+    if problems:
+        details = '; '.join(f"row {row['row']}: {row['error']}" for row in problems[:5])
+        more = f" and {len(problems) - 5} more" if len(problems) > 5 else ''
+        flash(f"Skipped {details}{more}", 'warning')
     return redirect(url_for('players', tournament_id=tournament_id))
 
 @app.route('/tournament/<string:tournament_id>/edit_player/<string:player_id>', methods=['POST'])
 def edit_player(tournament_id, player_id):
     """Edit a player's details"""
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('players', tournament_id=tournament_id))
 
-    player_ref = db_firestore.collection('players').document(player_id)
-    player_doc = _get_doc_or_404(player_ref)
-    player_data = _doc_to_dict(player_doc)
+    player_data = _fetch_or_404(repo.get_player, player_id, "player")
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
 
     # Ensure player belongs to the specified tournament
     if player_data.get('tournament_id') != tournament_id:
@@ -183,25 +330,13 @@ def edit_player(tournament_id, player_id):
         new_name = request.form.get('name')
         new_school = request.form.get('school')
         new_is_seeded = request.form.get('is_seeded') == 'on'
-        
+
         if not new_name or not new_school:
              flash('Player name and school cannot be empty.', 'error')
              return redirect(url_for('players', tournament_id=tournament_id))
 
         # Check for duplicates, excluding the current player
-        players_ref = db_firestore.collection('players')
-        existing_player_query = players_ref.where('tournament_id', '==', tournament_id) \
-                                         .where('name', '==', new_name) \
-                                         .where('school', '==', new_school)
-
-        existing_docs = list(existing_player_query.stream())
-
-        # Filter out the current player from the results
-        duplicate_exists = False
-        for doc in existing_docs:
-            if doc.id != player_id:
-                duplicate_exists = True
-                break
+        duplicate_exists = player_index.get(repo, tournament).find(new_name, new_school) not in (None, player_id)
 
         if duplicate_exists:
             flash(f'Another player named "{new_name}" from "{new_school}" already exists in this tournament', 'error')
@@ -213,7 +348,9 @@ def edit_player(tournament_id, player_id):
             'school': new_school,
             'is_seeded': new_is_seeded
         }
-        player_ref.update(update_data)
+        repo.update_player(tournament_id, player_id, update_data)
+        player_index.apply(tournament, player_id, {**player_data, **update_data})
+        _bracket_changed(tournament_id)
 
         flash('Player updated successfully', 'success')
     except Exception as e:
@@ -225,17 +362,13 @@ def edit_player(tournament_id, player_id):
 @app.route('/tournament/<string:tournament_id>/delete_player/<string:player_id>', methods=['POST'])
 def delete_player(tournament_id, player_id):
     """Delete a player from a tournament. Needs careful handling if bracket exists."""
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('players', tournament_id=tournament_id))
 
-    player_ref = db_firestore.collection('players').document(player_id)
-    player_doc = _get_doc_or_404(player_ref)
-    player_data = _doc_to_dict(player_doc)
-
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    tournament_doc = _get_doc_or_404(tournament_ref)
-    tournament_data = _doc_to_dict(tournament_doc)
+    player_data = _fetch_or_404(repo.get_player, player_id, "player")
+    tournament_data = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
 
     # Ensure player belongs to the specified tournament
     if player_data.get('tournament_id') != tournament_id:
@@ -251,8 +384,9 @@ def delete_player(tournament_id, player_id):
             flash('Cannot delete players after the tournament bracket has been generated.', 'error')
             return redirect(url_for('players', tournament_id=tournament_id))
 
-        # Delete the player document
-        player_ref.delete()
+        repo.delete_player(tournament_id, player_id)
+        player_index.apply(tournament_data, player_id, None)
+        _bracket_changed(tournament_id)
         flash('Player deleted successfully', 'success')
 
     except Exception as e:
@@ -261,127 +395,149 @@ def delete_player(tournament_id, player_id):
 
     return redirect(url_for('players', tournament_id=tournament_id))
 
+def _generation_params() -> dict:
+    """Best-of-K options of a generate or preview request (form or JSON)."""
+    form = request.get_json(silent=True) if request.is_json else request.form
+    try:
+        return {'candidates': max(1, int((form or {}).get('candidates') or 1)),
+                'time_budget': float((form or {}).get('time_budget') or 5.0)}
+    except (TypeError, ValueError):
+        return {'candidates': 1, 'time_budget': 5.0}
+
+def _queue_generation(tournament_id: str, params: dict):
+    """Queues a generation job; JSON clients get 202 with the job, forms go back to the players page."""
+    wants_json = _wants_json()
+    if profiler.active():
+        params = {**params, 'profile': True} # Profile the job too, it does the drawing
+    try:
+        job, created = job_queue.submit(tournament_id, params)
+    except Exception as e:
+        logging.error(f"Error queueing bracket generation for tournament {tournament_id}: {e}")
+        if wants_json:
+            return jsonify({'error': f'Error queueing bracket generation: {str(e)}'}), 500
+        flash(f'Error generating bracket: {str(e)}', 'error')
+        return redirect(url_for('players', tournament_id=tournament_id))
+
+    if wants_json:
+        response = jsonify({'job_id': job['id'], 'created': created, 'job': job,
+                            'progress_url': url_for('get_job', job_id=job['id'])})
+        response.status_code = 202
+        response.headers['Location'] = url_for('get_job', job_id=job['id'])
+        return response
+    if created:
+        flash('Bracket generation started', 'info')
+    else:
+        flash('Bracket generation is already in progress', 'info')
+    return redirect(url_for('players', tournament_id=tournament_id))
+
 @app.route('/tournament/<string:tournament_id>/generate_bracket', methods=['POST'])
 def generate_bracket(tournament_id):
-    """Generate the tournament bracket using Firestore data."""
-    if not db_firestore:
+    """
+    Queue generation of the tournament bracket (see bracket_jobs).
+
+    The tournament keeps its current bracket until the job has stored the new
+    one. JSON clients get 202 with the job; forms are sent back to the players
+    page, which shows the job's progress.
+    """
+    repo = get_repository()
+    if not repo:
+        if _wants_json():
+            return jsonify({'error': 'Database connection not available.'}), 503
         flash("Database connection not available.", "error")
         return redirect(url_for('players', tournament_id=tournament_id))
 
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    tournament_doc = _get_doc_or_404(tournament_ref)
-    # tournament_data = _doc_to_dict(tournament_doc) # Raw data if needed
-
-    try:
-        # Fetch players for the tournament from Firestore
-        players_query = db_firestore.collection('players').where('tournament_id', '==', tournament_id)
-        player_docs = list(players_query.stream()) # Execute query
+    _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+    # Optional best-of-K mode: draw several candidates in a process pool and keep the fairest
+    return _queue_generation(tournament_id, _generation_params())
 
-        if len(player_docs) < 2:
-            flash('At least 2 players are required to generate a bracket', 'error')
-            return redirect(url_for('players', tournament_id=tournament_id))
+@app.route('/api/tournament/<string:tournament_id>/bracket/preview', methods=['POST'])
+def preview_bracket(tournament_id):
+    """
+    API endpoint that draws a bracket without writing it to the tournament.
 
-        players_list = [_doc_to_dict(doc) for doc in player_docs]
-
-        # --- Clear existing matches for this tournament ---
-        # This is crucial to prevent duplicate/old matches.
-        # Use a batch delete for efficiency.
-        existing_matches_query = db_firestore.collection('matches').where('tournament_id', '==', tournament_id)
-        existing_match_docs = list(existing_matches_query.stream()) # Get all docs to delete
-        if existing_match_docs:
-            batch = db_firestore.batch()
-            for doc in existing_match_docs:
-                batch.delete(doc.reference)
-            batch.commit()
-            logging.info(f"Deleted {len(existing_match_docs)} existing matches for tournament {tournament_id}")
-        # --- End Clearing ---
-
-        # Prepare player data structure expected by create_tournament_bracket
-        # Assuming it needs a list of dictionaries with 'id', 'name', 'school', 'is_seeded'
-        # Adapt this based on the actual requirements of create_tournament_bracket
-        players_for_bracket = players_list # Use the list fetched earlier
-
-        # Generate new bracket structure (list of match dictionaries)
-        # IMPORTANT: create_tournament_bracket needs to be adapted for Firestore IDs (strings)
-        # and return data compatible with Firestore (e.g., player IDs as strings)
-        try:
-             # Pass string IDs
-            generated_matches_data = create_tournament_bracket(tournament_id, players_for_bracket)
-        except Exception as bracket_error:
-             logging.error(f"Error calling create_tournament_bracket for {tournament_id}: {bracket_error}")
-             flash(f"Internal error during bracket generation: {bracket_error}", "error")
-             return redirect(url_for('players', tournament_id=tournament_id))
+    Returns the draft in the format of the bracket API, plus 'preview' with
+    the token to commit it under and the draw's quality stats. Accepts the
+    same 'candidates' and 'time_budget' options as generate_bracket.
+    """
+    try:
+        preview = create_preview(tournament_id, _generation_params())
+    except NotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error previewing bracket for tournament {tournament_id}: {e}", exc_info=True)
+        return jsonify({'error': f'Error previewing bracket: {str(e)}'}), 500
+    return jsonify(preview)
 
+@app.route('/api/tournament/<string:tournament_id>/bracket/preview/<string:token>')
+def get_bracket_preview_api(tournament_id, token):
+    """API endpoint returning a stored preview again, in the same format as preview_bracket."""
+    try:
+        preview = job_queue.get_preview(token, tournament_id)
+    except Exception as e:
+        logging.error(f"Error fetching bracket preview {token}: {e}")
+        return jsonify({'error': 'Error accessing preview store'}), 500
+    if preview is None:
+        return jsonify({'error': 'Bracket preview not found. It may have expired or been committed already.'}), 404
+    bracket_data = get_bracket_preview(tournament_id, preview['matches'], preview['players'], token)
+    bracket_data['preview'] = {'token': token, 'expires_at': preview['expires_at'], 'stats': preview['stats']}
+    return jsonify(bracket_data)
+
+@app.route('/tournament/<string:tournament_id>/bracket/preview/<string:token>/commit', methods=['POST'])
+def commit_bracket_preview(tournament_id, token):
+    """
+    Queue saving a previewed bracket exactly as it was drawn.
+
+    Answers like generate_bracket. The preview must not have expired, and the
+    tournament's players must not have changed since it was drawn (409).
+    """
+    repo = get_repository()
+    wants_json = _wants_json()
+    if not repo:
+        if wants_json:
+            return jsonify({'error': 'Database connection not available.'}), 503
+        flash("Database connection not available.", "error")
+        return redirect(url_for('players', tournament_id=tournament_id))
 
-        # Save generated matches and link them using Firestore IDs
-        if generated_matches_data:
-            matches_ref = db_firestore.collection('matches')
-            match_refs_with_indices = [] # Store tuples of (doc_ref, original_index)
-            batch_create = db_firestore.batch()
-
-            # First pass: Create all match documents and store their refs + original index
-            for i, match_data in enumerate(generated_matches_data):
-                match_data['tournament_id'] = tournament_id
-                # Don't save next_match_index to Firestore
-                next_match_idx = match_data.pop('next_match_index', None)
-                new_match_ref = matches_ref.document() # Generate ref for new doc
-                batch_create.set(new_match_ref, match_data)
-                # Corrected variable name here
-                match_refs_with_indices.append({'ref': new_match_ref, 'original_index': i, 'next_match_original_index': next_match_idx})
-
-            batch_create.commit()
-            logging.info(f"Created {len(generated_matches_data)} match documents for tournament {tournament_id}")
-
-            # Create a map from original index to Firestore document ID
-            index_to_id_map = {item['original_index']: item['ref'].id for item in match_refs_with_indices}
-
-            # Second pass: Update matches with the correct next_match_id
-            batch_update = db_firestore.batch()
-            updates_prepared = 0
-            for item in match_refs_with_indices:
-                next_original_idx = item.get('next_match_original_index')
-                if next_original_idx is not None:
-                    next_match_firestore_id = index_to_id_map.get(next_original_idx)
-                    if next_match_firestore_id:
-                        batch_update.update(item['ref'], {'next_match_id': next_match_firestore_id})
-                        updates_prepared += 1
-                    else:
-                        logging.warning(f"Could not find Firestore ID for next_match_index {next_original_idx} when updating match {item['ref'].id}")
-
-            if updates_prepared > 0:
-                batch_update.commit()
-                logging.info(f"Updated {updates_prepared} matches with next_match_id links for tournament {tournament_id}")
-
-        else:
-            logging.warning(f"create_tournament_bracket returned no matches for {tournament_id}")
-
-
-        # Update tournament status
-        tournament_ref.update({'status': 'in_progress'})
-
-        flash('Tournament bracket generated successfully', 'success')
-        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+    # Checked here for a quick answer; the job checks again before saving
+    preview = job_queue.get_preview(token, tournament_id)
+    error, status = None, None
+    if preview is None:
+        error, status = 'Bracket preview not found. It may have expired or been committed already.', 404
+    elif preview['players_fingerprint'] != players_fingerprint(repo.list_players(tournament_id)):
+        error, status = 'Players have changed since the preview was drawn. Please preview the bracket again.', 409
+    if error:
+        if wants_json:
+            return jsonify({'error': error}), status
+        flash(error, 'error')
+        return redirect(url_for('players', tournament_id=tournament_id))
+    return _queue_generation(tournament_id, {'preview': token})
 
+@app.route('/api/jobs/<string:job_id>')
+def get_job(job_id):
+    """API endpoint with the status, phase and progress (0-100) of a background job."""
+    try:
+        job = job_queue.get(job_id)
     except Exception as e:
-        logging.error(f"Error generating bracket for tournament {tournament_id}: {e}")
-        # Rollback not needed explicitly for Firestore batch/single ops unless using transactions
-        flash(f'Error generating bracket: {str(e)}', 'error')
-        # Attempt to reset status if generation failed mid-way? Maybe not necessary.
-        # tournament_ref.update({'status': 'setup'})
-        return redirect(url_for('players', tournament_id=tournament_id))
+        logging.error(f"Error fetching job {job_id}: {e}")
+        return jsonify({'error': 'Error accessing job queue'}), 500
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
 
 
 @app.route('/tournament/<string:tournament_id>')
 def view_tournament(tournament_id):
     """View tournament bracket page"""
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         # Decide how to render - maybe a minimal page indicating DB error
         return render_template('tournament.html', tournament={'id': tournament_id, 'name': 'Error Loading Tournament', 'error': True}, bracket_data=None)
 
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    tournament_doc = _get_doc_or_404(tournament_ref)
-    tournament = _doc_to_dict(tournament_doc)
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
     if 'date' in tournament and isinstance(tournament['date'], datetime):
          tournament['date_str'] = tournament['date'].strftime('%Y-%m-%d')
 
@@ -392,45 +548,139 @@ def view_tournament(tournament_id):
 
 @app.route('/api/tournament/<string:tournament_id>/bracket')
 def get_bracket(tournament_id):
-    """API endpoint to get tournament bracket data from Firestore."""
-    if not db_firestore:
+    """
+    API endpoint to get tournament bracket data.
+
+    With ?since=<version> (the 'version' of bracket data the client already
+    has) only the matches changed since then are returned, or a
+    'full_reload' marker.
+    """
+    if not get_repository():
         return jsonify({'error': 'Database connection not available.'}), 503
 
+    since = request.args.get('since', type=int)
     try:
-        # IMPORTANT: get_tournament_bracket function needs modification
-        # to fetch data from Firestore instead of SQLAlchemy.
-        # It should query the 'matches' collection for the given tournament_id
-        # and potentially the 'players' collection to populate player names.
-        bracket_data = get_tournament_bracket(tournament_id) # Pass string ID
-        return jsonify(bracket_data)
+        if since is not None:
+            return Response(get_tournament_bracket_delta_json(tournament_id, since), mimetype='application/json')
+
+        # Revalidation (If-None-Match) costs only the tournament read
+        tournament = get_repository().get_tournament(tournament_id)
+        etag = None
+        if tournament is not None:
+            metrics.tag_request(size=_bracket_size(tournament))
+            etag = f"bracket-{tournament.get(BRACKET_VERSION_FIELD, 0)}"
+            not_modified = _not_modified(etag, 'no-cache')
+            if not_modified:
+                return not_modified
+
+        # Pre-encoded payload, served from the bracket cache while it is current
+        cached = get_tournament_bracket_json(tournament_id, tournament)
+        response = Response(cached.body, mimetype='application/json')
+        response.headers['Cache-Control'] = 'no-cache'
+        if etag and not cached.error:
+            response.set_etag(etag)
+        return response
     except Exception as e:
         logging.error(f"API Error fetching bracket for {tournament_id}: {e}")
         return jsonify({'error': f'Failed to retrieve bracket data: {str(e)}'}), 500
 
-# IMPORTANT: Changed match_id to string
+@app.route('/api/tournament/<string:tournament_id>/events')
+def tournament_events(tournament_id):
+    """
+    Server-Sent Events stream of bracket deltas (see bracket_events).
+
+    Resumes from the Last-Event-ID header, or from ?since=<version> on the
+    first connection.
+    """
+    repo = get_repository()
+    if not repo:
+        return jsonify({'error': 'Database connection not available.'}), 503
+    try:
+        tournament = repo.get_tournament(tournament_id)
+    except Exception as e:
+        logging.error(f"Error fetching tournament {tournament_id} for events: {e}")
+        return jsonify({'error': 'Error accessing database'}), 500
+    if tournament is None:
+        return jsonify({'error': 'Tournament not found. It may have been deleted.'}), 404
+    if event_hub.clients >= MAX_EVENT_CLIENTS:
+        logging.warning(f"Refusing live events for tournament {tournament_id}: {event_hub.clients} clients connected")
+        # The page polls the bracket API instead and tries the stream again later
+        response = jsonify({'error': 'Too many live connections. Please try again later.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(EVENTS_RETRY_AFTER)
+        return response
+
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('since', type=int)
+    stream = event_hub.stream(tournament_id, tournament.get(BRACKET_VERSION_FIELD, 0), last_event_id)
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request and Firestore metrics in the Prometheus text format (all gunicorn workers, see metrics.py)."""
+    body, content_type = metrics.exposition()
+    if body is None:
+        return jsonify({'error': 'Metrics are not enabled on this server.'}), 503
+    return Response(body, content_type=content_type)
+
+def _profiles_or_404():
+    """Aborts unless profiling is on and the request carries the admin token (see profiler.py)."""
+    if not profiler.authorized():
+        abort(404)
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """Admin endpoint listing the recent request profiles on this server, newest first."""
+    _profiles_or_404()
+    profiles = profiler.list_profiles(request.args.get('limit', 50, type=int))
+    for profile in profiles:
+        profile['downloads'] = {fmt: url_for('download_profile', profile_id=profile['id'], fmt=fmt)
+                                for fmt in PROFILE_FORMATS}
+    return jsonify({'profiles': profiles})
+
+@app.route('/admin/profiles/<string:profile_id>.<any(prof, txt, json):fmt>')
+def download_profile(profile_id, fmt):
+    """Admin endpoint downloading a profile: pstats data, a text report or its metadata."""
+    _profiles_or_404()
+    if fmt == 'txt':
+        report = profiler.report(profile_id)
+        if report is None:
+            abort(404, description=f"Not found: profile {profile_id}")
+        return Response(report, mimetype='text/plain')
+    path = profiler.path(profile_id, fmt)
+    if path is None:
+        abort(404, description=f"Not found: profile {profile_id}")
+    mimetype = 'application/json' if fmt == 'json' else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=fmt == 'prof', download_name=f"{profile_id}.{fmt}")
+
+@app.route('/api/stats/bracket_cache')
+def bracket_cache_stats():
+    """API endpoint with the bracket cache and request coalescing counters of this worker."""
+    return jsonify(bracket_cache.stats())
+
 @app.route('/api/match/<string:match_id>/update', methods=['POST'])
 def update_match(match_id):
-    """API endpoint to update match result in Firestore."""
-    logging.info(f"Received request to update match {match_id}") # <-- Add initial log
+    """API endpoint to update a match result and advance the winner."""
+    logging.info(f"Received request to update match {match_id}")
     try:
         data = request.get_json()
-        logging.info(f"Request payload for match {match_id}: {data}") # <-- Log payload
+        logging.info(f"Request payload for match {match_id}: {data}")
     except Exception as e:
         logging.error(f"Error getting JSON payload for match {match_id}: {e}")
         return jsonify({'success': False, 'error': 'Invalid request format.'}), 400
-        
-    if not db_firestore:
+
+    repo = get_repository()
+    if not repo:
         logging.error(f"Database connection error during update for match {match_id}")
         return jsonify({'success': False, 'error': 'Database connection not available.'}), 503
 
-    # Rest of the function remains the same...
     try:
-        # data = request.get_json() # Moved payload retrieval up
         if not data:
-            # This check might be redundant now but kept for safety
             logging.warning(f"Empty payload received for match {match_id}")
             return jsonify({'success': False, 'error': 'Invalid request body.'}), 400
-        
+
         winner_id = data.get('winner_id') # Expecting string player ID or null/None
 
         # Basic validation for winner_id format if not None
@@ -438,140 +688,195 @@ def update_match(match_id):
              logging.warning(f"Invalid winner_id format received for match {match_id}: {winner_id}")
              return jsonify({'success': False, 'error': 'Invalid winner_id format.'}), 400
 
-        match_ref = db_firestore.collection('matches').document(match_id)
-
-        # Use a transaction to ensure atomic update and advancement
-        @firestore.transactional
-        def update_in_transaction(transaction: Transaction, match_ref_tx: DocumentReference, winner_id_tx: str):
-            logging.info(f"[Transaction {transaction.id}] Attempting to get match snapshot for {match_ref_tx.id}") # <-- Added log
-            match_snapshot = match_ref_tx.get(transaction=transaction)
-            if not match_snapshot.exists:
-                logging.error(f"[Transaction {transaction.id}] Match {match_ref_tx.id} not found during transaction.") # <-- Added log
-                # Raise specific exception to be caught outside
-                raise NotFound(f"Match {match_ref_tx.id} not found")
-            
-            logging.info(f"[Transaction {transaction.id}] Successfully retrieved match snapshot for {match_ref_tx.id}") # <-- Added log
-            match_data = match_snapshot.to_dict()
-            tournament_id_tx = match_data.get('tournament_id')
-            current_match_number = match_data.get('match_number')
-            next_match_id = match_data.get('next_match_id')
-
-            if not tournament_id_tx:
-                 logging.error(f"[Transaction {transaction.id}] Match {match_ref_tx.id} is missing tournament_id") # <-- Added log
-                 raise ValueError(f"Match {match_ref_tx.id} is missing tournament_id")
-            if current_match_number is None:
-                 logging.error(f"[Transaction {transaction.id}] Match {match_ref_tx.id} is missing match_number") # <-- Added log
-                 raise ValueError(f"Match {match_ref_tx.id} is missing match_number")
-
-            # Update the winner_id for the current match
-            update_data = {
-                'winner_id': winner_id_tx,
-                'status': 'completed' if winner_id_tx else 'pending' # Update status
-            }
-            logging.info(f"[Transaction {transaction.id}] Attempting to update match {match_ref_tx.id} with: {update_data}") # <-- Added log
-            # --- Prepare for Advancing Winner (Read Next Match First) ---
-            next_match_ref = None
-            next_match_snapshot = None
-            if next_match_id and winner_id_tx:
-                logging.info(f"[Transaction {transaction.id}] Preparing to advance winner. Next match ID: {next_match_id}")
-                next_match_ref = db_firestore.collection('matches').document(next_match_id)
-                logging.info(f"[Transaction {transaction.id}] Attempting to get next match snapshot for {next_match_id} (Read before write)")
-                next_match_snapshot = next_match_ref.get(transaction=transaction) # Read next match BEFORE writing current match
-                if next_match_snapshot.exists:
-                    logging.info(f"[Transaction {transaction.id}] Successfully retrieved next match snapshot for {next_match_id}")
-                else:
-                    logging.warning(f"[Transaction {transaction.id}] Next match {next_match_id} does not exist.")
-
-            # --- Update Current Match (Write Operation) ---
-            transaction.update(match_ref_tx, update_data)
-            logging.info(f"[Transaction {transaction.id}] Successfully updated current match {match_ref_tx.id}: winner={winner_id_tx}, status={'completed' if winner_id_tx else 'pending'}")
-
-            # --- Update Next Match (Write Operation, if applicable) ---
-            if next_match_ref and next_match_snapshot and next_match_snapshot.exists and winner_id_tx:
-                next_match_data = next_match_snapshot.to_dict()
-                update_payload = {}
-                is_player1_slot = current_match_number % 2 != 0
-
-                if is_player1_slot:
-                    target_slot = 'player1_id'
-                    other_slot = 'player2_id'
-                else:
-                    target_slot = 'player2_id'
-                    other_slot = 'player1_id'
-
-                # Check if the target slot is already filled correctly or needs update
-                if next_match_data.get(target_slot) is None:
-                    update_payload[target_slot] = winner_id_tx
-                    logging.info(f"[Transaction {transaction.id}] Preparing to advance winner {winner_id_tx} to {target_slot} of next match {next_match_id}")
-                elif next_match_data.get(target_slot) != winner_id_tx:
-                    # Slot filled by someone else - log warning, don't overwrite
-                    logging.warning(f"[Transaction {transaction.id}] Next match {next_match_id} {target_slot} already filled with {next_match_data.get(target_slot)}, cannot advance {winner_id_tx}")
-                    # else: Slot already filled correctly, no update needed for this slot
-
-                # Determine if the next match becomes 'pending' (This should happen regardless of the slot update)
-                # Check current state + potential update
-                player1_now_present = (target_slot == 'player1_id' and target_slot in update_payload) or (next_match_data.get('player1_id') is not None)
-                player2_now_present = (target_slot == 'player2_id' and target_slot in update_payload) or (next_match_data.get('player2_id') is not None)
-
-                if player1_now_present and player2_now_present and next_match_data.get('status') != 'completed':
-                    update_payload['status'] = 'pending'
-                    logging.info(f"[Transaction {transaction.id}] Setting next match {next_match_id} status to 'pending'")
-
-                if update_payload: # Only update if there's something to change
-                    logging.info(f"[Transaction {transaction.id}] Attempting to update next match {next_match_id} with payload: {update_payload}") # <-- Added log
-                    transaction.update(next_match_ref, update_payload)
-                    logging.info(f"[Transaction {transaction.id}] Successfully updated next match {next_match_id}") # <-- Added log
-            # This else corresponds to the outer 'if next_match_ref and next_match_snapshot and next_match_snapshot.exists and winner_id_tx:'
-            # It handles cases where the next match doesn't exist or wasn't retrieved.
-            # The original logging.warning seemed misplaced under the inner else.
-            # Let's refine the logging based on the outer condition.
-            elif not (next_match_ref and next_match_snapshot and next_match_snapshot.exists and winner_id_tx):
-                 if next_match_id and winner_id_tx:
-                     logging.warning(f"[Transaction {transaction.id}] Next match {next_match_id} referenced by match {match_ref_tx.id} not found or snapshot retrieval failed during transaction.")
-                 # Other cases handled below
-            elif next_match_id and not winner_id_tx:
-                 logging.info(f"[Transaction {transaction.id}] No winner for match {match_ref_tx.id}, not advancing to {next_match_id}.") # <-- Added log
-            elif not next_match_id:
-                 logging.info(f"[Transaction {transaction.id}] Match {match_ref_tx.id} has no next_match_id.") # <-- Added log
-            
-            # Check if this was the final match and update tournament status
-            is_final = not next_match_id
-            if is_final and winner_id_tx:
-                logging.info(f"[Transaction {transaction.id}] Final match {match_ref_tx.id} completed. Attempting to update tournament {tournament_id_tx} status.") # <-- Added log
-                tournament_ref_tx = db_firestore.collection('tournaments').document(tournament_id_tx)
-                transaction.update(tournament_ref_tx, {'status': 'completed'})
-                logging.info(f"[Transaction {transaction.id}] Successfully updated tournament {tournament_id_tx} status to 'completed'.")
-            elif is_final and not winner_id_tx:
-                 logging.info(f"[Transaction {transaction.id}] Final match {match_ref_tx.id} winner cleared, not updating tournament status.") # <-- Added log
-
-        # Execute the transaction
-        logging.info(f"Attempting transaction for match {match_id} with winner {winner_id}")
-        transaction_result = update_in_transaction(db_firestore.transaction(), match_ref, winner_id)
-        logging.info(f"Transaction for match {match_id} completed successfully.") # <-- Added log
-        
-        # If transaction successful
+        # Updates the match, advances the winner and completes the tournament atomically
+        tournament_id = repo.record_result(match_id, winner_id)
+        _bracket_changed(tournament_id)
         logging.info(f"Successfully updated match {match_id}")
         return jsonify({'success': True})
 
-    except NotFound as e:
-        logging.error(f"Error updating match {match_id} (NotFound): {e}") # <-- Added log
+    except NotFoundError as e:
+        logging.error(f"Error updating match {match_id} (NotFound): {e}")
         return jsonify({'success': False, 'error': str(e)}), 404
     except ValueError as e:
-        logging.error(f"Error updating match {match_id} (ValueError): {e}") # <-- Added log
+        logging.error(f"Error updating match {match_id} (ValueError): {e}")
         return jsonify({'success': False, 'error': str(e)}), 400 # Bad request due to data inconsistency
     except Exception as e:
         # Catch any other unexpected errors during the process
         logging.exception(f"Unexpected error updating match {match_id}: {e}") # Use logging.exception to include traceback
         return jsonify({'success': False, 'error': 'An internal server error occurred.'}), 500
 
+@app.route('/api/tournament/<string:tournament_id>/results', methods=['POST'])
+def update_matches(tournament_id):
+    """
+    API endpoint to record many results of a tournament at once, e.g. a full round.
+
+    Expects {"results": [{"match_id": "...", "winner_id": "..." or null}, ...]},
+    applied in order. Returns the outcome of each result; invalid ones are
+    skipped without affecting the others.
+    """
+    data = request.get_json(silent=True)
+    results = data.get('results') if isinstance(data, dict) else None
+    if not isinstance(results, list) or not results:
+        return jsonify({'success': False, 'error': 'Invalid request body.'}), 400
+    if len(results) > MAX_BATCH_RESULTS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BATCH_RESULTS} results per request.'}), 400
+    pairs = []
+    for item in results:
+        match_id = item.get('match_id') if isinstance(item, dict) else None
+        winner_id = item.get('winner_id') if isinstance(item, dict) else None
+        if not isinstance(match_id, str) or not match_id or (winner_id is not None and not isinstance(winner_id, str)):
+            logging.warning(f"Invalid result in batch for tournament {tournament_id}: {item}")
+            return jsonify({'success': False, 'error': 'Invalid match_id or winner_id format.'}), 400
+        pairs.append((match_id, winner_id))
+
+    repo = get_repository()
+    if not repo:
+        return jsonify({'success': False, 'error': 'Database connection not available.'}), 503
+
+    try:
+        errors = repo.record_results(tournament_id, pairs)
+    except NotFoundError as e:
+        logging.error(f"Error recording results for tournament {tournament_id} (NotFound): {e}")
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except Exception as e:
+        logging.exception(f"Unexpected error recording results for tournament {tournament_id}: {e}")
+        return jsonify({'success': False, 'error': 'An internal server error occurred.'}), 500
+
+    applied = errors.count(None)
+    if applied:
+        _bracket_changed(tournament_id)
+    logging.info(f"Recorded {applied} of {len(pairs)} results for tournament {tournament_id}")
+    return jsonify({
+        'success': applied == len(pairs),
+        'results': [{'match_id': match_id, 'success': error is None, 'error': error}
+                    for (match_id, _), error in zip(pairs, errors)],
+    })
+
+def _export_response(kind: str, fmt: str, tournament_ids: list[str], filename: str) -> Response:
+    """Streams an export of some tournaments (all of them if tournament_ids is empty)."""
+    if kind not in EXPORT_COLUMNS or fmt not in EXPORT_FORMATS:
+        abort(404, description=f"Unknown export: {kind}.{fmt}")
+    repo = get_repository()
+    if not repo:
+        abort(503, description="Database connection not available.")
+    # Tournaments are checked up front: once streaming starts the status can't change
+    if tournament_ids:
+        tournaments = [_fetch_or_404(repo.get_tournament, tournament_id, "tournament") for tournament_id in tournament_ids]
+    else:
+        tournaments = repo.list_tournaments()
+    logging.info(f"Exporting {kind} of {len(tournaments)} tournaments as {fmt}")
+    body = encode_export(export_rows(repo, kind, tournaments), fmt, EXPORT_COLUMNS[kind])
+    response = Response(body, content_type=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+@app.route('/tournament/<string:tournament_id>/export/<string:kind>.<string:fmt>')
+def export_tournament_data(tournament_id, kind, fmt):
+    """Download the players, matches or placings of a tournament as CSV or NDJSON."""
+    return _export_response(kind, fmt, [tournament_id], f"{tournament_id}-{kind}")
+
+@app.route('/export/<string:kind>.<string:fmt>')
+def export_data(kind, fmt):
+    """
+    Download players, matches or placings of several tournaments as CSV or NDJSON.
+
+    Takes the tournaments as repeated ?tournament=<id> parameters; exports
+    every tournament if none is given.
+    """
+    return _export_response(kind, fmt, request.args.getlist('tournament'), f"tournaments-{kind}")
 
 @app.route('/tournament/<string:tournament_id>/export/pdf')
 def export_bracket_pdf(tournament_id):
-    """Export the tournament bracket as a PDF (Placeholder)."""
-    # This requires a PDF generation library (e.g., ReportLab, WeasyPrint)
-    # Fetch bracket data, format it, generate PDF
-    flash('PDF export functionality is not yet implemented.', 'info')
-    return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    """
+    Export the tournament bracket as a PDF (see bracket_pdf).
+
+    Rendered in a process pool and cached per bracket_version, so repeated
+    downloads of the same chart are served from disk.
+    """
+    repo = get_repository()
+    if not repo:
+        flash("Database connection not available.", "error")
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+
+    variant = _template_digest('exports/bracket_pdf.html')
+    etag = f"pdf-{bracket_pdf.cache_key(tournament, variant)}"
+    not_modified = _not_modified(etag, 'private, no-cache')
+    if not_modified is not None:
+        return not_modified
+
+    def build_html():
+        bracket_data = get_tournament_bracket(tournament_id)
+        if bracket_data.get('error'):
+            raise ValueError(bracket_data['error'])
+        rounds = bracket_data['rounds']
+        return render_template('exports/bracket_pdf.html', tournament=tournament,
+                               pages=bracket_pdf.paginate_bracket(rounds), max_round=max(rounds, default=0),
+                               player_count=len(bracket_data['players']), now=datetime.now())
+
+    try:
+        path = bracket_pdf.get_pdf(tournament, build_html, app.root_path, variant)
+    except TimeoutError:
+        flash('The PDF is still being prepared. Please try again in a minute.', 'info')
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    except bracket_pdf.PdfUnavailableError as e:
+        logging.error(f"PDF export unavailable: {e}")
+        flash('PDF export is not available on this server.', 'error')
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    except Exception as e:
+        logging.error(f"Error exporting PDF of tournament {tournament_id}: {e}", exc_info=True)
+        flash(f'Error exporting PDF: {str(e)}', 'error')
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+
+    response = send_file(path, mimetype='application/pdf', download_name=f"bracket-{tournament_id}.pdf", conditional=False)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/tournament/<string:tournament_id>/export/<any(svg, png):fmt>')
+def export_bracket_image(tournament_id, fmt):
+    """
+    Export the tournament bracket as an SVG or PNG image (see bracket_svg).
+
+    Drawn in the request without a browser and cached per bracket_version.
+    """
+    repo = get_repository()
+    if not repo:
+        flash("Database connection not available.", "error")
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    tournament = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
+
+    etag = f"{fmt}-{bracket_pdf.cache_key(tournament, 'image')}"
+    not_modified = _not_modified(etag, 'private, no-cache')
+    if not_modified is not None:
+        return not_modified
+
+    def load_bracket():
+        bracket_data = get_tournament_bracket(tournament_id)
+        if bracket_data.get('error'):
+            raise ValueError(bracket_data['error'])
+        return bracket_data
+
+    try:
+        image = bracket_svg.get_image(tournament, load_bracket, fmt)
+    except bracket_svg.ImageUnavailableError as e:
+        logging.error(f"PNG export unavailable: {e}")
+        flash('PNG export is not available on this server; please download the SVG image instead.', 'error')
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+    except Exception as e:
+        logging.error(f"Error exporting {fmt} image of tournament {tournament_id}: {e}", exc_info=True)
+        flash(f'Error exporting image: {str(e)}', 'error')
+        return redirect(url_for('view_tournament', tournament_id=tournament_id))
+
+    response = make_response(image)
+    response.content_type = 'image/svg+xml; charset=utf-8' if fmt == 'svg' else 'image/png'
+    response.headers['Content-Disposition'] = f'attachment; filename="bracket-{tournament_id}.{fmt}"'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 
 # --- Error Handlers ---
 @app.errorhandler(404)
@@ -582,17 +887,15 @@ def page_not_found(e):
 @app.errorhandler(500)
 def internal_server_error(e):
     # Log the error
-    logging.exception('An internal server error occurred.') 
+    logging.exception('An internal server error occurred.')
     # note that we set the 500 status explicitly
     return render_template('500.html', error=e), 500
 
-# Add any other routes from the original file if they were missed
-# Ensure all <int:id> are changed to <string:id> where appropriate
-
 # Example: Route for updating player order via drag/drop
 @app.route('/api/tournament/<string:tournament_id>/update_player_order', methods=['POST'])
 def update_player_order(tournament_id):
-    if not db_firestore:
+    repo = get_repository()
+    if not repo:
         return jsonify({'error': 'Database connection not available.'}), 503
     try:
         data = request.get_json()
@@ -601,76 +904,40 @@ def update_player_order(tournament_id):
         if not isinstance(ordered_player_ids, list):
             return jsonify({'error': 'Invalid data format. Expected player_ids list.'}), 400
 
-        # Use a batch write to update an 'order' field for each player
-        batch = db_firestore.batch()
-        players_ref = db_firestore.collection('players')
-        for index, player_id in enumerate(ordered_player_ids):
-            # Added check for non-string IDs before creating document reference
+        # Skip non-string IDs; the index in the list becomes each player's 'ui_order'
+        valid_ids = []
+        for player_id in ordered_player_ids:
             if not isinstance(player_id, str):
                 logging.warning(f"Skipping non-string player ID in order update: {player_id}")
-                continue # Skip non-string IDs
-            player_ref = players_ref.document(player_id)
-            # Check if player actually belongs to this tournament? Maybe not needed if UI prevents it.
-            batch.update(player_ref, {'ui_order': index}) # Add/Update an order field
-
-        batch.commit()
+                continue
+            valid_ids.append(player_id)
+        repo.set_player_order(tournament_id, valid_ids)
         return jsonify({'status': 'success', 'message': 'Player order updated.'})
     except Exception as e:
         logging.error(f"Error updating player order for tournament {tournament_id}: {e}")
         return jsonify({'error': f'Failed to update player order: {str(e)}'}), 500
 
-# Add any other routes from the original file if they were missed
-# Ensure all <int:id> are changed to <string:id> where appropriate
-
 @app.route('/tournament/<string:tournament_id>/delete', methods=['POST'])
 def delete_tournament(tournament_id):
-    app.logger.info(f'Received request to delete tournament with ID: {tournament_id}') # Add app logger
     """Delete a tournament and all its related data."""
-    if not db_firestore:
+    app.logger.info(f'Received request to delete tournament with ID: {tournament_id}')
+    repo = get_repository()
+    if not repo:
         flash("Database connection not available.", "error")
         return redirect(url_for('index'))
 
-    tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-    tournament_doc = _get_doc_or_404(tournament_ref)
-    tournament_data = _doc_to_dict(tournament_doc)
+    tournament_data = _fetch_or_404(repo.get_tournament, tournament_id, "tournament")
     logging.info(f"Attempting to delete tournament: {tournament_id} - {tournament_data.get('name')}")
 
     try:
-        # 使用批處理刪除所有相關數據
-        batch = db_firestore.batch()
-        logging.debug(f"Starting batch delete for tournament {tournament_id}")
-
-        # 1. 刪除所有相關的比賽
-        matches_query = db_firestore.collection('matches').where('tournament_id', '==', tournament_id)
-        matches_docs = list(matches_query.stream())
-        logging.info(f"Found {len(matches_docs)} matches to delete for tournament {tournament_id}")
-        for doc in matches_docs:
-            logging.debug(f"Adding match {doc.id} to delete batch")
-            batch.delete(doc.reference)
-        
-        # 2. 刪除所有相關的選手
-        players_query = db_firestore.collection('players').where('tournament_id', '==', tournament_id)
-        players_docs = list(players_query.stream())
-        logging.info(f"Found {len(players_docs)} players to delete for tournament {tournament_id}")
-        for doc in players_docs:
-            logging.debug(f"Adding player {doc.id} to delete batch")
-            batch.delete(doc.reference)
-        
-        # 3. 最後刪除比賽本身
-        batch.delete(tournament_ref)
-        
-        # 3. 最後刪除比賽本身
-        logging.debug(f"Adding tournament {tournament_id} itself to delete batch")
-        batch.delete(tournament_ref)
-
-        # 提交批處理操作
-        logging.info(f"Committing batch delete for tournament {tournament_id}")
-        batch.commit()
-        logging.info(f"Batch delete committed successfully for tournament {tournament_id}")
-        
+        # 刪除比賽及其所有選手和對賽
+        counts = repo.delete_tournament(tournament_id)
+        _bracket_changed(tournament_id)
+        logging.info(f"Deleted tournament {tournament_id} with {counts['players']} players and {counts['matches']} matches")
+
         flash(f'比賽 "{tournament_data.get("name")}" 已成功刪除', 'success')
     except Exception as e:
         logging.error(f"Error deleting tournament {tournament_id}: {e}")
         flash(f'刪除比賽時發生錯誤: {str(e)}', 'error')
-    
+
     return redirect(url_for('index'))
@@ -385,12 +385,12 @@ function updateMatchWinner(matchId, winnerId) {
                 }
             }
             
-            // Reload the tournament data to reflect the changes
+            // Fetch the matches changed by this result to reflect the changes
             const tournamentContainer = document.getElementById('tournament-bracket');
             if (tournamentContainer) {
                 const tournamentId = tournamentContainer.dataset.tournamentId;
-                console.log('Reloading tournament data for ID:', tournamentId);
-                loadTournamentData(tournamentId);
+                console.log('Refreshing tournament data for ID:', tournamentId);
+                refreshTournamentData(tournamentId);
             }
         } else {
             showErrorMessage(data.error || 'Failed to update match');
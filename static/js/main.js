@@ -14,6 +14,12 @@ document.addEventListener('DOMContentLoaded', function() {
         // Initialize confetti for winners
         initConfetti();
     }
+
+    // Follow a bracket generation running in the background (players page)
+    const generationJob = document.getElementById('generation-job');
+    if (generationJob) {
+        watchGenerationJob(generationJob);
+    }
     
     // Sortable players feature removed
     
@@ -128,6 +134,14 @@ function initAlertsDismiss() {
     });
 }
 
+// Bracket data currently shown, kept so later updates can be fetched as deltas
+let currentBracketData = null;
+// Live updates pushed by the server, one stream per page
+let bracketEvents = null;
+let bracketPolling = null;
+const BRACKET_POLL_MS = 10000; // Polling interval while the live stream is unavailable
+const LIVE_RETRY_MS = 30000; // Matches the Retry-After the server sends when it has no stream to spare
+
 /**
  * Load tournament data from the API
  * @param {number} tournamentId - The ID of the tournament to load
@@ -141,8 +155,10 @@ function loadTournamentData(tournamentId) {
             return response.json();
         })
         .then(data => {
+            currentBracketData = data.error ? null : data;
             // Initialize the bracket visualization with the data
             initializeBracket(data);
+            startBracketEvents(tournamentId);
         })
         .catch(error => {
             console.error('Error loading tournament data:', error);
@@ -150,6 +166,154 @@ function loadTournamentData(tournamentId) {
         });
 }
 
+/**
+ * Fetch only the matches changed since the bracket data on the page and redraw.
+ * Falls back to a full load when the server asks for it (new bracket, player changes).
+ * @param {string} tournamentId - The ID of the tournament to refresh
+ */
+function refreshTournamentData(tournamentId) {
+    if (!currentBracketData || currentBracketData.version === undefined) {
+        loadTournamentData(tournamentId);
+        return;
+    }
+    fetch(`/api/tournament/${tournamentId}/bracket?since=${currentBracketData.version}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+            return response.json();
+        })
+        .then(delta => {
+            if (delta.error) {
+                showErrorMessage(delta.error);
+                return;
+            }
+            if (delta.full_reload) {
+                loadTournamentData(tournamentId);
+                return;
+            }
+            if (applyBracketDelta(currentBracketData, delta)) {
+                initializeBracket(currentBracketData);
+            }
+        })
+        .catch(error => {
+            console.error('Error refreshing tournament data:', error);
+            loadTournamentData(tournamentId);
+        });
+}
+
+/**
+ * Poll a background bracket generation job and show its progress
+ * @param {HTMLElement} panel - Element with data-job-id and data-done-url
+ */
+function watchGenerationJob(panel) {
+    const bar = panel.querySelector('.progress-bar');
+    const label = panel.querySelector('.generation-phase');
+    const phases = {
+        queued: '排隊中', loading_players: '讀取選手', drawing: '抽籤中',
+        saving: '儲存賽程表', finishing: '即將完成', done: '完成'
+    };
+
+    const poll = () => {
+        fetch(`/api/jobs/${panel.dataset.jobId}`)
+            .then(response => response.json())
+            .then(job => {
+                if (job.error && !job.status) {
+                    throw new Error(job.error);
+                }
+                const progress = Math.round(job.progress);
+                bar.style.width = `${progress}%`;
+                bar.setAttribute('aria-valuenow', progress);
+                label.textContent = `${phases[job.phase] || job.phase} ${progress}%`;
+                if (job.status === 'succeeded') {
+                    window.location.href = panel.dataset.doneUrl;
+                } else if (job.status === 'failed') {
+                    bar.classList.add('bg-danger');
+                    label.textContent = `生成賽程表失敗：${job.error}`;
+                } else {
+                    setTimeout(poll, 1000);
+                }
+            })
+            .catch(error => {
+                console.error('Error checking bracket generation job:', error);
+                setTimeout(poll, 3000);
+            });
+    };
+    poll();
+}
+
+/**
+ * Subscribe to live bracket updates, so results entered elsewhere show up without reloading
+ * @param {string} tournamentId - The ID of the tournament to watch
+ */
+function startBracketEvents(tournamentId) {
+    if (bracketEvents || !window.EventSource || !currentBracketData) return;
+
+    // The browser reconnects by itself and resumes with Last-Event-ID
+    bracketEvents = new EventSource(`/api/tournament/${tournamentId}/events?since=${currentBracketData.version}`);
+    bracketEvents.addEventListener('delta', event => {
+        const delta = JSON.parse(event.data);
+        if (delta.full_reload || !currentBracketData) {
+            loadTournamentData(tournamentId);
+        } else if (delta.since > currentBracketData.version) {
+            // Missed an update in between
+            refreshTournamentData(tournamentId);
+        } else if (applyBracketDelta(currentBracketData, delta)) {
+            initializeBracket(currentBracketData);
+        }
+    });
+    bracketEvents.addEventListener('tournament_error', event => {
+        bracketEvents.close();
+        showErrorMessage(JSON.parse(event.data).error);
+    });
+    bracketEvents.addEventListener('open', stopBracketPolling);
+    bracketEvents.addEventListener('error', () => {
+        // A refused stream (e.g. 503 when the server is at its live connection
+        // limit) is not retried by the browser: poll for changes and try again later
+        if (!bracketEvents || bracketEvents.readyState !== EventSource.CLOSED) return;
+        bracketEvents = null;
+        startBracketPolling(tournamentId);
+        setTimeout(() => startBracketEvents(tournamentId), LIVE_RETRY_MS);
+    });
+}
+
+/**
+ * Refresh the bracket with ?since= deltas every BRACKET_POLL_MS until the live stream is back
+ * @param {string} tournamentId - The ID of the tournament to watch
+ */
+function startBracketPolling(tournamentId) {
+    if (bracketPolling) return;
+    bracketPolling = setInterval(() => refreshTournamentData(tournamentId), BRACKET_POLL_MS);
+}
+
+function stopBracketPolling() {
+    if (bracketPolling) {
+        clearInterval(bracketPolling);
+        bracketPolling = null;
+    }
+}
+
+/**
+ * Merge changed matches into bracket data
+ * @param {Object} data - Bracket data from the API, updated in place
+ * @param {Object} delta - Response of the bracket API with ?since=
+ * @returns {boolean} Whether any match changed
+ */
+function applyBracketDelta(data, delta) {
+    if (delta.version <= data.version) {
+        return false; // Already applied (e.g. both the live stream and a refresh delivered it)
+    }
+    delta.matches.forEach(match => {
+        const roundMatches = data.rounds[match.round_number] || [];
+        const index = roundMatches.findIndex(m => m.id === match.id);
+        if (index >= 0) {
+            roundMatches[index] = match;
+        }
+    });
+    data.version = delta.version;
+    return delta.matches.length > 0;
+}
+
 /**
  * Show error message on the page
  * @param {string} message - The error message to display
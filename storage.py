@@ -0,0 +1,420 @@
+# Storage layer
+#
+# Routes and bracket code talk to a Repository instead of a database client,
+# so the app can run on Firestore (the default) or on a local SQLite file:
+#
+#   STORAGE_BACKEND=firestore   - Firestore client initialized in app.py
+#   STORAGE_BACKEND=sqlite      - SQLite database at SQLITE_PATH
+#                                 (default instance/tournaments.db)
+#   STORAGE_BACKEND=memory      - in-memory Firestore stand-in (firestore_fake),
+#                                 for load tests without a cloud project
+#
+# Records are plain dicts with their ID under 'id', the same shape the
+# templates and JSON API already use.
+#
+# Every write that changes what the bracket view shows (results, a new
+# bracket, player changes) increments the tournament's 'bracket_version', so
+# cached bracket payloads can be checked against one cheap tournament read
+# (see bracket_cache). Result writes stamp the matches they change with the
+# new version ('version' on the match), so clients can fetch just the matches
+# changed since the version they have. Other changes also set
+# 'bracket_reset_version' to the new version: deltas from before it need a
+# full reload.
+#
+# Tournament records also carry a summary for the index page (player count,
+# played and decided matches, champion), so listing a page of tournaments
+# reads nothing else. Firestore keeps the summary fields on the tournament
+# document, updated in the same transaction as each write that changes them;
+# SQLite works them out in the listing query.
+import logging
+import os
+import threading
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'tournaments.db')
+
+# Tournament field counting changes to the bracket payload
+BRACKET_VERSION_FIELD = 'bracket_version'
+# Tournament field with the last version that changed more than match results
+BRACKET_RESET_FIELD = 'bracket_reset_version'
+# Records fetched per query by the iter_* methods
+PAGE_SIZE = 500
+
+# Tournament summary fields (see list_tournaments_page)
+PLAYER_COUNT_FIELD = 'player_count'
+MATCH_COUNT_FIELD = 'match_count' # Games the bracket needs: players drawn minus one
+COMPLETED_MATCHES_FIELD = 'completed_match_count' # Games decided, not counting byes
+CHAMPION_ID_FIELD = 'champion_id'
+CHAMPION_NAME_FIELD = 'champion_name'
+SUMMARY_FIELDS = (PLAYER_COUNT_FIELD, MATCH_COUNT_FIELD, COMPLETED_MATCHES_FIELD, CHAMPION_ID_FIELD, CHAMPION_NAME_FIELD)
+
+
+class NotFoundError(LookupError):
+    """Raised when a record a write depends on does not exist."""
+
+
+class Repository:
+    """Interface shared by all storage backends."""
+
+    name = 'base'
+
+    # --- Tournaments ---
+
+    def list_tournaments(self) -> list[dict]:
+        """All tournaments, newest date first."""
+        raise NotImplementedError
+
+    def list_tournaments_page(self, page_size: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        """
+        One page of tournaments, newest date first, with their SUMMARY_FIELDS.
+
+        Args:
+            page_size (int): Tournaments per page.
+            cursor (str | None): The cursor returned with the previous page;
+                                 None for the first page.
+
+        Returns:
+            tuple[list[dict], str | None]: The tournaments, and the cursor of
+                the next page (None on the last page).
+
+        Raises:
+            NotFoundError: If the cursor's tournament no longer exists.
+        """
+        raise NotImplementedError
+
+    def get_tournament(self, tournament_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def create_tournament(self, data: dict) -> str:
+        """Create a tournament and return its ID."""
+        raise NotImplementedError
+
+    def update_tournament(self, tournament_id: str, fields: dict) -> None:
+        raise NotImplementedError
+
+    def delete_tournament(self, tournament_id: str) -> dict:
+        """
+        Delete a tournament with its players and matches.
+
+        Returns:
+            dict: Number of deleted 'players' and 'matches'.
+        """
+        raise NotImplementedError
+
+    def watch_tournament(self, tournament_id: str, on_change):
+        """
+        Call on_change() whenever the tournament record changes, from any process.
+
+        Returns:
+            callable | None: Stops watching; None if the backend cannot push
+                             changes, in which case callers poll instead.
+        """
+        return None
+
+    # --- Players ---
+
+    def list_players(self, tournament_id: str) -> list[dict]:
+        """Players of a tournament, ordered by name."""
+        raise NotImplementedError
+
+    def get_player(self, player_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def find_players(self, tournament_id: str, name: str, school: str) -> list[dict]:
+        """Players of a tournament with exactly this name and school."""
+        raise NotImplementedError
+
+    def add_player(self, data: dict) -> str:
+        """Add a player and return its ID."""
+        raise NotImplementedError
+
+    def player_keys(self, tournament_id: str) -> set[tuple[str, str]]:
+        """The (name, school) of every player of a tournament, read with one query."""
+        raise NotImplementedError
+
+    def add_players(self, tournament_id: str, players: list[dict]) -> list[str]:
+        """
+        Add many players at once and return their IDs.
+
+        The players are written in as few commits as the backend allows, and
+        the tournament's bracket_version is bumped once, after all of them.
+        Duplicates are not checked here (see player_import).
+        """
+        raise NotImplementedError
+
+    def update_player(self, tournament_id: str, player_id: str, fields: dict) -> None:
+        raise NotImplementedError
+
+    def delete_player(self, tournament_id: str, player_id: str) -> None:
+        raise NotImplementedError
+
+    def set_player_order(self, tournament_id: str, player_ids: list[str]) -> None:
+        """Store the drag-and-drop order of players as their 'ui_order'."""
+        raise NotImplementedError
+
+    def iter_players(self, tournament_id: str, page_size: int = PAGE_SIZE):
+        """
+        Yield the players of a tournament, ordered by name, one page of
+        page_size records in memory at a time (for exports of any size).
+        """
+        raise NotImplementedError
+
+    # --- Brackets ---
+
+    def iter_matches(self, tournament: dict, page_size: int = PAGE_SIZE):
+        """
+        Yield the stored matches of a tournament's bracket, fetched page by page.
+
+        Args:
+            tournament (dict): The tournament record, as returned by get_tournament.
+            page_size (int): Matches fetched per query.
+
+        Yields:
+            dict: Match records with 'id', 'round_number', 'match_number',
+                  player IDs, 'winner_id' and 'status'. The order depends on
+                  the backend; use round and match number to place them.
+        """
+        raise NotImplementedError
+
+    def save_bracket(self, tournament_id: str, matches: list[dict], players: list[dict], on_progress=None) -> None:
+        """
+        Replace the bracket of a tournament.
+
+        Readers keep getting the previous bracket until the new one has been
+        written completely.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            matches (list[dict]): Output of create_tournament_bracket, with 'next_match_index' links.
+            players (list[dict]): The players the bracket was drawn from.
+            on_progress (callable): Optional; called with (writes done, writes
+                                    queued) where the backend writes in steps.
+        """
+        raise NotImplementedError
+
+    def load_bracket(self, tournament: dict) -> tuple:
+        """
+        Load the bracket of a tournament.
+
+        Args:
+            tournament (dict): The tournament record, as returned by get_tournament.
+
+        Returns:
+            tuple: (Bracket or None if no bracket was generated, players), where
+                   players maps player ID to {'name', 'school'}. Bracket.match_ids
+                   holds the ID of every stored match and Bracket.versions their
+                   version stamps.
+        """
+        raise NotImplementedError
+
+    def record_result(self, match_id: str, winner_id: str | None) -> str:
+        """
+        Set the winner of a match (None clears it) and advance the winner, atomically.
+
+        Increments the tournament's bracket_version and stamps the changed
+        matches with the new version.
+
+        Returns:
+            str: The ID of the tournament the match belongs to.
+
+        Raises:
+            NotFoundError: If the match does not exist.
+            ValueError: If the stored match is inconsistent or the winner is invalid.
+        """
+        raise NotImplementedError
+
+    def record_results(self, tournament_id: str, results: list[tuple[str, str | None]]) -> list[str | None]:
+        """
+        Set the winners of several matches of one tournament and advance them.
+
+        Results are applied in order, so a winner advanced by an earlier result
+        can be decided on by a later one. All of them are validated against one
+        read of the matches involved, and the valid ones are written in a single
+        transaction (split only where a backend limits the size of a commit)
+        with one bracket_version increment per transaction.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            results (list[tuple[str, str | None]]): (match ID, winner ID or None) pairs.
+
+        Returns:
+            list[str | None]: Per result, None if it was applied or the reason it was rejected.
+
+        Raises:
+            NotFoundError: If the tournament does not exist.
+        """
+        raise NotImplementedError
+
+
+def is_played(match: dict) -> bool:
+    """Whether a match was played and decided (a bye is not)."""
+    return bool(match.get('winner_id') and match.get('player1_id') and match.get('player2_id'))
+
+
+def count_change(tournament: dict, field: str, delta: int) -> dict:
+    """
+    Update adding delta to a summary counter of a tournament.
+
+    Empty if there is nothing to add or the tournament has no summary yet;
+    a missing summary is worked out in full when the tournament is listed.
+    """
+    if not delta or tournament.get(field) is None:
+        return {}
+    return {field: max(tournament[field] + delta, 0)}
+
+
+def bracket_summary(matches, player_names: dict) -> dict:
+    """
+    Work out the bracket's summary fields from its matches.
+
+    Args:
+        matches (iterable): Match dicts with round and match numbers, player
+                            IDs and 'winner_id' (as from iter_matches or
+                            create_tournament_bracket).
+        player_names (dict): Player ID -> name, for the champion's name.
+
+    Returns:
+        dict: MATCH_COUNT_FIELD, COMPLETED_MATCHES_FIELD, CHAMPION_ID_FIELD and CHAMPION_NAME_FIELD.
+    """
+    drawn = completed = 0
+    final = (0, None) # (round number, winner of the match in it)
+    for match in matches:
+        round_number = match.get('round_number') or 0
+        if round_number == 1:
+            drawn += bool(match.get('player1_id')) + bool(match.get('player2_id'))
+        completed += is_played(match)
+        if round_number > final[0]:
+            final = (round_number, match.get('winner_id'))
+    return {MATCH_COUNT_FIELD: max(drawn - 1, 0), COMPLETED_MATCHES_FIELD: completed,
+            CHAMPION_ID_FIELD: final[1], CHAMPION_NAME_FIELD: player_names.get(final[1])}
+
+
+def advance_winner(match: dict, next_match: dict | None, winner_id: str | None) -> tuple[dict, dict]:
+    """
+    Work out the writes for a match result, shared by every backend.
+
+    The winner fills their slot in the next match only if that slot is empty,
+    and the next match becomes pending once both slots are filled.
+
+    Args:
+        match (dict): The match being decided; needs 'match_number'.
+        next_match (dict | None): The match the winner plays next, if any.
+        winner_id (str | None): The winner, or None to clear the result.
+
+    Returns:
+        tuple[dict, dict]: Fields to update on the match and on the next match.
+    """
+    # Imported here so backends can import this module without the model
+    from models import Bracket
+
+    match_update = {'winner_id': winner_id, 'status': 'completed' if winner_id else 'pending'}
+    next_update = {}
+    if next_match is None or not winner_id:
+        return match_update, next_update
+
+    # Heap layout: odd match numbers feed player1, even ones player2
+    target_slot = Bracket.next_slot_field(match['match_number'])
+    if next_match.get(target_slot) is None:
+        next_update[target_slot] = winner_id
+    elif next_match.get(target_slot) != winner_id:
+        logging.warning(f"Next match {next_match.get('id')} {target_slot} already filled with {next_match.get(target_slot)}, cannot advance {winner_id}")
+
+    player1_present = next_update.get('player1_id', next_match.get('player1_id')) is not None
+    player2_present = next_update.get('player2_id', next_match.get('player2_id')) is not None
+    if player1_present and player2_present and next_match.get('status') != 'completed':
+        next_update['status'] = 'pending'
+    return match_update, next_update
+
+
+def apply_results(tournament_id: str, matches: dict, results: list[tuple[str, str | None]]) -> tuple[list[str | None], dict, bool]:
+    """
+    Validate a batch of results and work out its writes, shared by the match-document backends.
+
+    Args:
+        tournament_id (str): The tournament every match must belong to.
+        matches (dict): Match ID -> stored match, for the matches of the batch
+                        and the matches they feed; updated in place as results
+                        are applied in order.
+        results (list[tuple[str, str | None]]): (match ID, winner ID or None) pairs.
+
+    Returns:
+        tuple[list[str | None], dict, bool]: Per result, None or the reason it
+            was rejected; match ID -> fields to write; and whether a final was
+            decided (the tournament is then completed).
+    """
+    errors = []
+    updates = {}
+    completed = False
+    for match_id, winner_id in results:
+        match = matches.get(match_id)
+        if match is None or match.get('tournament_id') != tournament_id:
+            errors.append(f"Match {match_id} not found")
+            continue
+        if match.get('match_number') is None:
+            errors.append(f"Match {match_id} is missing match_number")
+            continue
+        if winner_id is not None and winner_id not in (match.get('player1_id'), match.get('player2_id')):
+            errors.append(f"Player {winner_id} is not in match {match_id}")
+            continue
+
+        next_match_id = match.get('next_match_id')
+        next_match = matches.get(next_match_id) if next_match_id else None
+        if next_match_id and winner_id and next_match is None:
+            logging.warning(f"Next match {next_match_id} referenced by match {match_id} not found.")
+        match_update, next_update = advance_winner(match, next_match, winner_id)
+        for record_id, update in ((match_id, match_update), (next_match_id, next_update)):
+            if update:
+                matches[record_id].update(update)
+                updates.setdefault(record_id, {}).update(update)
+        completed = completed or (not next_match_id and winner_id is not None)
+        errors.append(None)
+    return errors, updates, completed
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository() -> Repository | None:
+    """
+    Return the repository of this process, creating it on first use.
+
+    Returns None if the configured backend is not available (e.g. Firestore
+    could not be initialized), so callers can report it like before.
+    """
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = _create_repository()
+    return _repository
+
+
+def set_repository(repository: Repository | None) -> None:
+    """Replace the repository of this process (for scripts and tests)."""
+    global _repository
+    _repository = repository
+
+
+def _create_repository() -> Repository | None:
+    # Firestore calls are counted per request (see metrics)
+    from metrics import instrument_firestore
+    backend = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+    if backend == 'sqlite':
+        from storage_sqlite import SQLiteRepository
+        path = os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
+        logging.info(f"Using SQLite storage at {path}")
+        return SQLiteRepository(path)
+    if backend == 'memory':
+        # In-memory Firestore stand-in with injected latency, for load tests
+        from firestore_fake import client_from_env
+        from storage_firestore import FirestoreRepository
+        return FirestoreRepository(instrument_firestore(client_from_env(os.environ)))
+    if backend != 'firestore':
+        logging.error(f"Unknown STORAGE_BACKEND '{backend}', falling back to Firestore")
+
+    # Under gevent workers gRPC was set up for gevent in gunicorn.conf.py
+    from app import db_firestore
+    if db_firestore is None:
+        return None
+    from storage_firestore import FirestoreRepository
+    return FirestoreRepository(instrument_firestore(db_firestore))
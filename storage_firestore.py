@@ -0,0 +1,524 @@
+# Firestore storage backend
+import logging
+
+from google.cloud import firestore
+from google.cloud.firestore import Query
+from google.api_core.exceptions import NotFound
+
+import bracket_store
+from bulk_writer import BulkWriter
+from models import Bracket
+from storage import (BRACKET_RESET_FIELD, BRACKET_VERSION_FIELD, CHAMPION_ID_FIELD, CHAMPION_NAME_FIELD,
+                     COMPLETED_MATCHES_FIELD, PAGE_SIZE, PLAYER_COUNT_FIELD, NotFoundError, Repository, advance_winner,
+                     apply_results, bracket_summary, count_change, is_played)
+
+# Tournament field naming the generation of match documents that make up its
+# bracket; documents of other generations are being written or deleted
+_GENERATION_FIELD = 'bracket_generation'
+
+# A Firestore commit holds at most 500 writes; each result writes its match
+# and the match it feeds, plus one tournament update per commit
+_RESULTS_PER_COMMIT = 249
+
+
+def _stream_pages(query, page_size: int):
+    """Stream a query's documents in pages of page_size, each page continuing after the last document."""
+    cursor = None
+    while True:
+        page = query.limit(page_size)
+        if cursor is not None:
+            page = page.start_after(cursor)
+        docs = list(page.stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1]
+
+
+def _doc_to_dict(doc) -> dict | None:
+    """Converts a Firestore document snapshot to a dict, adding the ID."""
+    data = doc.to_dict()
+    if data is not None:
+        data['id'] = doc.id
+    return data
+
+
+class FirestoreRepository(Repository):
+    """
+    Storage on Cloud Firestore.
+
+    Collections: tournaments, players and matches (one document per match),
+    plus brackets/ for tournaments stored in single-document mode (see
+    bracket_store).
+    """
+
+    name = 'firestore'
+
+    def __init__(self, client):
+        self.client = client
+
+    # --- Tournaments ---
+
+    def list_tournaments(self) -> list[dict]:
+        query = self.client.collection('tournaments').order_by('date', direction=Query.DESCENDING)
+        return [_doc_to_dict(doc) for doc in query.stream()]
+
+    def list_tournaments_page(self, page_size: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        tournaments_ref = self.client.collection('tournaments')
+        query = tournaments_ref.order_by('date', direction=Query.DESCENDING)
+        if cursor:
+            # The cursor is the ID of the previous page's last tournament
+            snapshot = tournaments_ref.document(cursor).get()
+            if not snapshot.exists:
+                raise NotFoundError(f"Tournament {cursor} not found")
+            query = query.start_after(snapshot)
+        docs = list(query.limit(page_size + 1).stream())
+        tournaments = [_doc_to_dict(doc) for doc in docs[:page_size]]
+        for tournament in tournaments:
+            if tournament.get(PLAYER_COUNT_FIELD) is None:
+                tournament.update(self._refresh_summary(tournament))
+        return tournaments, (tournaments[-1]['id'] if len(docs) > page_size else None)
+
+    def _refresh_summary(self, tournament: dict) -> dict:
+        """
+        Work out and store the summary of a tournament created before summaries were kept.
+
+        Counted outside a transaction, so the result is only stored if the
+        bracket_version did not change meanwhile; otherwise the next listing
+        tries again.
+        """
+        tournament_id = tournament['id']
+        players = self.client.collection('players').where('tournament_id', '==', tournament_id).select(['name'])
+        names = {doc.id: doc.get('name') for doc in players.stream()}
+        summary = {PLAYER_COUNT_FIELD: len(names), **bracket_summary(self.iter_matches(tournament), names)}
+        tournament_ref = self.client.collection('tournaments').document(tournament_id)
+
+        @firestore.transactional
+        def store_in_transaction(transaction):
+            snapshot = tournament_ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.to_dict().get(BRACKET_VERSION_FIELD) == tournament.get(BRACKET_VERSION_FIELD):
+                transaction.update(tournament_ref, summary)
+
+        store_in_transaction(self.client.transaction())
+        logging.info(f"Stored summary of tournament {tournament_id}: {summary}")
+        return summary
+
+    def get_tournament(self, tournament_id: str) -> dict | None:
+        doc = self.client.collection('tournaments').document(tournament_id).get()
+        return _doc_to_dict(doc) if doc.exists else None
+
+    def create_tournament(self, data: dict) -> str:
+        # Firestore auto-generates the ID
+        summary = {PLAYER_COUNT_FIELD: 0, **bracket_summary([], {})}
+        _, doc_ref = self.client.collection('tournaments').add({**summary, **data})
+        return doc_ref.id
+
+    def update_tournament(self, tournament_id: str, fields: dict) -> None:
+        self.client.collection('tournaments').document(tournament_id).update(fields)
+
+    def watch_tournament(self, tournament_id: str, on_change):
+        doc_ref = self.client.collection('tournaments').document(tournament_id)
+        if not hasattr(doc_ref, 'on_snapshot'):
+            return None # The in-memory stand-in has no listeners
+        watch = doc_ref.on_snapshot(lambda snapshots, changes, read_time: on_change())
+        return watch.unsubscribe
+
+    def delete_tournament(self, tournament_id: str) -> dict:
+        # Children first, in parallel chunks, while the queries are still streaming
+        writer = BulkWriter.from_env(self.client, f"Deleting tournament {tournament_id}")
+        match_count = 0
+        for doc in self.client.collection('matches').where('tournament_id', '==', tournament_id).stream():
+            writer.delete(doc.reference)
+            match_count += 1
+        bracket_store.delete_bracket(self.client, tournament_id, batch=writer)
+
+        player_count = 0
+        for doc in self.client.collection('players').where('tournament_id', '==', tournament_id).stream():
+            writer.delete(doc.reference)
+            player_count += 1
+        writer.close()
+
+        # Deleted last, so a failed bulk delete leaves the tournament listed and the delete can be retried
+        self.client.collection('tournaments').document(tournament_id).delete()
+        logging.info(f"Deleted tournament {tournament_id}: {match_count} matches, {player_count} players")
+        return {'players': player_count, 'matches': match_count}
+
+    # --- Players ---
+
+    def list_players(self, tournament_id: str) -> list[dict]:
+        query = self.client.collection('players').where('tournament_id', '==', tournament_id).order_by('name')
+        return [_doc_to_dict(doc) for doc in query.stream()]
+
+    def get_player(self, player_id: str) -> dict | None:
+        doc = self.client.collection('players').document(player_id).get()
+        return _doc_to_dict(doc) if doc.exists else None
+
+    def find_players(self, tournament_id: str, name: str, school: str) -> list[dict]:
+        query = self.client.collection('players').where('tournament_id', '==', tournament_id) \
+                                                 .where('name', '==', name) \
+                                                 .where('school', '==', school)
+        return [_doc_to_dict(doc) for doc in query.stream()]
+
+    def add_player(self, data: dict) -> str:
+        # Same transaction as the version bump
+        doc_ref = self.client.collection('players').document()
+
+        def create(transaction, tournament):
+            transaction.create(doc_ref, data)
+            return count_change(tournament, PLAYER_COUNT_FIELD, 1)
+
+        self._reset_bracket_version(data['tournament_id'], create)
+        return doc_ref.id
+
+    def player_keys(self, tournament_id: str) -> set[tuple[str, str]]:
+        # Only the two key fields are transferred
+        query = self.client.collection('players').where('tournament_id', '==', tournament_id).select(['name', 'school'])
+        return {(doc.get('name'), doc.get('school')) for doc in query.stream()}
+
+    def add_players(self, tournament_id: str, players: list[dict]) -> list[str]:
+        writer = BulkWriter.from_env(self.client, f"Adding {len(players)} players to tournament {tournament_id}")
+        players_ref = self.client.collection('players')
+        player_ids = []
+        for data in players:
+            doc_ref = players_ref.document()
+            writer.set(doc_ref, {**data, 'tournament_id': tournament_id})
+            player_ids.append(doc_ref.id)
+        writer.close()
+        # Bumped last: a reader that sees the new version also sees every new player
+        self._reset_bracket_version(tournament_id, lambda transaction, tournament:
+                                    count_change(tournament, PLAYER_COUNT_FIELD, len(player_ids)))
+        return player_ids
+
+    def iter_players(self, tournament_id: str, page_size: int = PAGE_SIZE):
+        query = self.client.collection('players').where('tournament_id', '==', tournament_id).order_by('name')
+        for doc in _stream_pages(query, page_size):
+            yield _doc_to_dict(doc)
+
+    def update_player(self, tournament_id: str, player_id: str, fields: dict) -> None:
+        self.client.collection('players').document(player_id).update(fields)
+        if 'name' in fields or 'school' in fields:
+            # Keep the player table of a single-document bracket current
+            player = self.get_player(player_id) or {}
+            bracket_store.update_player(self.client, tournament_id, player_id,
+                                        player.get('name', ''), player.get('school', ''))
+        # Bumped last: a reader that sees the new version also sees the new data
+        self._reset_bracket_version(tournament_id, lambda transaction, tournament:
+                                    {CHAMPION_NAME_FIELD: fields['name']}
+                                    if 'name' in fields and tournament.get(CHAMPION_ID_FIELD) == player_id else None)
+
+    def delete_player(self, tournament_id: str, player_id: str) -> None:
+        player_ref = self.client.collection('players').document(player_id)
+
+        def delete(transaction, tournament):
+            if not player_ref.get(transaction=transaction).exists:
+                return None # Already gone; the count must not drop twice
+            transaction.delete(player_ref)
+            return count_change(tournament, PLAYER_COUNT_FIELD, -1)
+
+        self._reset_bracket_version(tournament_id, delete)
+
+    def set_player_order(self, tournament_id: str, player_ids: list[str]) -> None:
+        writer = BulkWriter.from_env(self.client, f"Reordering players of tournament {tournament_id}")
+        players_ref = self.client.collection('players')
+        for index, player_id in enumerate(player_ids):
+            writer.update(players_ref.document(player_id), {'ui_order': index})
+        writer.close()
+
+    # --- Brackets ---
+
+    def save_bracket(self, tournament_id: str, matches: list[dict], players: list[dict], on_progress=None) -> None:
+        # The previous bracket stays in place, and is what readers load, until
+        # the tournament is switched to the new one below
+        previous_match_refs = [doc.reference for doc in
+                               self.client.collection('matches').where('tournament_id', '==', tournament_id).stream()]
+
+        storage_mode = bracket_store.default_storage_mode()
+        generation = None
+        if storage_mode == bracket_store.SINGLE_DOCUMENT:
+            # Whole bracket in one versioned document (sharded when large), written in one batch
+            bracket = Bracket.from_match_dicts(matches)
+            bracket_store.save_bracket(self.client, tournament_id, bracket, {p['id']: p for p in players})
+        else:
+            writer = BulkWriter.from_env(self.client, f"Saving bracket of tournament {tournament_id}", on_progress)
+            generation = self._save_match_documents(tournament_id, matches, writer)
+            writer.close()
+
+        # The switch: bumped once everything is written, so readers never load a half-written bracket
+        summary = bracket_summary(matches, {player['id']: player.get('name') for player in players})
+        self._reset_bracket_version(tournament_id, fields={**summary, bracket_store.STORAGE_FIELD: storage_mode,
+                                                           _GENERATION_FIELD: generation})
+
+        cleanup = BulkWriter.from_env(self.client, f"Deleting previous bracket of tournament {tournament_id}")
+        for ref in previous_match_refs:
+            cleanup.delete(ref)
+        if storage_mode != bracket_store.SINGLE_DOCUMENT:
+            bracket_store.delete_bracket(self.client, tournament_id, batch=cleanup)
+        cleanup.close()
+        if previous_match_refs:
+            logging.info(f"Deleted {len(previous_match_refs)} previous matches of tournament {tournament_id}")
+
+    def _reset_bracket_version(self, tournament_id: str, write=None, fields: dict | None = None) -> int:
+        """
+        Increment the tournament's bracket_version and mark it as a reset, in one transaction.
+
+        Args:
+            tournament_id (str): The ID of the tournament.
+            write (callable): Optional write to make in the same transaction; called with
+                              it and the tournament's data, and may return more fields to
+                              set on the tournament (e.g. its summary counts).
+            fields (dict): Optional extra fields to set on the tournament.
+
+        Returns:
+            int: The new bracket_version.
+        """
+        tournament_ref = self.client.collection('tournaments').document(tournament_id)
+
+        @firestore.transactional
+        def reset_in_transaction(transaction):
+            snapshot = tournament_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise NotFoundError(f"Tournament {tournament_id} not found")
+            tournament = snapshot.to_dict()
+            version = (tournament.get(BRACKET_VERSION_FIELD) or 0) + 1
+            written = write(transaction, tournament) if write is not None else None
+            transaction.update(tournament_ref, {**(fields or {}), **(written or {}),
+                                                BRACKET_VERSION_FIELD: version, BRACKET_RESET_FIELD: version})
+            return version
+
+        return reset_in_transaction(self.client.transaction())
+
+    def _save_match_documents(self, tournament_id: str, matches: list[dict], writer: BulkWriter) -> str:
+        """
+        Queue one document per match, linked to the next match by its Firestore ID.
+
+        Returns:
+            str: The generation the documents are tagged with; load_bracket only
+                 reads the generation named on the tournament.
+        """
+        matches_ref = self.client.collection('matches')
+        generation = matches_ref.document().id
+        if not matches:
+            logging.warning(f"create_tournament_bracket returned no matches for {tournament_id}")
+            return generation
+        # IDs are generated client-side up front, so each match is written once with its link
+        match_refs = [matches_ref.document() for _ in matches]
+        for match_data, match_ref in zip(matches, match_refs):
+            match_data['tournament_id'] = tournament_id
+            match_data[_GENERATION_FIELD] = generation
+            # Don't save next_match_index to Firestore
+            next_match_idx = match_data.pop('next_match_index', None)
+            if next_match_idx is not None:
+                match_data['next_match_id'] = match_refs[next_match_idx].id
+            writer.set(match_ref, match_data)
+        logging.info(f"Queued {len(matches)} match documents for tournament {tournament_id}")
+        return generation
+
+    def load_bracket(self, tournament: dict) -> tuple:
+        tournament_id = tournament['id']
+        if bracket_store.uses_single_document(tournament):
+            # Single-document brackets carry their own player table
+            loaded = bracket_store.load_bracket(self.client, tournament_id)
+            if loaded is None:
+                return None, {}
+            bracket, players, _ = loaded
+            return bracket, players
+
+        players_dict = {}
+        for doc in self.client.collection('players').where('tournament_id', '==', tournament_id).stream():
+            player_data = doc.to_dict()
+            # Include only necessary info for bracket display
+            players_dict[doc.id] = {
+                 'name': player_data.get('name', 'Unknown'),
+                 'school': player_data.get('school', '')
+            }
+        logging.debug(f"Fetched {len(players_dict)} players for bracket {tournament_id}")
+        if not players_dict:
+            return None, players_dict
+
+        # No ordering needed: each match's place in the bracket follows from its round and match number.
+        # Documents of a bracket still being written, or of one being cleaned up, are skipped.
+        generation = tournament.get(_GENERATION_FIELD)
+        match_list = []
+        for doc in self.client.collection('matches').where('tournament_id', '==', tournament_id).stream():
+            match_data = _doc_to_dict(doc)
+            if match_data.get(_GENERATION_FIELD) == generation:
+                match_list.append(match_data)
+        logging.debug(f"Firestore query for matches returned {len(match_list)} documents for tournament {tournament_id}")
+        if not match_list:
+            return None, players_dict
+        return Bracket.from_match_dicts(match_list), players_dict
+
+    def iter_matches(self, tournament: dict, page_size: int = PAGE_SIZE):
+        tournament_id = tournament['id']
+        if bracket_store.uses_single_document(tournament):
+            # One document (or a few shards) holds the whole bracket anyway
+            loaded = bracket_store.load_bracket(self.client, tournament_id)
+            if loaded is not None:
+                for match_data in loaded[0].to_match_dicts(tournament_id):
+                    match_data.pop('next_match_index', None)
+                    yield match_data
+            return
+        # Ordered by document ID, which needs no composite index
+        generation = tournament.get(_GENERATION_FIELD)
+        query = self.client.collection('matches').where('tournament_id', '==', tournament_id)
+        for doc in _stream_pages(query, page_size):
+            match_data = _doc_to_dict(doc)
+            if match_data.get(_GENERATION_FIELD) == generation:
+                yield match_data
+
+    def record_result(self, match_id: str, winner_id: str | None) -> str:
+        single_document_match = bracket_store.parse_match_id(match_id)
+        try:
+            if single_document_match:
+                tournament_id, node = single_document_match
+                version = bracket_store.update_result(self.client, tournament_id, node, winner_id)
+                logging.info(f"Updated match {match_id}, bracket version {version}")
+                return tournament_id
+            return self._record_match_document_result(match_id, winner_id)
+        except NotFound as e:
+            raise NotFoundError(str(e)) from e
+
+    def _record_match_document_result(self, match_id: str, winner_id: str | None) -> str:
+        client = self.client
+        match_ref = client.collection('matches').document(match_id)
+
+        # Use a transaction to ensure atomic update and advancement
+        @firestore.transactional
+        def update_in_transaction(transaction):
+            match_snapshot = match_ref.get(transaction=transaction)
+            if not match_snapshot.exists:
+                raise NotFound(f"Match {match_id} not found")
+            match_data = _doc_to_dict(match_snapshot)
+            tournament_id = match_data.get('tournament_id')
+            next_match_id = match_data.get('next_match_id')
+
+            if not tournament_id:
+                raise ValueError(f"Match {match_id} is missing tournament_id")
+            if match_data.get('match_number') is None:
+                raise ValueError(f"Match {match_id} is missing match_number")
+            if winner_id is not None and winner_id not in (match_data.get('player1_id'), match_data.get('player2_id')):
+                raise ValueError(f"Player {winner_id} is not in match {match_id}")
+
+            # Read next match and the tournament before writing anything
+            next_match_ref = None
+            next_match_data = None
+            if next_match_id and winner_id:
+                next_match_ref = client.collection('matches').document(next_match_id)
+                next_match_snapshot = next_match_ref.get(transaction=transaction)
+                if next_match_snapshot.exists:
+                    next_match_data = _doc_to_dict(next_match_snapshot)
+                else:
+                    logging.warning(f"[Transaction {transaction.id}] Next match {next_match_id} referenced by match {match_id} not found.")
+            tournament_ref = client.collection('tournaments').document(tournament_id)
+            tournament_snapshot = tournament_ref.get(transaction=transaction)
+            if not tournament_snapshot.exists:
+                raise NotFound(f"Tournament {tournament_id} not found")
+            tournament_data = tournament_snapshot.to_dict()
+            bracket_version = (tournament_data.get(BRACKET_VERSION_FIELD) or 0) + 1
+
+            match_update, next_update = advance_winner(match_data, next_match_data, winner_id)
+            played = is_played({**match_data, **match_update}) - is_played(match_data)
+            tournament_update = {BRACKET_VERSION_FIELD: bracket_version,
+                                 **count_change(tournament_data, COMPLETED_MATCHES_FIELD, played)}
+            if not next_match_id:
+                tournament_update.update(self._champion_fields(transaction, winner_id))
+
+            # Changed matches carry the new version, for delta reads
+            match_update['version'] = bracket_version
+            transaction.update(match_ref, match_update)
+            if next_update:
+                next_update['version'] = bracket_version
+                transaction.update(next_match_ref, next_update)
+                logging.info(f"[Transaction {transaction.id}] Updated next match {next_match_id} with {next_update}")
+
+            # Check if this was the final match and update tournament status
+            if not next_match_id and winner_id:
+                tournament_update['status'] = 'completed'
+                logging.info(f"[Transaction {transaction.id}] Final match {match_id} completed, tournament {tournament_id} marked completed.")
+            transaction.update(tournament_ref, tournament_update)
+            return tournament_id
+
+        logging.info(f"Attempting transaction for match {match_id} with winner {winner_id}")
+        return update_in_transaction(client.transaction())
+
+    def record_results(self, tournament_id: str, results: list[tuple[str, str | None]]) -> list[str | None]:
+        parsed = [bracket_store.parse_match_id(match_id) for match_id, _ in results]
+        try:
+            if any(item and item[0] == tournament_id for item in parsed):
+                return self._record_single_document_results(tournament_id, results, parsed)
+            errors = []
+            for start in range(0, len(results), _RESULTS_PER_COMMIT):
+                errors.extend(self._record_match_document_results(tournament_id, results[start:start + _RESULTS_PER_COMMIT]))
+            return errors
+        except NotFound as e:
+            raise NotFoundError(str(e)) from e
+
+    def _record_single_document_results(self, tournament_id: str, results: list, parsed: list) -> list[str | None]:
+        errors = [f"Match {match_id} not found" for match_id, _ in results]
+        indexes = [index for index, item in enumerate(parsed) if item and item[0] == tournament_id]
+        version, node_errors = bracket_store.update_results(
+            self.client, tournament_id, [(parsed[index][1], results[index][1]) for index in indexes])
+        for index, error in zip(indexes, node_errors):
+            errors[index] = str(error) if error else None
+        logging.info(f"Recorded {node_errors.count(None)} of {len(results)} results for tournament {tournament_id}, bracket version {version}")
+        return errors
+
+    def _record_match_document_results(self, tournament_id: str, results: list) -> list[str | None]:
+        client = self.client
+        matches_ref = client.collection('matches')
+        tournament_ref = client.collection('tournaments').document(tournament_id)
+        match_refs = {match_id: matches_ref.document(match_id) for match_id, _ in results if match_id and '/' not in match_id}
+
+        @firestore.transactional
+        def update_in_transaction(transaction):
+            tournament_snapshot = tournament_ref.get(transaction=transaction)
+            if not tournament_snapshot.exists:
+                raise NotFound(f"Tournament {tournament_id} not found")
+
+            # Read the batch's matches in one call, then the matches they feed in another
+            matches = {}
+
+            def read_matches(refs):
+                if refs:
+                    for snapshot in client.get_all(refs, transaction=transaction):
+                        if snapshot.exists:
+                            matches[snapshot.id] = _doc_to_dict(snapshot)
+
+            read_matches(list(match_refs.values()))
+            next_ids = {match.get('next_match_id') for match in matches.values()
+                        if match.get('tournament_id') == tournament_id} - matches.keys() - {None}
+            read_matches([matches_ref.document(next_id) for next_id in next_ids])
+
+            was_played = {match_id: is_played(match) for match_id, match in matches.items()}
+            errors, updates, completed = apply_results(tournament_id, matches, results)
+            if not updates:
+                return errors
+
+            tournament_data = tournament_snapshot.to_dict()
+            bracket_version = (tournament_data.get(BRACKET_VERSION_FIELD) or 0) + 1
+            played = sum(is_played(matches[match_id]) - was_played[match_id] for match_id in updates)
+            tournament_update = {BRACKET_VERSION_FIELD: bracket_version,
+                                 **count_change(tournament_data, COMPLETED_MATCHES_FIELD, played)}
+            for match_id in updates:
+                if not matches[match_id].get('next_match_id'):
+                    tournament_update.update(self._champion_fields(transaction, matches[match_id].get('winner_id')))
+
+            # Changed matches carry the new version, for delta reads
+            for match_id, update in updates.items():
+                transaction.update(matches_ref.document(match_id), {**update, 'version': bracket_version})
+            if completed:
+                tournament_update['status'] = 'completed'
+                logging.info(f"[Transaction {transaction.id}] Final match decided, tournament {tournament_id} marked completed.")
+            transaction.update(tournament_ref, tournament_update)
+            return errors
+
+        logging.info(f"Attempting transaction for {len(results)} results of tournament {tournament_id}")
+        return update_in_transaction(client.transaction())
+
+    def _champion_fields(self, transaction, winner_id: str | None) -> dict:
+        """Summary fields for the winner of the final (None when its result is cleared), read in the transaction."""
+        name = None
+        if winner_id:
+            snapshot = self.client.collection('players').document(winner_id).get(transaction=transaction)
+            name = snapshot.to_dict().get('name') if snapshot.exists else None
+        return {CHAMPION_ID_FIELD: winner_id, CHAMPION_NAME_FIELD: name}
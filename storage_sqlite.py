@@ -0,0 +1,372 @@
+# SQLite storage backend
+#
+# Local alternative to Firestore for venues without a reliable connection,
+# and for benchmarks and scripts that should not need a cloud project. The
+# database runs in WAL mode so readers never block the writer, and each
+# thread gets its own connection.
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from models import Bracket
+from storage import (BRACKET_RESET_FIELD, BRACKET_VERSION_FIELD, CHAMPION_ID_FIELD, CHAMPION_NAME_FIELD,
+                     COMPLETED_MATCHES_FIELD, MATCH_COUNT_FIELD, PAGE_SIZE, PLAYER_COUNT_FIELD, NotFoundError, Repository,
+                     advance_winner, apply_results)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tournaments (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    date TEXT,
+    status TEXT NOT NULL DEFAULT 'setup',
+    bracket_version INTEGER NOT NULL DEFAULT 0,
+    bracket_reset_version INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_tournaments_date ON tournaments (date);
+
+CREATE TABLE IF NOT EXISTS players (
+    id TEXT PRIMARY KEY,
+    tournament_id TEXT NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    school TEXT NOT NULL,
+    is_seeded INTEGER NOT NULL DEFAULT 0,
+    ui_order INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_players_tournament_name ON players (tournament_id, name, school);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id TEXT PRIMARY KEY,
+    tournament_id TEXT NOT NULL REFERENCES tournaments (id) ON DELETE CASCADE,
+    round_number INTEGER NOT NULL,
+    match_number INTEGER NOT NULL,
+    player1_id TEXT,
+    player2_id TEXT,
+    winner_id TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    next_match_id TEXT,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_position ON matches (tournament_id, round_number, match_number);
+"""
+
+_TOURNAMENT_COLUMNS = ('name', 'date', 'status', BRACKET_VERSION_FIELD, BRACKET_RESET_FIELD)
+_PLAYER_COLUMNS = ('tournament_id', 'name', 'school', 'is_seeded', 'ui_order')
+_MATCH_COLUMNS = ('tournament_id', 'round_number', 'match_number', 'player1_id', 'player2_id',
+                  'winner_id', 'status', 'next_match_id', 'version')
+
+
+def new_id() -> str:
+    """Random 20-character ID, the same length as Firestore auto IDs."""
+    return secrets.token_hex(10)
+
+
+def _to_db(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _split_fields(fields: dict, columns: tuple) -> tuple[dict, dict]:
+    """Split a record into values for real columns and the rest, kept in the 'extra' JSON column."""
+    known = {k: _to_db(v) for k, v in fields.items() if k in columns}
+    extra = {k: _to_db(v) for k, v in fields.items() if k not in columns and k != 'id'}
+    return known, extra
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict:
+    data = dict(row)
+    extra = data.pop('extra', None)
+    if extra:
+        for key, value in json.loads(extra).items():
+            data.setdefault(key, value)
+    if isinstance(data.get('date'), str):
+        try:
+            data['date'] = datetime.fromisoformat(data['date'])
+        except ValueError:
+            pass
+    if 'is_seeded' in data:
+        data['is_seeded'] = bool(data['is_seeded'])
+    return data
+
+
+class SQLiteRepository(Repository):
+    """Storage in a local SQLite database file."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; multi-statement writes use _transaction()
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements in one write transaction, taking the write lock up front."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _query(self, sql: str, params: tuple = ()) -> list[dict]:
+        return [_row_to_dict(row) for row in self._connection().execute(sql, params)]
+
+    def _insert(self, conn, table: str, columns: tuple, data: dict) -> str:
+        record_id = data.get('id') or new_id()
+        known, extra = _split_fields(data, columns)
+        names = ['id', *known, 'extra']
+        conn.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                     (record_id, *known.values(), json.dumps(extra, ensure_ascii=False)))
+        return record_id
+
+    def _update(self, conn, table: str, columns: tuple, record_id: str, fields: dict) -> None:
+        known, extra = _split_fields(fields, columns)
+        if extra:
+            row = conn.execute(f"SELECT extra FROM {table} WHERE id = ?", (record_id,)).fetchone()
+            if row is None:
+                raise NotFoundError(f"{table[:-1].capitalize()} {record_id} not found")
+            merged = json.loads(row['extra'] or '{}')
+            merged.update(extra)
+            known['extra'] = json.dumps(merged, ensure_ascii=False)
+        if not known:
+            return
+        assignments = ', '.join(f"{name} = ?" for name in known)
+        cursor = conn.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", (*known.values(), record_id))
+        if cursor.rowcount == 0:
+            raise NotFoundError(f"{table[:-1].capitalize()} {record_id} not found")
+
+    def _bump_bracket_version(self, conn, tournament_id: str, reset: bool = False) -> int:
+        """Increment bracket_version (and mark it as a reset) and return the new version."""
+        assignments = f"{BRACKET_VERSION_FIELD} = {BRACKET_VERSION_FIELD} + 1"
+        if reset:
+            assignments += f", {BRACKET_RESET_FIELD} = {BRACKET_VERSION_FIELD} + 1"
+        conn.execute(f"UPDATE tournaments SET {assignments} WHERE id = ?", (tournament_id,))
+        row = conn.execute(f"SELECT {BRACKET_VERSION_FIELD} FROM tournaments WHERE id = ?", (tournament_id,)).fetchone()
+        return row[0] if row else 0
+
+    # --- Tournaments ---
+
+    def list_tournaments(self) -> list[dict]:
+        return self._query("SELECT * FROM tournaments ORDER BY date DESC")
+
+    def list_tournaments_page(self, page_size: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+        # Summaries come from indexed subqueries, so there is nothing to keep in step on writes
+        conditions, params = '', ()
+        if cursor:
+            if not self._query("SELECT id FROM tournaments WHERE id = ?", (cursor,)):
+                raise NotFoundError(f"Tournament {cursor} not found")
+            # Keyset on (date, id): the cursor is the ID of the previous page's last tournament
+            conditions = "WHERE (t.date, t.id) < (SELECT date, id FROM tournaments WHERE id = ?)"
+            params = (cursor,)
+        rows = self._query(f"""
+            SELECT t.*,
+                (SELECT COUNT(*) FROM players WHERE tournament_id = t.id) AS {PLAYER_COUNT_FIELD},
+                (SELECT MAX(COUNT(player1_id) + COUNT(player2_id) - 1, 0) FROM matches
+                 WHERE tournament_id = t.id AND round_number = 1) AS {MATCH_COUNT_FIELD},
+                (SELECT COUNT(*) FROM matches WHERE tournament_id = t.id AND winner_id IS NOT NULL
+                 AND player1_id IS NOT NULL AND player2_id IS NOT NULL) AS {COMPLETED_MATCHES_FIELD},
+                f.winner_id AS {CHAMPION_ID_FIELD}, p.name AS {CHAMPION_NAME_FIELD}
+            FROM tournaments t
+            LEFT JOIN matches f ON f.tournament_id = t.id AND f.next_match_id IS NULL
+            LEFT JOIN players p ON p.id = f.winner_id
+            {conditions}
+            ORDER BY t.date DESC, t.id DESC LIMIT ?""", (*params, page_size + 1))
+        tournaments = rows[:page_size]
+        return tournaments, (tournaments[-1]['id'] if len(rows) > page_size else None)
+
+    def get_tournament(self, tournament_id: str) -> dict | None:
+        rows = self._query("SELECT * FROM tournaments WHERE id = ?", (tournament_id,))
+        return rows[0] if rows else None
+
+    def create_tournament(self, data: dict) -> str:
+        return self._insert(self._connection(), 'tournaments', _TOURNAMENT_COLUMNS, data)
+
+    def update_tournament(self, tournament_id: str, fields: dict) -> None:
+        with self._transaction() as conn:
+            self._update(conn, 'tournaments', _TOURNAMENT_COLUMNS, tournament_id, fields)
+
+    def delete_tournament(self, tournament_id: str) -> dict:
+        with self._transaction() as conn:
+            counts = {
+                'players': conn.execute("SELECT COUNT(*) FROM players WHERE tournament_id = ?", (tournament_id,)).fetchone()[0],
+                'matches': conn.execute("SELECT COUNT(*) FROM matches WHERE tournament_id = ?", (tournament_id,)).fetchone()[0],
+            }
+            # Players and matches go with it (ON DELETE CASCADE)
+            conn.execute("DELETE FROM tournaments WHERE id = ?", (tournament_id,))
+        logging.info(f"Deleted tournament {tournament_id}: {counts['matches']} matches, {counts['players']} players")
+        return counts
+
+    # --- Players ---
+
+    def list_players(self, tournament_id: str) -> list[dict]:
+        return self._query("SELECT * FROM players WHERE tournament_id = ? ORDER BY name", (tournament_id,))
+
+    def get_player(self, player_id: str) -> dict | None:
+        rows = self._query("SELECT * FROM players WHERE id = ?", (player_id,))
+        return rows[0] if rows else None
+
+    def find_players(self, tournament_id: str, name: str, school: str) -> list[dict]:
+        return self._query("SELECT * FROM players WHERE tournament_id = ? AND name = ? AND school = ?",
+                           (tournament_id, name, school))
+
+    def add_player(self, data: dict) -> str:
+        with self._transaction() as conn:
+            player_id = self._insert(conn, 'players', _PLAYER_COLUMNS, data)
+            self._bump_bracket_version(conn, data['tournament_id'], reset=True)
+        return player_id
+
+    def player_keys(self, tournament_id: str) -> set[tuple[str, str]]:
+        rows = self._connection().execute("SELECT name, school FROM players WHERE tournament_id = ?", (tournament_id,))
+        return {(row['name'], row['school']) for row in rows}
+
+    def add_players(self, tournament_id: str, players: list[dict]) -> list[str]:
+        with self._transaction() as conn:
+            player_ids = [self._insert(conn, 'players', _PLAYER_COLUMNS, {**data, 'tournament_id': tournament_id})
+                          for data in players]
+            self._bump_bracket_version(conn, tournament_id, reset=True)
+        return player_ids
+
+    def iter_players(self, tournament_id: str, page_size: int = PAGE_SIZE):
+        # Keyset pages, so no read transaction stays open while the caller consumes them
+        last = ('', '')
+        while True:
+            page = self._query("SELECT * FROM players WHERE tournament_id = ? AND (name, id) > (?, ?) "
+                               "ORDER BY name, id LIMIT ?", (tournament_id, *last, page_size))
+            yield from page
+            if len(page) < page_size:
+                return
+            last = (page[-1]['name'], page[-1]['id'])
+
+    def update_player(self, tournament_id: str, player_id: str, fields: dict) -> None:
+        with self._transaction() as conn:
+            self._update(conn, 'players', _PLAYER_COLUMNS, player_id, fields)
+            self._bump_bracket_version(conn, tournament_id, reset=True)
+
+    def delete_player(self, tournament_id: str, player_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM players WHERE id = ?", (player_id,))
+            self._bump_bracket_version(conn, tournament_id, reset=True)
+
+    def set_player_order(self, tournament_id: str, player_ids: list[str]) -> None:
+        with self._transaction() as conn:
+            conn.executemany("UPDATE players SET ui_order = ? WHERE id = ? AND tournament_id = ?",
+                             [(index, player_id, tournament_id) for index, player_id in enumerate(player_ids)])
+
+    # --- Brackets ---
+
+    def save_bracket(self, tournament_id: str, matches: list[dict], players: list[dict], on_progress=None) -> None:
+        # One transaction, so readers see the old bracket until it commits.
+        # IDs are assigned up front, so next_match_id links go in with the rows
+        match_ids = [new_id() for _ in matches]
+        rows = []
+        for match_id, match_data in zip(match_ids, matches):
+            next_index = match_data.get('next_match_index')
+            rows.append((
+                match_id, tournament_id, match_data['round_number'], match_data['match_number'],
+                match_data.get('player1_id'), match_data.get('player2_id'), match_data.get('winner_id'),
+                match_data.get('status', 'pending'), match_ids[next_index] if next_index is not None else None,
+                match_data.get('version', 0),
+            ))
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM matches WHERE tournament_id = ?", (tournament_id,)).rowcount
+            conn.executemany(f"INSERT INTO matches (id, {', '.join(_MATCH_COLUMNS)}) "
+                             f"VALUES ({', '.join('?' * (len(_MATCH_COLUMNS) + 1))})", rows)
+            self._bump_bracket_version(conn, tournament_id, reset=True)
+        logging.info(f"Replaced {deleted} matches with {len(rows)} for tournament {tournament_id}")
+
+    def load_bracket(self, tournament: dict) -> tuple:
+        tournament_id = tournament['id']
+        conn = self._connection()
+        players = {row['id']: {'name': row['name'], 'school': row['school']}
+                   for row in conn.execute("SELECT id, name, school FROM players WHERE tournament_id = ?", (tournament_id,))}
+        if not players:
+            return None, players
+        match_list = [dict(row) for row in conn.execute("SELECT * FROM matches WHERE tournament_id = ?", (tournament_id,))]
+        if not match_list:
+            return None, players
+        return Bracket.from_match_dicts(match_list), players
+
+    def iter_matches(self, tournament: dict, page_size: int = PAGE_SIZE):
+        last = (0, 0)
+        while True:
+            page = self._query("SELECT * FROM matches WHERE tournament_id = ? AND (round_number, match_number) > (?, ?) "
+                               "ORDER BY round_number, match_number LIMIT ?", (tournament['id'], *last, page_size))
+            yield from page
+            if len(page) < page_size:
+                return
+            last = (page[-1]['round_number'], page[-1]['match_number'])
+
+    def record_result(self, match_id: str, winner_id: str | None) -> str:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM matches WHERE id = ?", (match_id,)).fetchone()
+            if row is None:
+                raise NotFoundError(f"Match {match_id} not found")
+            match_data = dict(row)
+            if winner_id is not None and winner_id not in (match_data['player1_id'], match_data['player2_id']):
+                raise ValueError(f"Player {winner_id} is not in match {match_id}")
+            next_match_id = match_data['next_match_id']
+
+            next_match_data = None
+            if next_match_id and winner_id:
+                next_row = conn.execute("SELECT * FROM matches WHERE id = ?", (next_match_id,)).fetchone()
+                if next_row is None:
+                    logging.warning(f"Next match {next_match_id} referenced by match {match_id} not found.")
+                else:
+                    next_match_data = dict(next_row)
+
+            # Changed matches carry the new version, for delta reads
+            bracket_version = self._bump_bracket_version(conn, match_data['tournament_id'])
+            match_update, next_update = advance_winner(match_data, next_match_data, winner_id)
+            match_update['version'] = bracket_version
+            self._update(conn, 'matches', _MATCH_COLUMNS, match_id, match_update)
+            if next_update:
+                next_update['version'] = bracket_version
+                self._update(conn, 'matches', _MATCH_COLUMNS, next_match_id, next_update)
+
+            # Check if this was the final match and update tournament status
+            if not next_match_id and winner_id:
+                conn.execute("UPDATE tournaments SET status = 'completed' WHERE id = ?", (match_data['tournament_id'],))
+        return match_data['tournament_id']
+
+    def record_results(self, tournament_id: str, results: list[tuple[str, str | None]]) -> list[str | None]:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM tournaments WHERE id = ?", (tournament_id,)).fetchone() is None:
+                raise NotFoundError(f"Tournament {tournament_id} not found")
+            # One query covers every match a result can touch
+            matches = {row['id']: dict(row) for row in conn.execute("SELECT * FROM matches WHERE tournament_id = ?", (tournament_id,))}
+            errors, updates, completed = apply_results(tournament_id, matches, results)
+            if not updates:
+                return errors
+
+            bracket_version = self._bump_bracket_version(conn, tournament_id)
+            for match_id, update in updates.items():
+                self._update(conn, 'matches', _MATCH_COLUMNS, match_id, {**update, 'version': bracket_version})
+            if completed:
+                conn.execute("UPDATE tournaments SET status = 'completed' WHERE id = ?", (tournament_id,))
+        return errors
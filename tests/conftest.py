@@ -0,0 +1,44 @@
+from datetime import datetime
+
+import pytest
+
+import bracket_store
+from firestore_fake import FakeFirestoreClient
+from storage import set_repository
+from storage_firestore import FirestoreRepository
+from storage_sqlite import SQLiteRepository
+from tournament import create_tournament_bracket
+
+BACKENDS = ('match_documents', 'single_document', 'sqlite')
+
+
+@pytest.fixture(params=BACKENDS)
+def repo(request, monkeypatch, tmp_path):
+    """A fresh repository of each backend, installed as the process's repository."""
+    if request.param == 'sqlite':
+        repository = SQLiteRepository(str(tmp_path / 'tournaments.db'))
+    else:
+        storage = bracket_store.SINGLE_DOCUMENT if request.param == 'single_document' else bracket_store.MATCH_DOCUMENTS
+        monkeypatch.setenv('BRACKET_STORAGE', storage)
+        repository = FirestoreRepository(FakeFirestoreClient())
+    set_repository(repository)
+    yield repository
+    set_repository(None)
+
+
+def make_tournament(repo, players: int = 8, schools: str = 'ABCD', bracket: bool = True) -> str:
+    """Create a tournament with players from the given schools and, optionally, its bracket."""
+    tournament_id = repo.create_tournament({'name': 'Open', 'date': datetime(2026, 10, 17), 'status': 'setup'})
+    repo.add_players(tournament_id, [{'name': f'Player {i:02d}', 'school': schools[i % len(schools)], 'is_seeded': False}
+                                     for i in range(players)])
+    if bracket:
+        player_list = repo.list_players(tournament_id)
+        repo.save_bracket(tournament_id, create_tournament_bracket(tournament_id, player_list), player_list)
+    return tournament_id
+
+
+def first_round(repo, tournament_id: str) -> list[dict]:
+    """The stored first-round matches with two players, by match number."""
+    matches = repo.iter_matches(repo.get_tournament(tournament_id))
+    return sorted((m for m in matches if m['round_number'] == 1 and m.get('player1_id') and m.get('player2_id')),
+                  key=lambda m: m['match_number'])
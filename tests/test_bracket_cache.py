@@ -0,0 +1,58 @@
+import time
+
+from bracket_cache import BracketCache, CachedBracket
+
+
+def _cached(body: bytes = b'{}') -> CachedBracket:
+    return CachedBracket(body)
+
+
+def test_newer_version_evicts_the_entry():
+    cache = BracketCache()
+    cache.put('t1', 3, _cached())
+    assert cache.get('t1', 4) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_older_version_misses_but_keeps_the_entry():
+    cache = BracketCache()
+    entry = _cached()
+    cache.put('t1', 3, entry)
+    assert cache.get('t1', 2) is None
+    assert cache.get('t1', 3) is entry
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entry_is_evicted(monkeypatch):
+    cache = BracketCache(ttl=10)
+    cache.put('t1', 3, _cached())
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 11)
+    assert cache.get('t1', 3) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_put_keeps_a_newer_entry():
+    cache = BracketCache()
+    newer = _cached(b'new')
+    cache.put('t1', 5, newer)
+    cache.put('t1', 4, _cached(b'old'))
+    assert cache.get('t1', 5) is newer
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = BracketCache(max_entries=2)
+    cache.put('t1', 1, _cached())
+    cache.put('t2', 1, _cached())
+    cache.get('t1', 1)
+    cache.put('t3', 1, _cached())
+    assert cache.get('t2', 1) is None
+    assert cache.get('t1', 1) is not None and cache.get('t3', 1) is not None
+    assert cache.evictions == 1
+
+
+def test_changed_since_cuts_the_matches_after_a_version():
+    body = b'[{"a":1},{"b":2},{"c":3}]'
+    cached = CachedBracket(body, [(7, 17, 24), (2, 1, 8), (5, 9, 16)])
+    assert cached.changed_since(4) == [b'{"b":2}', b'{"c":3}']
+    assert cached.changed_since(7) == []
@@ -0,0 +1,146 @@
+import time
+
+import pytest
+
+import bracket_jobs
+import bracket_search
+from bracket_jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+from bracket_search import BrokenProcessPool
+from conftest import make_tournament
+
+
+def _queue(path, **kwargs) -> JobQueue:
+    """A queue whose runner threads never start, so tests claim and run its jobs themselves."""
+    queue = JobQueue(str(path), **kwargs)
+    queue._started = True
+    return queue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = _queue(tmp_path / 'jobs.db')
+    monkeypatch.setattr(bracket_jobs, 'job_queue', queue)
+    return queue
+
+
+class _BrokenPool:
+    """Process pool stand-in whose processes have all died."""
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('A process in the process pool was terminated abruptly')
+
+
+def _wait_for(queue: JobQueue, job_id: str, timeout: float = 10.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in (SUCCEEDED, FAILED):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} still {job['status']} after {timeout}s")
+
+
+def test_job_goes_from_queued_to_succeeded(repo, queue, monkeypatch):
+    monkeypatch.setattr(bracket_jobs, '_PROGRESS_INTERVAL', 0)
+    writes = []
+    update = queue._update
+    monkeypatch.setattr(queue, '_update', lambda job_id, **fields: (writes.append(fields), update(job_id, **fields)))
+    tournament_id = make_tournament(repo, bracket=False)
+
+    job, created = queue.submit(tournament_id, {})
+    assert created and (job['status'], job['phase'], job['progress']) == (QUEUED, QUEUED, 0)
+    # A second request for the same tournament gets the queued job
+    again, created = queue.submit(tournament_id, {})
+    assert not created and again['id'] == job['id']
+
+    claimed = queue._claim()
+    assert claimed['id'] == job['id']
+    assert (queue.get(job['id'])['status'], queue.get(job['id'])['attempts']) == (RUNNING, 1)
+    assert queue._claim() is None
+
+    queue._run(claimed)
+    job = queue.get(job['id'])
+    assert (job['status'], job['phase'], job['progress']) == (SUCCEEDED, 'done', 100)
+    assert job['result'] == {'matches': 7, 'draw_score': None}
+    assert job['message'] == 'Tournament bracket generated successfully'
+    assert queue.active_job(tournament_id) is None
+    assert repo.get_tournament(tournament_id)['status'] == 'in_progress'
+
+    # Progress moves through the phases in order and never goes back
+    phases = [fields['phase'] for fields in writes if 'phase' in fields]
+    assert list(dict.fromkeys(phases)) == ['loading_players', 'drawing', 'saving', 'finishing', 'done']
+    progress = [fields['progress'] for fields in writes if 'progress' in fields]
+    assert progress == sorted(progress) and progress[-1] == 100.0
+
+
+def test_job_for_too_few_players_fails(repo, queue):
+    tournament_id = make_tournament(repo, players=1, bracket=False)
+    job, _ = queue.submit(tournament_id, {})
+    queue._run(queue._claim())
+
+    job = queue.get(job['id'])
+    assert job['status'] == FAILED
+    assert job['error'] == 'At least 2 players are required to generate a bracket'
+    # A failed job doesn't block the next one
+    assert queue.submit(tournament_id, {})[1]
+
+
+def test_job_failing_while_saving_records_the_error(repo, queue, monkeypatch):
+    tournament_id = make_tournament(repo, bracket=False)
+
+    def save_bracket(*args, **kwargs):
+        raise RuntimeError('Deadline exceeded')
+
+    monkeypatch.setattr(repo, 'save_bracket', save_bracket)
+    job, _ = queue.submit(tournament_id, {})
+    queue._run(queue._claim())
+
+    job = queue.get(job['id'])
+    assert (job['status'], job['phase'], job['error']) == (FAILED, 'saving', 'Deadline exceeded')
+    assert repo.get_tournament(tournament_id)['status'] == 'setup'
+
+
+def test_broken_process_pool_draws_the_candidates_in_the_runner(repo, queue, monkeypatch):
+    monkeypatch.setattr(bracket_search, '_get_pool', lambda: _BrokenPool())
+    tournament_id = make_tournament(repo, players=12, bracket=False)
+
+    job, _ = queue.submit(tournament_id, {'candidates': 3, 'time_budget': 10})
+    queue._run(queue._claim())
+
+    job = queue.get(job['id'])
+    assert job['status'] == SUCCEEDED
+    assert job['result']['matches'] == 15
+    assert job['result']['draw_score']['candidates_scored'] == 3
+    assert 'best of 3 draws' in job['message']
+
+
+def test_job_of_a_dead_worker_is_queued_again_then_failed(repo, queue):
+    queue.stale_seconds = 60
+    tournament_id = make_tournament(repo, bracket=False)
+    job, _ = queue.submit(tournament_id, {})
+
+    for attempt in range(1, bracket_jobs._MAX_ATTEMPTS + 1):
+        assert queue._claim()['id'] == job['id']
+        assert queue.get(job['id'])['attempts'] == attempt
+        # The worker running it dies: its heartbeat stops
+        with queue._transaction() as conn:
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 120, job['id']))
+
+    assert queue._claim() is None
+    job = queue.get(job['id'])
+    assert (job['status'], job['error']) == (FAILED, 'Bracket generation was interrupted repeatedly.')
+
+
+def test_restarted_worker_runs_the_jobs_queued_before(repo, tmp_path, monkeypatch):
+    path = tmp_path / 'jobs.db'
+    first, second = make_tournament(repo, bracket=False), make_tournament(repo, players=5, bracket=False)
+    stopped = _queue(path)
+    jobs = [stopped.submit(first, {})[0], stopped.submit(second, {})[0]]
+
+    # A new worker on the same job database picks them up
+    restarted = JobQueue(str(path), poll_seconds=0.05)
+    monkeypatch.setattr(bracket_jobs, 'job_queue', restarted)
+    restarted.start()
+
+    assert [_wait_for(restarted, job['id'])['status'] for job in jobs] == [SUCCEEDED, SUCCEEDED]
+    assert [_wait_for(restarted, job['id'])['result']['matches'] for job in jobs] == [7, 7]
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import bracket_pdf
+
+
+def _fake_render(html: str, base_url: str, path: str) -> int:
+    """Stands in for WeasyPrint in the pool process: html is 'sleep <seconds>' or 'exit'."""
+    if html == 'exit':
+        os._exit(1)
+    time.sleep(float(html.split()[1]))
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.7 ' + html.encode())
+    return os.path.getsize(path)
+
+
+@pytest.fixture(autouse=True)
+def pdf_cache(tmp_path, monkeypatch):
+    # The pool is forked after the patch, so its processes run _fake_render
+    monkeypatch.setattr(bracket_pdf, '_render_pdf', _fake_render)
+    monkeypatch.setattr(bracket_pdf, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(bracket_pdf, 'RENDER_TIMEOUT', 5.0)
+    bracket_pdf._reset_pool()
+    yield tmp_path
+    pool = bracket_pdf._pool
+    bracket_pdf._reset_pool()
+    if pool is not None:
+        pool.shutdown()
+
+
+def _tournament(version: int = 1) -> dict:
+    return {'id': 't1', 'name': 'Open', 'date': '2026-10-17', 'status': 'in_progress', 'bracket_version': version}
+
+
+class _Html:
+    """build_html stand-in that counts its calls."""
+
+    def __init__(self, html: str = 'sleep 0'):
+        self.html = html
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        return self.html
+
+
+def test_renders_once_then_serves_the_cached_file(pdf_cache):
+    build_html = _Html()
+    path = bracket_pdf.get_pdf(_tournament(), build_html, '/')
+    assert os.path.dirname(path) == str(pdf_cache)
+    assert bracket_pdf.get_pdf(_tournament(), build_html, '/') == path
+    assert build_html.calls == 1
+    assert not os.path.exists(f'{path}.lock')
+
+
+def test_concurrent_downloads_share_one_render():
+    build_html = _Html('sleep 0.3')
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(bracket_pdf.get_pdf(_tournament(), build_html, '/')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 1 and len(paths) == 5
+    assert build_html.calls == 1
+
+
+def test_timed_out_render_keeps_its_lock_until_it_finishes(monkeypatch):
+    monkeypatch.setattr(bracket_pdf, 'RENDER_TIMEOUT', 0.3)
+    build_html = _Html('sleep 1.5')
+    path = bracket_pdf.cache_path(_tournament())
+    with pytest.raises(TimeoutError):
+        bracket_pdf.get_pdf(_tournament(), build_html, '/')
+    assert os.path.exists(f'{path}.lock')
+
+    # A download during the render waits for it rather than rendering again
+    with pytest.raises(TimeoutError):
+        bracket_pdf.get_pdf(_tournament(), build_html, '/')
+    assert build_html.calls == 1
+
+    bracket_pdf._flights[path].result(timeout=5)
+    assert os.path.exists(path) and not os.path.exists(f'{path}.lock')
+    assert bracket_pdf.get_pdf(_tournament(), build_html, '/') == path
+    assert build_html.calls == 1
+
+
+def test_waits_for_a_render_locked_by_a_live_process(monkeypatch):
+    monkeypatch.setattr(bracket_pdf, 'RENDER_TIMEOUT', 0.5)
+    path = bracket_pdf.cache_path(_tournament())
+    with open(f'{path}.lock', 'w') as f:
+        f.write(str(os.getppid()))
+    build_html = _Html()
+    with pytest.raises(TimeoutError):
+        bracket_pdf.get_pdf(_tournament(), build_html, '/')
+    assert build_html.calls == 0
+
+
+def test_takes_over_the_lock_of_a_dead_process():
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    path = bracket_pdf.cache_path(_tournament())
+    with open(f'{path}.lock', 'w') as f:
+        f.write(str(dead.pid))
+    assert bracket_pdf.get_pdf(_tournament(), _Html(), '/') == path
+    assert not os.path.exists(f'{path}.lock')
+
+
+def test_a_dead_render_process_resets_the_pool():
+    path = bracket_pdf.cache_path(_tournament())
+    with pytest.raises(bracket_pdf.BrokenProcessPool):
+        bracket_pdf.get_pdf(_tournament(), _Html('exit'), '/')
+    assert bracket_pdf._pool is None
+    assert not os.path.exists(f'{path}.lock')
+    assert bracket_pdf.get_pdf(_tournament(), _Html(), '/') == path
+
+
+def test_only_older_versions_are_removed(pdf_cache):
+    other = bracket_pdf.get_pdf({**_tournament(1), 'id': 't10'}, _Html(), '/')
+    newer = bracket_pdf.get_pdf(_tournament(5), _Html(), '/')
+    # A slow render of an older version finishing late leaves the newer chart alone
+    older = bracket_pdf.get_pdf(_tournament(3), _Html(), '/')
+    assert os.path.exists(newer) and os.path.exists(older)
+
+    latest = bracket_pdf.get_pdf(_tournament(6), _Html(), '/')
+    assert sorted(os.listdir(pdf_cache)) == sorted(os.path.basename(p) for p in (latest, other))
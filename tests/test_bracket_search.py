@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import bracket_search
+from bracket_search import _rank, generate_best_bracket, score_bracket
+
+
+def _first_round(*pairs: tuple[str, str]) -> list[dict]:
+    return [{'round_number': 1, 'match_number': i + 1, 'player1_id': a, 'player2_id': b}
+            for i, (a, b) in enumerate(pairs)]
+
+
+def test_one_first_round_clash_outranks_many_later_ones():
+    # Four clashes in the second round weigh as much as one in the first, but the
+    # first-round clash still ranks worse
+    early = {'clashes_by_round': [1, 0, 0], 'rng_seed': 0, 'penalty': 16.0}
+    late = {'clashes_by_round': [0, 5, 0], 'rng_seed': 1, 'penalty': 20.0}
+    assert _rank(late) < _rank(early)
+
+
+def test_clashes_by_round_counts_schools_and_seeds():
+    players = [{'id': 'a1', 'school': 'A', 'is_seeded': True}, {'id': 'a2', 'school': 'A', 'is_seeded': False},
+               {'id': 'b1', 'school': 'B', 'is_seeded': True}, {'id': 'b2', 'school': 'B', 'is_seeded': False}]
+    score = score_bracket(_first_round(('a1', 'b2'), ('b1', 'a2')), players)
+    assert score['clashes_by_round'] == [0, 3]
+    assert score['earliest_same_school_round'] == 2
+    assert score['seed_collision_round'] == 2
+
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    monkeypatch.setenv('BRACKET_POOL_WORKERS', '1')
+    bracket_search._reset_pool(bracket_search._pool)
+    yield
+    pool = bracket_search._pool
+    bracket_search._reset_pool(pool)
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def test_generation_survives_a_killed_pool_process(fresh_pool, caplog):
+    players = [{'id': f'p{i}', 'name': f'Player {i}', 'school': 'AB'[i % 2], 'is_seeded': i < 2} for i in range(12)]
+    pool = bracket_search._get_pool()
+    pool.submit(os.getpid).result() # Starts the pool process
+    for process in list(pool._processes.values()):
+        process.kill()
+        process.join()
+
+    # The broken pool is dropped and the candidates are drawn in this process
+    matches, score = generate_best_bracket('t1', players, candidates=3, time_budget=10, base_seed=7)
+    assert score['candidates_scored'] == 3
+    assert {p for m in matches if m['round_number'] == 1 for p in (m['player1_id'], m['player2_id']) if p} \
+        == {p['id'] for p in players}
+    assert bracket_search._pool is not pool
+    assert [r.message for r in caplog.records if 'pool broke' in r.message] \
+        == ['Bracket candidate pool broke; drawing 3 candidate(s) for tournament t1 in this process']
+    caplog.clear()
+
+    # The next draw gets a fresh pool and picks the same candidate
+    _, again = generate_best_bracket('t1', players, candidates=3, time_budget=10, base_seed=7)
+    assert bracket_search._pool is not None and bracket_search._pool is not pool
+    assert (again['rng_seed'], again['clashes_by_round']) == (score['rng_seed'], score['clashes_by_round'])
+    assert not [r for r in caplog.records if 'pool broke' in r.message]
@@ -0,0 +1,102 @@
+import io
+
+import pytest
+
+import player_import
+from conftest import make_tournament
+from player_import import ADDED, DUPLICATE, INVALID, import_players, read_rows
+
+
+def _csv(text: str, encoding: str = 'utf-8') -> io.BytesIO:
+    return io.BytesIO(text.encode(encoding))
+
+
+def _import(repo, tournament_id: str, file, filename: str = 'players.csv', **kwargs) -> dict:
+    return import_players(repo, tournament_id, read_rows(file, filename, **kwargs))
+
+
+def _stored(repo, tournament_id: str) -> set:
+    return {(p['name'], p['school'], bool(p['is_seeded'])) for p in repo.list_players(tournament_id)}
+
+
+def test_header_names_the_columns(repo):
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    result = _import(repo, tournament_id, _csv('school,seeded,name\nA,yes,Ann\nB,,Bob\n'))
+    assert (result['added'], result['duplicates'], result['invalid']) == (2, 0, 0)
+    assert [(r['row'], r['status']) for r in result['rows']] == [(2, ADDED), (3, ADDED)]
+    assert all(r['player_id'] for r in result['rows'])
+    assert _stored(repo, tournament_id) == {('Ann', 'A', True), ('Bob', 'B', False)}
+
+
+def test_chinese_headers_with_a_byte_order_mark(repo):
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    result = _import(repo, tournament_id, _csv('\ufeff姓名,學校,種子\n王小明,建國中學,是\n李大華,北一女中,\n'))
+    assert result['added'] == 2
+    assert _stored(repo, tournament_id) == {('王小明', '建國中學', True), ('李大華', '北一女中', False)}
+
+
+def test_without_a_header_the_first_row_is_a_player(repo):
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    result = _import(repo, tournament_id, _csv('Ann,A,1\n\nBob,B\n'))
+    assert [(r['row'], r['name'], r['is_seeded']) for r in result['rows']] == [(1, 'Ann', True), (3, 'Bob', False)]
+    assert _stored(repo, tournament_id) == {('Ann', 'A', True), ('Bob', 'B', False)}
+
+
+def test_duplicates_in_the_file_and_in_the_tournament_are_skipped(repo):
+    tournament_id = make_tournament(repo, players=2, schools='A', bracket=False)
+    result = _import(repo, tournament_id, _csv('name,school\nPlayer 00,A\nAnn,A\nAnn,A\nAnn,B\n,A\n'))
+    assert (result['added'], result['duplicates'], result['invalid']) == (2, 2, 1)
+    assert [(r['status'], r['error']) for r in result['rows']] == [
+        (DUPLICATE, 'Player already exists in this tournament'),
+        (ADDED, None),
+        (DUPLICATE, 'Same player as row 3'),
+        (ADDED, None),
+        (INVALID, 'Player name and school are required'),
+    ]
+    assert len(repo.list_players(tournament_id)) == 4
+
+
+def test_too_many_rows_writes_nothing(repo, monkeypatch):
+    monkeypatch.setattr(player_import, 'MAX_IMPORT_ROWS', 3)
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    with pytest.raises(ValueError, match='more than 3 players'):
+        _import(repo, tournament_id, _csv('name,school\n' + ''.join(f'P{i},A\n' for i in range(4))))
+    assert repo.list_players(tournament_id) == []
+
+    # Exactly the limit is fine
+    assert _import(repo, tournament_id, _csv(''.join(f'P{i},A\n' for i in range(3))))['added'] == 3
+
+
+def test_non_utf8_csv_is_rejected_unless_its_encoding_is_given(repo):
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    text = '姓名,學校\n王小明,建國中學\n'
+    with pytest.raises(ValueError, match='not valid UTF-8'):
+        _import(repo, tournament_id, _csv(text, 'big5'))
+    assert repo.list_players(tournament_id) == []
+
+    assert _import(repo, tournament_id, _csv(text, 'big5'), encoding='big5')['added'] == 1
+    assert _stored(repo, tournament_id) == {('王小明', '建國中學', False)}
+
+
+def test_xlsx_upload(repo):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in (('Name', 'School', 'Seed'), ('Ann', 'A', 1.0), ('Bob', 'B', None), (None, None, None), (7.0, 'C', 0)):
+        sheet.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    file.seek(0)
+
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    result = _import(repo, tournament_id, file, 'players.XLSX')
+    assert [r['row'] for r in result['rows']] == [2, 3, 5]
+    assert _stored(repo, tournament_id) == {('Ann', 'A', True), ('Bob', 'B', False), ('7', 'C', False)}
+
+
+def test_broken_xlsx_is_rejected(repo):
+    pytest.importorskip('openpyxl')
+    tournament_id = make_tournament(repo, players=0, bracket=False)
+    with pytest.raises(ValueError, match='Could not read the file'):
+        _import(repo, tournament_id, io.BytesIO(b'name,school\nAnn,A\n'), 'players.xlsx')
+    assert repo.list_players(tournament_id) == []
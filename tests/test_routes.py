@@ -0,0 +1,99 @@
+import pytest
+
+import storage_firestore
+from conftest import first_round, make_tournament
+from routes import app
+
+
+@pytest.fixture
+def client(repo):
+    return app.test_client()
+
+
+def _post_results(client, tournament_id: str, results: list[tuple[str, str | None]]):
+    return client.post(f'/api/tournament/{tournament_id}/results',
+                       json={'results': [{'match_id': m, 'winner_id': w} for m, w in results]})
+
+
+def _matches(repo, tournament_id: str) -> dict:
+    return {m['id']: m for m in repo.iter_matches(repo.get_tournament(tournament_id))}
+
+
+def test_batch_rejects_a_winner_from_outside_the_match(repo, client):
+    tournament_id = make_tournament(repo)
+    match, other = first_round(repo, tournament_id)[:2]
+    before = _matches(repo, tournament_id)
+    version = repo.get_tournament(tournament_id)['bracket_version']
+
+    response = _post_results(client, tournament_id, [(match['id'], other['player1_id'])])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] is False
+    assert body['results'][0]['success'] is False
+    assert 'is not in match' in body['results'][0]['error']
+    assert repo.get_tournament(tournament_id)['bracket_version'] == version
+    assert _matches(repo, tournament_id) == before
+
+
+def test_batch_applies_the_valid_results_of_a_partly_invalid_batch(repo, client):
+    tournament_id = make_tournament(repo)
+    first, second, third = first_round(repo, tournament_id)[:3]
+    version = repo.get_tournament(tournament_id)['bracket_version']
+
+    response = _post_results(client, tournament_id, [
+        (first['id'], first['player1_id']),
+        ('no-such-match', first['player1_id']),
+        (second['id'], third['player2_id']),
+        (third['id'], third['player2_id']),
+    ])
+
+    body = response.get_json()
+    assert body['success'] is False
+    assert [r['success'] for r in body['results']] == [True, False, False, True]
+    assert body['results'][1]['error'] and body['results'][2]['error']
+    matches = _matches(repo, tournament_id)
+    assert matches[first['id']]['winner_id'] == first['player1_id']
+    assert matches[second['id']].get('winner_id') is None
+    assert matches[third['id']]['winner_id'] == third['player2_id']
+    # The valid results were written together, with one version increment
+    assert repo.get_tournament(tournament_id)['bracket_version'] == version + 1
+    assert matches[first['id']]['version'] == matches[third['id']]['version'] == version + 1
+
+
+def test_batch_larger_than_one_commit_advances_winners_across_commits(repo, client):
+    # 512 players give 256 first-round matches, more than one Firestore commit holds
+    tournament_id = make_tournament(repo, players=512, schools='ABCDEFGH')
+    round_one = first_round(repo, tournament_id)
+    assert len(round_one) > storage_firestore._RESULTS_PER_COMMIT
+    winners = [(m['id'], m['player1_id']) for m in round_one]
+
+    # Second-round results at the end of the batch decide on winners advanced earlier in it
+    feeders = {}
+    for match in round_one:
+        feeders.setdefault(match['next_match_id'], []).append(match)
+    second_round = [(next_id, min(fed, key=lambda m: m['match_number'])['player1_id'])
+                    for next_id, fed in sorted(feeders.items(), key=lambda item: item[0])]
+
+    response = _post_results(client, tournament_id, winners + second_round)
+
+    body = response.get_json()
+    assert body['success'] is True, [r for r in body['results'] if not r['success']]
+    assert len(body['results']) == len(winners) + len(second_round)
+    matches = _matches(repo, tournament_id)
+    assert all(matches[match_id]['winner_id'] == winner_id for match_id, winner_id in winners + second_round)
+    third_round = [m for m in matches.values() if m['round_number'] == 3]
+    assert all(m['player1_id'] and m['player2_id'] for m in third_round)
+    assert repo.get_tournament(tournament_id)['status'] != 'completed'
+
+
+def test_batch_rejects_a_malformed_body(repo, client):
+    tournament_id = make_tournament(repo)
+    assert _post_results(client, tournament_id, []).status_code == 400
+    response = client.post(f'/api/tournament/{tournament_id}/results', json={'results': [{'winner_id': 'p1'}]})
+    assert response.status_code == 400
+
+
+def test_batch_for_an_unknown_tournament_is_not_found(repo, client):
+    response = _post_results(client, 'no-such-tournament', [('m1', None)])
+    assert response.status_code == 404
@@ -0,0 +1,16 @@
+import pytest
+
+from conftest import first_round, make_tournament
+
+
+def test_record_result_rejects_a_winner_from_outside_the_match(repo):
+    tournament_id = make_tournament(repo)
+    match, other = first_round(repo, tournament_id)[:2]
+    before = list(repo.iter_matches(repo.get_tournament(tournament_id)))
+    version = repo.get_tournament(tournament_id)['bracket_version']
+
+    with pytest.raises(ValueError, match='is not in match'):
+        repo.record_result(match['id'], other['player1_id'])
+
+    assert repo.get_tournament(tournament_id)['bracket_version'] == version
+    assert list(repo.iter_matches(repo.get_tournament(tournament_id))) == before
@@ -0,0 +1,174 @@
+import json
+import random
+from collections import Counter
+from itertools import combinations
+
+import pytest
+
+from bracket_cache import bracket_cache
+from conftest import first_round, make_tournament
+from tournament import (_encode_payload, create_tournament_bracket, get_tournament_bracket,
+                        get_tournament_bracket_delta_json, get_tournament_bracket_json, meeting_round)
+
+# A 17-player draw from two schools, almost all seeded: the seeds of school A
+# crowd one half, which used to push a negative player count down the tree
+LOPSIDED = 'BBAAABAABABAAABAA'
+LOPSIDED_SEEDED = '11111011101010111'
+
+
+def _players(schools: str, seeded: str) -> list[dict]:
+    return [{'id': f'p{i}', 'name': f'Player {i:02d}', 'school': school, 'is_seeded': flag == '1'}
+            for i, (school, flag) in enumerate(zip(schools, seeded))]
+
+
+def _assert_valid_draw(players: list[dict], matches: list[dict]) -> None:
+    first_round = [m for m in matches if m['round_number'] == 1]
+    placed = Counter(player_id for m in first_round for player_id in (m['player1_id'], m['player2_id']) if player_id)
+    assert placed == Counter(p['id'] for p in players)
+    # A bye pairs with a player, never with another bye
+    assert all(m['player1_id'] or m['player2_id'] for m in first_round)
+
+
+@pytest.mark.parametrize('rng_seed', range(50))
+def test_lopsided_seeded_field(rng_seed):
+    random.seed(rng_seed)
+    players = _players(LOPSIDED, LOPSIDED_SEEDED)
+    _assert_valid_draw(players, create_tournament_bracket('t', players))
+
+
+def test_random_seeded_fields_place_every_player():
+    rng = random.Random(1)
+    for _ in range(500):
+        size = rng.randint(2, 80)
+        schools = ''.join(rng.choice('ABCD'[:rng.randint(1, 4)]) for _ in range(size))
+        seed_rate = rng.random()
+        seeded = ''.join('1' if rng.random() < seed_rate else '0' for _ in range(size))
+        random.seed(rng.random())
+        players = _players(schools, seeded)
+        _assert_valid_draw(players, create_tournament_bracket('t', players))
+
+
+def _earliest_meeting(matches: list[dict], players: list[dict], school: str) -> int:
+    slots = [2 * (m['match_number'] - 1) + offset for m in matches if m['round_number'] == 1
+             for offset, key in enumerate(('player1_id', 'player2_id'))
+             if m[key] and m[key] in {p['id'] for p in players if p['school'] == school}]
+    return min(meeting_round(a, b) for a, b in combinations(slots, 2))
+
+
+@pytest.mark.parametrize('rng_seed', range(5))
+def test_schools_meet_as_late_as_the_draw_allows(rng_seed):
+    # 32 schools of 8 in 256 slots: one player of each school per 32-slot subtree
+    random.seed(rng_seed)
+    players = _players(''.join(chr(ord('A') + i % 32) for i in range(256)), '0' * 256)
+    matches = create_tournament_bracket('t', players)
+    _assert_valid_draw(players, matches)
+    assert min(_earliest_meeting(matches, players, chr(ord('A') + i)) for i in range(32)) == 6
+
+
+@pytest.mark.parametrize('rng_seed', range(5))
+def test_unseeded_players_avoid_their_schools_seeds(rng_seed):
+    # School A's four seeds take one quarter each, so its other four players
+    # each get the other eighth of a quarter
+    random.seed(rng_seed)
+    players = _players('A' * 64, '1111' + '0' * 60)
+    for i, player in enumerate(players[8:]):
+        player['school'] = f'S{i}'
+    matches = create_tournament_bracket('t', players)
+    _assert_valid_draw(players, matches)
+    assert _earliest_meeting(matches, players, 'A') == 4
+
+
+def _payload(*versions: int) -> dict:
+    matches = [{'id': f'm{i}', 'player1': {'name': '選手 甲'}, 'version': version} for i, version in enumerate(versions)]
+    return {'rounds': {1: matches[:2], 2: matches[2:]}, 'players': {'p1': {'name': '選手 甲'}}, 'version': max(versions),
+            'error': None}
+
+
+def test_encoded_payload_is_the_json_of_the_payload():
+    bracket_data = _payload(3, 0, 5)
+    cached = _encode_payload(bracket_data)
+    assert json.loads(cached.body) == json.loads(json.dumps(bracket_data))
+    assert cached.error is None
+
+
+def test_encoded_payload_notes_the_matches_stamped_after_the_reset():
+    bracket_data = _payload(3, 1, 5, 2)
+    cached = _encode_payload(bracket_data, reset_version=2)
+    matches = bracket_data['rounds'][1] + bracket_data['rounds'][2]
+    assert [json.loads(body) for body in cached.changed_since(2)] == [matches[0], matches[2]]
+    assert [json.loads(body) for body in cached.changed_since(3)] == [matches[2]]
+    assert cached.changed_since(5) == []
+
+
+def test_error_payload_encodes_without_rounds():
+    cached = _encode_payload({'rounds': {}, 'players': {}, 'error': 'Tournament not found.'})
+    assert json.loads(cached.body) == {'rounds': {}, 'players': {}, 'error': 'Tournament not found.'}
+    assert cached.error == 'Tournament not found.'
+    assert json.loads(_encode_payload({'rounds': {}}).body) == {'rounds': {}}
+
+
+@pytest.fixture
+def empty_cache():
+    bracket_cache.clear()
+    yield
+    bracket_cache.clear()
+
+
+def _delta(tournament_id: str, since: int) -> dict:
+    return json.loads(get_tournament_bracket_delta_json(tournament_id, since))
+
+
+def _version(repo, tournament_id: str) -> int:
+    return repo.get_tournament(tournament_id)['bracket_version']
+
+
+def test_delta_since_the_current_version_is_empty(repo, empty_cache):
+    tournament_id = make_tournament(repo)
+    version = _version(repo, tournament_id)
+    assert _delta(tournament_id, version) == {'version': version, 'since': version, 'full_reload': False,
+                                              'matches': [], 'error': None}
+
+
+def test_delta_since_an_older_version_has_the_changed_matches(repo, empty_cache):
+    tournament_id = make_tournament(repo)
+    start = _version(repo, tournament_id)
+    get_tournament_bracket_json(tournament_id) # Cached before the results, and dropped by them
+    first, second = first_round(repo, tournament_id)[:2]
+    repo.record_result(first['id'], first['player1_id'])
+    repo.record_result(second['id'], second['player2_id'])
+    version = _version(repo, tournament_id)
+
+    full = get_tournament_bracket(tournament_id)
+    by_id = {m['id']: m for matches in full['rounds'].values() for m in matches}
+    delta = _delta(tournament_id, start)
+    assert (delta['version'], delta['since'], delta['full_reload']) == (version, start, False)
+    # Each result changes its match and the match its winner advances to
+    assert {m['id'] for m in delta['matches']} == {first['id'], second['id'], first['next_match_id']}
+    assert all(m == by_id[m['id']] for m in delta['matches'])
+
+    delta = _delta(tournament_id, version - 1)
+    assert {m['id'] for m in delta['matches']} == {second['id'], second['next_match_id']}
+
+
+def test_delta_since_before_the_last_reset_asks_for_a_full_reload(repo, empty_cache):
+    tournament_id = make_tournament(repo)
+    match = first_round(repo, tournament_id)[0]
+    repo.record_result(match['id'], match['player1_id'])
+    before = _version(repo, tournament_id)
+
+    # Regenerating the bracket resets it
+    players = repo.list_players(tournament_id)
+    repo.save_bracket(tournament_id, create_tournament_bracket(tournament_id, players), players)
+    version = _version(repo, tournament_id)
+    assert repo.get_tournament(tournament_id)['bracket_reset_version'] > before
+
+    delta = _delta(tournament_id, before)
+    assert (delta['version'], delta['full_reload'], delta['matches']) == (version, True, [])
+    # A version the server never reached means the client's data is unknown too
+    assert _delta(tournament_id, version + 1)['full_reload'] is True
+    assert _delta(tournament_id, version)['full_reload'] is False
+
+
+def test_delta_of_a_missing_tournament_asks_for_a_full_reload(repo, empty_cache):
+    assert _delta('no-such-tournament', 0) == {'error': 'Tournament not found. It may have been deleted.',
+                                                'full_reload': True}
@@ -1,12 +1,255 @@
 # Tournament bracket generation logic
+import gc
+import json
 import math
 import random
 import logging
-from collections import defaultdict
-# Removed SQLAlchemy model imports
-# from models import Match, Player
-# Removed db import from app, use db_firestore when needed (e.g., in get_tournament_bracket)
-from app import db_firestore # Keep this if get_tournament_bracket needs it directly
+import operator
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import count, repeat
+import numpy as np
+from bracket_cache import CachedBracket, bracket_cache
+from models import Bracket
+from storage import BRACKET_RESET_FIELD, BRACKET_VERSION_FIELD, NotFoundError, get_repository
+
+def meeting_round(slot_a: int, slot_b: int) -> int:
+    """
+    Return the round in which the players in two first-round slots can first meet.
+
+    Slots 0 and 1 meet in round 1, slots 0 and 2 in round 2, slots 0 and
+    total_slots // 2 only in the final.
+    """
+    return (slot_a ^ slot_b).bit_length()
+
+
+@lru_cache(maxsize=None)
+def seed_template(total_slots: int) -> tuple[int, ...]:
+    """
+    Return the standard seeding template for a bracket of total_slots.
+
+    Entry r is the first-round slot for seed rank r + 1. The layout is the usual
+    1 vs N, 2 vs N-1, ... draw in which seeds 1 and 2 can only meet in the final,
+    seeds 1-4 only in the semi-finals, and so on (the slot order of each rank
+    group follows bit-reversal). Templates are cached per bracket size.
+
+    Args:
+        total_slots (int): Bracket size, a power of two.
+
+    Returns:
+        tuple[int, ...]: First-round slot for each seed rank, one entry per slot.
+    """
+    # Seed rank in each slot, doubled level by level: rank r keeps its place
+    # and the new rank (size + 1 - r) becomes its first-round opponent
+    ranks = [1]
+    while len(ranks) < total_slots:
+        size = 2 * len(ranks) + 1
+        ranks = [r for rank in ranks for r in (rank, size - rank)]
+
+    slots = [0] * total_slots
+    for slot, rank in enumerate(ranks):
+        slots[rank - 1] = slot
+    return tuple(slots)
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Hold off cyclic garbage collection while building many long-lived objects.
+
+    Every match dictionary of a large draw outlives the build, so the
+    collections its allocations set off would walk all live objects (the
+    player records included) and free nothing.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _place_by_school(slot_players: np.ndarray, open_slots: np.ndarray, to_place: np.ndarray, school_of: np.ndarray) -> None:
+    """
+    Fill the open slots of a draw with players, keeping schools apart.
+
+    The draw is treated as a binary tree in heap order: node 1 is the whole
+    bracket, the halves of node n are 2n and 2n + 1, and leaf total_slots + s is
+    first-round slot s. Each school is split between the two halves of a node so
+    that the half with fewer players from that school (seeds included) receives
+    more, recursively down to single slots. Players from the same school
+    therefore meet as late as the draw allows.
+
+    The tree is walked one level at a time with every school at once, so a
+    level costs a handful of array operations over its (node, school) groups.
+    Within a node, an odd player of a school goes to whichever half keeps the
+    open slots of both halves most even, chosen at random among the schools
+    with one to spare. Only when a half is short of room are schools pushed
+    further off balance, larger schools first.
+
+    Args:
+        slot_players (np.ndarray): Player index in each first-round slot, -1 if
+                                   empty (seeds are already placed). Filled in place.
+        open_slots (np.ndarray): Boolean mask of the slots to fill (empty and not a bye).
+        to_place (np.ndarray): Indices of the players to place.
+        school_of (np.ndarray): School code of every player.
+    """
+    total_slots = len(slot_players)
+    num_rounds = total_slots.bit_length() - 1
+    if not len(to_place):
+        return
+
+    # Open slots and seeded players below every node of the bracket tree,
+    # counted level by level
+    free = np.zeros(2 * total_slots, dtype=np.int64)
+    free[total_slots:] = open_slots
+    seeded = np.zeros(2 * total_slots, dtype=np.int64)
+    seeded[total_slots:] = slot_players >= 0
+    for depth in reversed(range(num_rounds)):
+        start = 1 << depth
+        free[start:2 * start] = free[2 * start:4 * start:2] + free[2 * start + 1:4 * start:2]
+        seeded[start:2 * start] = seeded[2 * start:4 * start:2] + seeded[2 * start + 1:4 * start:2]
+
+    # The same by school, as sorted lookup keys (school * 2 * total_slots + node).
+    # Only groups of a school with seeds, in a node with seeds, need the lookup.
+    seed_slots = np.flatnonzero(slot_players >= 0)
+    seed_schools = school_of[slot_players[seed_slots]]
+    seed_keys, seed_totals = np.unique(np.concatenate([seed_schools * (2 * total_slots) + ((total_slots + seed_slots) >> r)
+                                                       for r in range(1, num_rounds + 1)]), return_counts=True)
+    has_seeds = np.zeros(len(school_of), dtype=bool)
+    has_seeds[seed_schools] = True
+
+    def seeds_in(schools, nodes):
+        counts = np.zeros(len(schools), dtype=np.int64)
+        some = np.flatnonzero(has_seeds[schools] & (seeded[nodes] > 0))
+        if len(some):
+            keys = schools[some] * (2 * total_slots) + nodes[some]
+            found = np.minimum(np.searchsorted(seed_keys, keys), len(seed_keys) - 1)
+            counts[some] = np.where(seed_keys[found] == keys, seed_totals[found], 0)
+        return counts
+
+    # One permutation up front randomizes the order within each school; a
+    # school's players then take consecutive entries of by_school, and each
+    # group of the walk covers a range of them
+    rng = np.random.default_rng(random.getrandbits(64))
+    shuffled = rng.permutation(to_place)
+    sizes = np.bincount(school_of[to_place])
+    school_keys = school_of[shuffled]
+    if len(sizes) <= 1 << 16:
+        school_keys = school_keys.astype(np.uint16) # A stable sort of 16-bit keys is a radix sort
+    by_school = shuffled[np.argsort(school_keys, kind='stable')]
+
+    # Once a school is down to one player in a subtree that holds none of its
+    # seeds, the exact slot inside that subtree no longer matters for it. Such
+    # players are reserved on the subtree node and given a concrete slot
+    # afterwards, which keeps the walk short for small schools. A lone player
+    # whose school has no seeds is reserved on the root straight away.
+    reserved_nodes, reserved_players = [], []
+
+    def reserve(node, k, school, first):
+        done = k == 1
+        done[done] = seeds_in(school[done], node[done]) == 0
+        reserved_nodes.append(node[done])
+        reserved_players.append(by_school[first[done]])
+        keep = ~done
+        return node[keep], k[keep], school[keep], first[keep]
+
+    school = np.flatnonzero(sizes)
+    node, k, school, first = reserve(np.ones(len(school), dtype=np.int64), sizes[school], school, (np.cumsum(sizes) - sizes)[school])
+    # Larger schools first (they absorb any forced imbalance), ties at random
+    order = np.argsort(rng.random(len(school)) - k)
+    node, k, school, first = node[order], k[order], school[order], first[order]
+    for _ in range(num_rounds):
+        if not len(node):
+            break
+        # Even out (school players already in the half + new ones) across both
+        # halves; an odd one may go either way
+        diff = k + seeds_in(school, 2 * node + 1) - seeds_in(school, 2 * node)
+        low = np.clip(diff >> 1, 0, k)
+        high = np.clip((diff >> 1) + (diff & 1), 0, k)
+
+        # Groups are sorted by node; settle how many go left in each node
+        block_starts = np.flatnonzero(np.concatenate(([True], node[1:] != node[:-1])))
+        block_sizes = np.diff(np.append(block_starts, len(node)))
+        block_of = np.repeat(np.arange(len(block_starts)), block_sizes)
+        block_node = node[block_starts]
+        total = np.add.reduceat(k, block_starts)
+        low_total = np.add.reduceat(low, block_starts)
+        high_total = np.add.reduceat(high, block_starts)
+        free_left = free[2 * block_node]
+        free_right = free[2 * block_node + 1]
+        balanced = (free_left - free_right + total + rng.integers(0, 2, len(block_starts))) >> 1
+        # Enough go left that the right half can take the rest, no more than fit
+        go_left = np.clip(np.clip(balanced, low_total, high_total),
+                          np.maximum(total - free_right, 0), np.minimum(free_left, total))
+
+        def running(values):
+            # Sum of values before each group within its node
+            before = np.cumsum(values) - values
+            return before - before[block_starts][block_of]
+
+        # Odd players to send left, starting from a random school in each node
+        spare = high - low
+        spare_total = high_total - low_total
+        extra = np.clip(go_left - low_total, 0, spare_total)
+        offset = (rng.random(len(block_starts)) * spare_total).astype(np.int64)
+        chosen = (running(spare) - offset[block_of]) % np.maximum(spare_total, 1)[block_of] < extra[block_of]
+        k_left = low + (spare & chosen)
+        # Forced moves where a half is short of room, larger schools first
+        over = np.maximum(go_left - high_total, 0)
+        if over.any():
+            room = k - high
+            k_left += np.clip(over[block_of] - running(room), 0, room)
+        under = np.maximum(low_total - go_left, 0)
+        if under.any():
+            k_left -= np.clip(under[block_of] - running(low), 0, low)
+
+        # Children of node n: its left groups, then its right groups, so the
+        # next level stays sorted by node
+        left = np.arange(len(node)) + block_starts[block_of]
+        right = left + block_sizes[block_of]
+        child_node = np.empty(2 * len(node), dtype=np.int64)
+        child_k = np.empty_like(child_node)
+        child_school = np.empty_like(child_node)
+        child_first = np.empty_like(child_node)
+        child_node[left], child_node[right] = 2 * node, 2 * node + 1
+        child_k[left], child_k[right] = k_left, k - k_left
+        child_school[left] = child_school[right] = school
+        child_first[left], child_first[right] = first, first + k_left
+        keep = child_k > 0
+        node, k, school, first = reserve(child_node[keep], child_k[keep], child_school[keep], child_first[keep])
+
+    # Resolve reservations deepest subtree first, each node taking the first
+    # open slots in its range. Every reservation was counted against all of its
+    # ancestors, so a subtree always has room for the reservations made on it
+    # once its own descendants are settled.
+    reserved_nodes = np.concatenate(reserved_nodes)
+    reserved_players = np.concatenate(reserved_players)
+    by_node = np.argsort(reserved_nodes, kind='stable')
+    reserved_nodes = reserved_nodes[by_node]
+    reserved_players = reserved_players[by_node]
+    is_open = open_slots.copy()
+    for depth in reversed(range(num_rounds + 1)):
+        lo, hi = np.searchsorted(reserved_nodes, [1 << depth, 2 << depth])
+        if lo == hi:
+            continue
+        width = 1 << (num_rounds - depth)
+        local = reserved_nodes[lo:hi] - (1 << depth)
+        wanted = np.bincount(local, minlength=1 << depth)
+        # Rank of each open slot among the open slots of its node
+        open_before = np.cumsum(is_open, dtype=np.int32) - is_open
+        node_start = open_before[::width]
+        rank = open_before - np.repeat(node_start, width)
+        slots = np.flatnonzero(is_open & (rank < np.repeat(wanted, width)))
+        group = reserved_players[lo:hi]
+        if len(slots) < len(group):
+            logging.error(f"No open slot left for {len(group) - len(slots)} players reserved on bracket level {depth}")
+            room = np.diff(np.append(node_start, open_before[-1] + is_open[-1]))
+            group = group[np.arange(len(local)) - np.searchsorted(local, local) < room[local]]
+        slot_players[slots] = group
+        is_open[slots] = False
+
 
 def create_tournament_bracket(tournament_id: str, players_list: list[dict]) -> list[dict]:
     """
@@ -22,8 +265,10 @@ def create_tournament_bracket(tournament_id: str, players_list: list[dict]) -> l
                                    at least 'id' (str), 'school' (str), 'is_seeded' (bool).
 
     Returns:
-        list[dict]: A list of match dictionaries ready to be saved to Firestore.
-                    Matches do not contain next_match_id, structure is implicit.
+        list[dict]: A list of match dictionaries ready to be saved to Firestore,
+                    built from a heap-ordered Bracket. Matches do not contain
+                    next_match_id; next_match_index is the list index of the
+                    match the winner advances to.
     """
     # Use the provided players_list instead of querying
     # players = Player.query.filter_by(tournament_id=tournament_id).all()
@@ -46,244 +291,61 @@ def create_tournament_bracket(tournament_id: str, players_list: list[dict]) -> l
 
     logging.info(f"Generating bracket for {num_players} players, {num_rounds} rounds, {total_slots} slots, {num_byes} byes.")
 
-    # Group players by school for distribution
-    schools = defaultdict(list)
-    for player in players:
-        # Ensure player has expected keys
-        if not all(k in player for k in ('id', 'school', 'is_seeded', 'name')):
-             logging.error(f"Player data missing required keys: {player}")
-             # Handle error appropriately, maybe skip player or raise exception
-             continue
-        schools[player['school']].append(player)
-
-    # Separate seeded and non-seeded players (using dictionary access)
-    seeded_players = [p for p in players if p.get('is_seeded', False)]
-    non_seeded_players = [p for p in players if not p.get('is_seeded', False)]
-
-    # Create first round structure
-    player_positions = [None] * total_slots # Stores player dicts or None (for byes)
-
-    # 1. Place seeded players strategically (modify position calculation slightly)
-    # Ensure list index access is safe
-    seeded_placements = {}
-    # Simplified seeding placement: spread across quarters/halves
-    seed_order = [0, total_slots // 2, total_slots // 4, 3 * total_slots // 4]
-    seed_order += [i for i in range(total_slots) if i not in seed_order] # Fill remaining
-
-    seeded_players.sort(key=lambda p: p.get('name')) # Consistent order for tie-breaking
-
-    current_seed_idx = 0
-    placed_seed_count = 0
-    while placed_seed_count < len(seeded_players) and current_seed_idx < len(seed_order):
-         pos = seed_order[current_seed_idx]
-         if player_positions[pos] is None:
-             player_positions[pos] = seeded_players[placed_seed_count]
-             seeded_placements[pos] = seeded_players[placed_seed_count]
-             placed_seed_count += 1
-         current_seed_idx += 1
-
-    # Handle cases where seeded players couldn't fit in ideal spots (shouldn't happen if logic is right)
-    if placed_seed_count < len(seeded_players):
-        logging.warning("Could not place all seeded players optimally, placing remaining randomly.")
-        remaining_seeds = seeded_players[placed_seed_count:]
-        empty_slots_for_seed = [i for i, p in enumerate(player_positions) if p is None]
-        random.shuffle(empty_slots_for_seed)
-        for i, player in enumerate(remaining_seeds):
-            if i < len(empty_slots_for_seed):
-                pos = empty_slots_for_seed[i]
-                player_positions[pos] = player
-                seeded_placements[pos] = player
-            else:
-                 logging.error("Ran out of slots placing remaining seeds.") # Should not happen
-                 break
-
-    # 2. Distribute byes evenly (Place None)
-    # Place byes preferably against lower seeds or spread out
-    bye_positions_filled = 0
-    # Try placing against seeds first, starting from lowest if possible
-    bye_placement_order = sorted(seeded_placements.keys(), reverse=True) # Try opposite lowest seeds
-    for seed_pos in bye_placement_order:
-        if bye_positions_filled >= num_byes: break
-        # Find adjacent slot
-        adj_pos = seed_pos + 1 if seed_pos % 2 == 0 else seed_pos - 1
-        if 0 <= adj_pos < total_slots and player_positions[adj_pos] is None:
-            player_positions[adj_pos] = None # Place Bye (represented by None)
-            bye_positions_filled += 1
-
-    # Fill remaining byes in other available slots
-    if bye_positions_filled < num_byes:
-        available_slots_for_byes = [i for i, p in enumerate(player_positions) if p is None]
-        random.shuffle(available_slots_for_byes)
-        needed = num_byes - bye_positions_filled
-        for i in range(min(needed, len(available_slots_for_byes))):
-             player_positions[available_slots_for_byes[i]] = None
-             bye_positions_filled += 1
+    # Read the players a key at a time (players are handled by their index in
+    # players from here on). A missing key sends the list down the slower path
+    # that logs the players at fault.
+    required_keys = {'id', 'school', 'is_seeded', 'name'}
+    try:
+        player_ids = list(map(operator.itemgetter('id'), players))
+        school_names = list(map(operator.itemgetter('school'), players))
+        seeded_flags = list(map(operator.itemgetter('is_seeded'), players))
+        if not all(map(operator.contains, players, repeat('name'))):
+            raise KeyError('name')
+    except KeyError:
+        for player in players:
+            if not player.keys() >= required_keys:
+                logging.error(f"Player data missing required keys: {player}")
+        player_ids = [p['id'] for p in players]
+        school_names = [p['school'] for p in players]
+        seeded_flags = [p.get('is_seeded', False) for p in players]
+
+    # Separate seeded and non-seeded players. A school's code is the index of
+    # its first player.
+    is_seeded = np.fromiter(map(operator.truth, seeded_flags), dtype=bool, count=num_players)
+    school_of = np.fromiter(map({}.setdefault, school_names, count()), dtype=np.int64, count=num_players)
+
+    # Create first round structure: player index per slot, -1 for an empty slot or a bye
+    slot_players = np.full(total_slots, -1, dtype=np.int64)
+    open_slots = np.ones(total_slots, dtype=bool)
+
+    # 1. Place seeded players on the standard seeding template
+    # Seed ranks 1, 2, ... land in opposite halves, then quarters, and so on
+    template = seed_template(total_slots)
+    seeded_players = sorted(np.flatnonzero(is_seeded).tolist(), key=lambda i: players[i].get('name')) # Consistent order for tie-breaking
+    seed_slots = list(template[:len(seeded_players)])
+    slot_players[seed_slots] = seeded_players
+    open_slots[seed_slots] = False
+
+    # 2. Reserve bye slots (they stay empty)
+    # Byes take the template slots of the ranks past the last player, which
+    # pairs them with the top ranks and spreads them evenly over halves and
+    # quarters. A match never gets two byes since fewer than half the slots are byes.
+    open_slots[list(template[num_players:])] = False
 
     # 3. Distribute remaining non-seeded players with school separation
-    available_slots = [i for i, p in enumerate(player_positions) if p is None]
-    school_placements = defaultdict(list)
-    # Add seeded player positions to school_placements for separation logic
-    for pos, player in seeded_placements.items():
-        school_placements[player['school']].append(pos)
-
-    # Sort schools by size (largest first) to handle bigger schools first
-    sorted_schools = sorted(schools.items(), key=lambda item: len([p for p in item[1] if not p.get('is_seeded')]), reverse=True)
-
-    players_to_place = non_seeded_players.copy()
-    random.shuffle(players_to_place) # Randomize order within non-seeded
-
-    placed_count = 0
-    for player in players_to_place:
-        best_pos = -1
-        max_min_dist = -1
-
-        current_school = player['school']
-        occupied_by_school = school_placements[current_school]
-
-        if not occupied_by_school:
-            # First player from this school, try random available slot
-             if available_slots:
-                  best_pos = random.choice(available_slots)
-        else:
-            # Find slot furthest from others of the same school
-            for slot in available_slots:
-                # Calculate min distance to any player from the same school in the bracket circle
-                min_dist = float('inf')
-                for placed_pos in occupied_by_school:
-                     # Distance considering wrap-around might be better, but simple diff for now
-                     dist = abs(slot - placed_pos)
-                     # Alternative: dist = min(abs(slot - placed_pos), total_slots - abs(slot - placed_pos))
-                     min_dist = min(min_dist, dist)
-
-                if min_dist > max_min_dist:
-                     max_min_dist = min_dist
-                     best_pos = slot
-                elif min_dist == max_min_dist:
-                     # Tie-break randomly or prefer lower index?
-                     if best_pos == -1 or random.random() < 0.5:
-                          best_pos = slot
-
-        # Fallback if no best_pos found (e.g., only one slot left)
-        if best_pos == -1 and available_slots:
-             best_pos = random.choice(available_slots)
-
-        if best_pos != -1:
-             player_positions[best_pos] = player
-             school_placements[current_school].append(best_pos)
-             available_slots.remove(best_pos)
-             placed_count += 1
-        else:
-             logging.error(f"Could not find position for player {player['id']} from {player['school']} - available slots: {len(available_slots)}")
-             # This shouldn't happen if logic is correct
+    _place_by_school(slot_players, open_slots, np.flatnonzero(~is_seeded), school_of)
 
     # Final check if all slots are filled (except expected byes)
-    filled_slots = sum(1 for p in player_positions if p is not None)
+    filled_slots = np.count_nonzero(slot_players >= 0)
     if filled_slots != num_players:
         logging.error(f"Mismatch in placed players: Expected {num_players}, Got {filled_slots}")
 
-    # --- Create Match Dictionaries --- 
-    matches_data = []
-    round1_matches_count = total_slots // 2
-
-    # Create match dictionaries for the first round
-    for i in range(round1_matches_count):
-        pos1 = i * 2
-        pos2 = i * 2 + 1
-        player1_dict = player_positions[pos1]
-        player2_dict = player_positions[pos2]
-
-        player1_id = player1_dict['id'] if player1_dict else None
-        player2_id = player2_dict['id'] if player2_dict else None
-
-        winner_id = None
-        match_status = 'pending'
-        # Auto-advance if there's a bye
-        if player1_id and not player2_id:
-            winner_id = player1_id
-            match_status = 'completed'
-        elif player2_id and not player1_id:
-            winner_id = player2_id
-            match_status = 'completed'
-        elif not player1_id and not player2_id:
-            # This shouldn't happen with correct bye logic, but handle defensively
-            logging.warning(f"Match {i+1} in round 1 has two byes.")
-            match_status = 'completed' # Or maybe 'invalid'
-
-        match_dict = {
-            'tournament_id': tournament_id,
-            'round_number': 1,
-            'match_number': i + 1, # 1-based index within the round
-            'player1_id': player1_id, # Store ID (string)
-            'player2_id': player2_id, # Store ID (string)
-            'winner_id': winner_id,  # Store ID (string) or None
-            # 'next_match_id': None, # Will be populated later
-            'next_match_index': None, # Placeholder for linking before IDs exist
-            'status': match_status # pending, completed
-        }
-        matches_data.append(match_dict)
-
-    # Create placeholder match dictionaries for subsequent rounds
-    match_counter_in_round = 0
-    matches_in_prev_round = round1_matches_count
-    for round_num in range(2, num_rounds + 1):
-        matches_in_round = matches_in_prev_round // 2
-        for i in range(matches_in_round):
-             match_dict = {
-                'tournament_id': tournament_id,
-                'round_number': round_num,
-                'match_number': i + 1,
-                'player1_id': None,
-                'player2_id': None,
-                'winner_id': None,
-                # 'next_match_id': None, # Will be populated later
-                'next_match_index': None, # Placeholder for linking before IDs exist
-                'status': 'pending' # Initially pending until players advance
-            }
-             matches_data.append(match_dict)
-        matches_in_prev_round = matches_in_round
-
-    # Removed database saving logic (db.session.add_all, flush, etc.)
-    # Removed logic that linked matches using next_match_id based on DB IDs
-    # --- Link matches using indices (before Firestore IDs exist) ---
-    match_index_map = {(m['round_number'], m['match_number']): i for i, m in enumerate(matches_data)}
-
-    for i, match in enumerate(matches_data):
-        current_round = match['round_number']
-        current_match_num = match['match_number']
-
-        if current_round < num_rounds: # Not the final round
-            next_round = current_round + 1
-            # The winner of match 'k' in round 'r' goes to match ceil(k/2) in round 'r+1'
-            next_match_num = math.ceil(current_match_num / 2)
-            next_match_key = (next_round, next_match_num)
-
-            if next_match_key in match_index_map:
-                matches_data[i]['next_match_index'] = match_index_map[next_match_key]
-            else:
-                logging.warning(f"Could not find next match index for R{current_round} M{current_match_num} -> R{next_round} M{next_match_num}")
-
-    # Auto-advance winners from Round 1 byes
-    # This needs to happen *after* next_match_index is set
-    for i, match in enumerate(matches_data):
-        if match['round_number'] == 1 and match['status'] == 'completed' and match['winner_id'] is not None:
-            winner_id = match['winner_id']
-            next_idx = match.get('next_match_index')
-
-            if next_idx is not None and 0 <= next_idx < len(matches_data):
-                next_match = matches_data[next_idx]
-                # Determine if winner goes to player1 or player2 slot based on current match number
-                if match['match_number'] % 2 != 0: # Odd match number -> player1 slot
-                    if next_match['player1_id'] is None: # Avoid overwriting
-                        next_match['player1_id'] = winner_id
-                else: # Even match number -> player2 slot
-                    if next_match['player2_id'] is None:
-                        next_match['player2_id'] = winner_id
-
-                # Update next match status if both players are now present
-                if next_match['player1_id'] is not None and next_match['player2_id'] is not None:
-                    next_match['status'] = 'pending' # Ready to play
-            elif next_idx is not None:
-                 logging.warning(f"Invalid next_match_index {next_idx} calculated for match {i}")
+    # --- Build the bracket ---
+    # The heap-ordered model links every match to the next one by index
+    # arithmetic and advances players with a first-round bye.
+    bracket = Bracket.from_slot_codes(player_ids, slot_players.tolist())
+    with _gc_paused():
+        matches_data = bracket.to_match_dicts(tournament_id)
 
     logging.info(f"Generated and linked {len(matches_data)} match structures for tournament {tournament_id}")
     return matches_data
@@ -295,23 +357,29 @@ def create_tournament_bracket(tournament_id: str, players_list: list[dict]) -> l
 def update_match_result(match_id: str, winner_id: str) -> bool:
     """
     Update match result and handle advancement logic.
-    This is a wrapper function that delegates to routes.py implementation.
-    
+
     Args:
         match_id (str): The ID of the match to update.
-        winner_id (str): The ID of the winning player.
+        winner_id (str): The ID of the winning player (None clears the result).
         
     Returns:
         bool: True if update was successful, False otherwise.
     """
-    logging.warning("update_match_result called from tournament.py - this is a stub function")
-    # This is just a stub to satisfy imports
-    # The actual implementation is in routes.py
-    return True
+    repo = get_repository()
+    if repo is None:
+        logging.error("Storage backend not available in update_match_result")
+        return False
+    try:
+        tournament_id = repo.record_result(match_id, winner_id)
+        bracket_cache.invalidate(tournament_id)
+        return True
+    except (NotFoundError, ValueError) as e:
+        logging.error(f"Error updating match {match_id}: {e}")
+        return False
 
 def get_tournament_bracket(tournament_id: str) -> dict:
     """
-    Fetch matches and players from Firestore and structure data for the bracket view.
+    Fetch matches and players from storage and structure data for the bracket view.
 
     Args:
         tournament_id (str): The ID of the tournament.
@@ -327,95 +395,196 @@ def get_tournament_bracket(tournament_id: str) -> dict:
                       'player_id1': {'name': '...', 'school': '...'},
                       ...
                   },
+                  'version': bracket version the data is at least as new as,
                   'error': None or 'Error message'
               }
     """
-    if not db_firestore:
-        logging.error("Firestore client not available in get_tournament_bracket")
-        return {'rounds': {}, 'players': {}, 'error': 'Database connection not available. Please try again later.'}
+    bracket_data, cached = _bracket_payload(tournament_id)
+    if bracket_data is None:
+        # Served from the cache; decoding gives the caller its own copy
+        bracket_data = json.loads(cached.body)
+        bracket_data['rounds'] = {int(round_number): matches for round_number, matches in bracket_data['rounds'].items()}
+    return bracket_data
 
-    bracket_data = {'rounds': {}, 'players': {}, 'error': None}
+def get_tournament_bracket_json(tournament_id: str, tournament: dict | None = None) -> CachedBracket:
+    """
+    Same payload as get_tournament_bracket, JSON-encoded for the API.
+
+    Served from bracket_cache while the tournament's bracket_version is unchanged.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        tournament (dict | None): The tournament record, if the caller has
+                                  just read it (saves reading it again).
+
+    Returns:
+        CachedBracket: The encoded payload in 'body'; 'error' is set if the
+                       payload is an error message.
+    """
+    return _bracket_payload(tournament_id, tournament)[1]
+
+def get_tournament_bracket_delta_json(tournament_id: str, since: int) -> bytes:
+    """
+    Matches changed since a bracket version, JSON-encoded for the API.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        since (int): The 'version' of the bracket data the client has.
+
+    Returns:
+        bytes: {'version': current version, 'since': since, 'full_reload': bool,
+                'matches': [changed matches, in the format of get_tournament_bracket]}.
+               'full_reload' is True when the bracket was regenerated or its
+               players changed after `since` (or `since` is unknown); the client
+               should then fetch the whole bracket. Errors come back as
+               {'error': message, 'full_reload': True}.
+    """
+    repo = get_repository()
+    tournament, error = _read_tournament(repo, tournament_id)
+    if error:
+        return _dumps({'error': error, 'full_reload': True})
+
+    version = tournament.get(BRACKET_VERSION_FIELD, 0)
+    reset_version = tournament.get(BRACKET_RESET_FIELD, 0)
+    head = {'version': version, 'since': since}
+    if since < reset_version or since > version:
+        return _dumps({**head, 'full_reload': True, 'matches': [], 'error': None})
+    if since == version:
+        return _dumps({**head, 'full_reload': False, 'matches': [], 'error': None})
+
+    _, cached = bracket_cache.load(tournament_id, version, lambda: _build_bracket_payload(repo, tournament))
+    if cached.error:
+        return _dumps({'error': cached.error, 'full_reload': True})
+    # Cut the changed matches straight out of the cached payload
+    head_bytes = _dumps({**head, 'full_reload': False, 'error': None})
+    return head_bytes[:-1] + b',"matches":[' + b','.join(cached.changed_since(since)) + b']}'
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _encode_payload(bracket_data: dict, reset_version: int = 0) -> CachedBracket:
+    """
+    Encode a bracket payload, noting the byte range of every match stamped after reset_version.
+
+    The JSON is assembled match by match so deltas can later be sliced out of
+    the cached body instead of decoding it again.
+    """
+    chunks = [b'{"rounds":{']
+    offset = len(chunks[0])
+    changes = []
+    for index, (round_number, matches) in enumerate(bracket_data['rounds'].items()):
+        chunk = f'{"," if index else ""}"{round_number}":['.encode('utf-8')
+        for match_index, match in enumerate(matches):
+            if match_index:
+                chunk += b','
+            chunks.append(chunk)
+            offset += len(chunk)
+            encoded = _dumps(match)
+            if match.get('version', 0) > reset_version:
+                changes.append((match['version'], offset, offset + len(encoded)))
+            chunks.append(encoded)
+            offset += len(encoded)
+            chunk = b''
+        chunks.append(chunk + b']')
+        offset += len(chunk) + 1
+    rest = _dumps({key: value for key, value in bracket_data.items() if key != 'rounds'})
+    chunks.append(b'}}' if rest == b'{}' else b'},' + rest[1:])
+    return CachedBracket(b''.join(chunks), changes, bracket_data.get('error'))
+
+def _read_tournament(repo, tournament_id: str) -> tuple[dict | None, str | None]:
+    """Fetch a tournament for the bracket API; returns (tournament, None) or (None, error message)."""
+    if repo is None:
+        logging.error("Storage backend not available in get_tournament_bracket")
+        return None, 'Database connection not available. Please try again later.'
     try:
-        # 1. Validate tournament exists
-        tournament_ref = db_firestore.collection('tournaments').document(tournament_id)
-        tournament_doc = tournament_ref.get()
-        
-        if not tournament_doc.exists:
-            logging.error(f"Tournament {tournament_id} does not exist")
-            return {'rounds': {}, 'players': {}, 'error': 'Tournament not found. It may have been deleted.'}
-            
-        # 2. Get all players for the tournament
-        players_ref = db_firestore.collection('players').where('tournament_id', '==', tournament_id)
-        player_docs = players_ref.stream()
-        players_dict = {}
-        for doc in player_docs:
-            player_data = doc.to_dict()
-            # Include only necessary info for bracket display
-            players_dict[doc.id] = {
-                 'name': player_data.get('name', 'Unknown'),
-                 'school': player_data.get('school', '')
-            }
+        tournament = repo.get_tournament(tournament_id)
+    except Exception as e:
+        logging.error(f"Error fetching tournament {tournament_id}: {e}", exc_info=True)
+        return None, f"Error retrieving bracket data: {str(e)[:100]}... (Please contact administrator)"
+    if tournament is None:
+        logging.error(f"Tournament {tournament_id} does not exist")
+        bracket_cache.invalidate(tournament_id)
+        return None, 'Tournament not found. It may have been deleted.'
+    return tournament, None
+
+def _bracket_payload(tournament_id: str, tournament: dict | None = None) -> tuple[dict | None, CachedBracket]:
+    """
+    Return (payload, encoded payload); payload is None when it came from the cache.
+
+    Costs one tournament read on a cache hit (none if `tournament` is given).
+    Concurrent misses for the same version share one load (see bracket_cache).
+    """
+    repo = get_repository()
+    # 1. Validate tournament exists
+    error = None
+    if tournament is None:
+        tournament, error = _read_tournament(repo, tournament_id)
+    if error:
+        bracket_data = {'rounds': {}, 'players': {}, 'error': error}
+        return bracket_data, _encode_payload(bracket_data)
+
+    # The version is read before the bracket, so a cached payload is never older than its version
+    version = tournament.get(BRACKET_VERSION_FIELD, 0)
+    return bracket_cache.load(tournament_id, version, lambda: _build_bracket_payload(repo, tournament))
+
+def _build_bracket_payload(repo, tournament: dict) -> tuple[dict, CachedBracket, bool]:
+    """Load a tournament's bracket and players; returns (payload, encoded payload, cacheable)."""
+    tournament_id = tournament['id']
+    bracket_data = {'rounds': {}, 'players': {}, 'version': tournament.get(BRACKET_VERSION_FIELD, 0), 'error': None}
+    try:
+        # 2. Get players and matches
+        bracket, players_dict = repo.load_bracket(tournament)
         bracket_data['players'] = players_dict
-        logging.debug(f"Fetched {len(players_dict)} players for bracket {tournament_id}")
-        
+
         if not players_dict:
             logging.info(f"No players found for tournament {tournament_id}")
             # Return empty data without error - frontend will handle as "no players" message
-            return bracket_data
-
-        # 3. Get all matches for the tournament, ordered by round and match number
-        matches_ref = db_firestore.collection('matches')\
-                                .where('tournament_id', '==', tournament_id)\
-                                .order_by('round_number')\
-                                .order_by('match_number')
-        
-        # Convert to list for easier counting and iteration
-        match_docs_list = list(matches_ref.stream())
-        logging.debug(f"Firestore query for matches returned {len(match_docs_list)} documents for tournament {tournament_id}")
-        
-        if not match_docs_list:
+        elif bracket is None:
             logging.info(f"No matches found for tournament {tournament_id}")
             # Return empty data without error - frontend will handle as "need to generate bracket" message
-            return bracket_data
+        else:
+            # 3. Organize matches by round and add player names and schools
+            rounds = _bracket_rounds(bracket, players_dict, tournament_id)
+            bracket_data['rounds'] = rounds
 
-        # Organize matches by round
-        rounds = defaultdict(list)
-        processed_count = 0
-        
-        for doc in match_docs_list:
-            try:
-                match_data = doc.to_dict()
-                match_data['id'] = doc.id # Add Firestore document ID
-                
-                # Add player names
-                p1_id = match_data.get('player1_id')
-                p2_id = match_data.get('player2_id')
-                w_id = match_data.get('winner_id')
-
-                match_data['player1_name'] = players_dict.get(p1_id, {}).get('name') if p1_id else None
-                match_data['player2_name'] = players_dict.get(p2_id, {}).get('name') if p2_id else None
-                match_data['winner_name'] = players_dict.get(w_id, {}).get('name') if w_id else None
-                
-                # Add player school information
-                match_data['player1_school'] = players_dict.get(p1_id, {}).get('school') if p1_id else None
-                match_data['player2_school'] = players_dict.get(p2_id, {}).get('school') if p2_id else None
-
-                round_num = match_data.get('round_number')
-                if round_num is not None:
-                    rounds[round_num].append(match_data)
-                    processed_count += 1
-                else:
-                    logging.warning(f"Match {doc.id} missing or has null round_number for tournament {tournament_id}. Skipping.")
-            except Exception as process_error:
-                logging.error(f"Error processing match document {doc.id}: {process_error}", exc_info=True)
-                # Continue processing other matches
-
-        bracket_data['rounds'] = dict(rounds) # Convert defaultdict to dict
-        
-        logging.debug(f"Finished processing. Added matches to {len(rounds)} rounds. Total matches processed: {processed_count} for bracket {tournament_id}")
+            logging.debug(f"Finished processing. Added matches to {len(rounds)} rounds. Total matches processed: {sum(map(len, rounds.values()))} for bracket {tournament_id}")
 
     except Exception as e:
         logging.error(f"Error fetching bracket data for tournament {tournament_id}: {e}", exc_info=True)
         bracket_data['error'] = f"Error retrieving bracket data: {str(e)[:100]}... (Please contact administrator)"
 
-    return bracket_data
+    return bracket_data, _encode_payload(bracket_data, tournament.get(BRACKET_RESET_FIELD, 0)), bracket_data['error'] is None
+
+def _bracket_rounds(bracket: Bracket, players_dict: dict, tournament_id: str) -> dict:
+    """Matches of a bracket grouped by round, with player names and schools added."""
+    rounds = {}
+    for match_data in bracket.to_match_dicts(tournament_id):
+        if 'id' not in match_data:
+            continue # No stored match at this position
+        match_data.pop('next_match_index', None)
+        for prefix in ('player1', 'player2', 'winner'):
+            player = players_dict.get(match_data[f'{prefix}_id'], {})
+            match_data[f'{prefix}_name'] = player.get('name')
+            if prefix != 'winner':
+                match_data[f'{prefix}_school'] = player.get('school')
+        rounds.setdefault(match_data['round_number'], []).append(match_data)
+    return rounds
+
+def get_bracket_preview(tournament_id: str, matches: list[dict], players_dict: dict, match_id_prefix: str) -> dict:
+    """
+    Structure a draft bracket that was never stored like get_tournament_bracket.
+
+    Args:
+        tournament_id (str): The ID of the tournament.
+        matches (list[dict]): Output of create_tournament_bracket.
+        players_dict (dict): Player ID to {'name', 'school'}.
+        match_id_prefix (str): Matches get the placeholder ID '<prefix>.<node>',
+                               since the draft has no stored IDs yet.
+
+    Returns:
+        dict: {'rounds', 'players', 'version': None, 'error': None}.
+    """
+    bracket = Bracket.from_match_dicts(matches)
+    bracket.match_ids = [None] + [f"{match_id_prefix}.{node}" for node in range(1, bracket.total_slots)]
+    return {'rounds': _bracket_rounds(bracket, players_dict, tournament_id), 'players': players_dict,
+            'version': None, 'error': None}